@@ -0,0 +1,35 @@
+"""
+Fill last_sets with the latest finished set of every user and exercise from the sets table.
+New trainings keep last_sets up to date when they end, so this is needed once after
+migration 008. Users are processed in id ranges, one short transaction per batch,
+and running it again is safe: a newer entry is never replaced by an older set.
+
+Usage:
+    python backfill_last_sets.py [--batch 500]
+"""
+import argparse
+import time
+
+from models import db, LastSet, Set, User
+
+
+def backfill(batch):
+    last_user_id = User.select(User.id).order_by(User.id.desc()).scalar() or 0
+    total = 0
+    started = time.perf_counter()
+    for first in range(0, last_user_id + 1, batch):
+        with db.atomic():
+            total += len(LastSet.record(Set.user >= first, Set.user < first + batch))
+        print(f'users up to {min(first + batch - 1, last_user_id)}: {total} entries')
+    print(f'{total} entries written in {time.perf_counter() - started:.1f} s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', type=int, default=500, help='users per transaction')
+    args = parser.parse_args()
+    backfill(args.batch)
+
+
+if __name__ == '__main__':
+    main()
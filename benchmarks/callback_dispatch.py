@@ -0,0 +1,85 @@
+"""
+Cost of finding the controller for a callback query.
+
+A synthetic comparison: the "patterns" side is not the old dispatch itself but a stand-in
+for its layout - one CallbackQueryHandler per controller, checked one by one until a pattern
+matches - built from today's route table. The old handlers matched other patterns against
+callback data resolved through the arbitrary callback data cache, so the numbers show
+the cost of that layout, not a measurement of the previous code. It is compared with the
+CallbackRouter lookup by route key (decoding of the compact callback data included),
+on the callback data the bot actually produces, from the first registered route to the last one.
+
+Usage:
+    python -m benchmarks.callback_dispatch --number 100000
+"""
+import argparse
+import re
+import timeit
+from datetime import datetime
+
+from telegram import CallbackQuery, Chat, Message, Update, User as TelegramUser
+from telegram.ext import CallbackQueryHandler
+
+from constants import ActivityLevelCoefficients, Genders, Routes
+from logic.router import SEPARATOR, route_data
+from main import build_router
+
+
+CALLBACK_DATA = {
+    'menu first': 'start_training',
+    'exercise tools': route_data(Routes.ExerciseTools, group=4),
+    'exercise': route_data(Routes.Exercise, exercise=153),
+    'start exercise': route_data(Routes.StartExercise, exercise=153),
+    'calculator params': route_data(Routes.CalculatorParams,
+                                    gender=Genders.Man,
+                                    activity_level=ActivityLevelCoefficients[0]),
+    'next program day': route_data(Routes.NextProgramDay, program=7),
+    'menu last': 'menu',
+}
+
+
+def _update(data):
+    user = TelegramUser(id=1, first_name='bench', is_bot=False)
+    message = Message(message_id=1, date=datetime.now(), chat=Chat(id=1, type=Chat.PRIVATE))
+    return Update(update_id=1,
+                  callback_query=CallbackQuery(id='1',
+                                               from_user=user,
+                                               chat_instance='1',
+                                               message=message,
+                                               data=data))
+
+
+def _legacy_handlers(router):
+    # synthetic: a pattern handler per route of the current table, in registration order
+    return [CallbackQueryHandler(callback, pattern=f'^{re.escape(route)}(?:{SEPARATOR}|$)')
+            for route, callback in router._routes.items()]
+
+
+def _legacy_dispatch(handlers, update):
+    for handler in handlers:
+        if handler.check_update(update):
+            return handler.callback
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=100000)
+    args = parser.parse_args()
+
+    router = build_router(None)
+    handlers = _legacy_handlers(router)
+
+    print('synthetic comparison: pattern handlers built from the current route table vs the router')
+    for name, data in CALLBACK_DATA.items():
+        update = _update(data)
+        assert _legacy_dispatch(handlers, update) is router.resolve(data), name
+
+        legacy = timeit.timeit(lambda: _legacy_dispatch(handlers, update), number=args.number)
+        routed = timeit.timeit(lambda: router.resolve(update.callback_query.data), number=args.number)
+        print(f'{name:>18}: synthetic patterns {legacy / args.number * 1e6:7.2f} us, '
+              f'router {routed / args.number * 1e6:5.2f} us '
+              f'({legacy / routed:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
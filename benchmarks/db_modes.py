@@ -0,0 +1,65 @@
+"""
+Updates per second under concurrent load for every DB mode.
+
+Every simulated update does what a typical handler does: one unit of db work
+(user lookup + a query with configurable server latency) followed by an awaited
+Telegram call (simulated with asyncio.sleep).
+
+Usage:
+    python -m benchmarks.db_modes --updates 2000 --concurrency 200 --query-ms 5 --telegram-ms 50
+"""
+import argparse
+import asyncio
+import time
+
+from constants import DBModes
+from models import (
+    db,
+    run_db,
+    set_db_mode,
+    shutdown_db_executor,
+    User
+)
+
+
+def _db_unit(query_ms):
+    User.select().order_by(User.id).first()
+    db.execute_sql('SELECT pg_sleep(%s)', (query_ms / 1000,))
+
+
+async def _update(query_ms, telegram_ms, semaphore):
+    async with semaphore:
+        await run_db(_db_unit, query_ms)
+        await asyncio.sleep(telegram_ms / 1000)
+
+
+async def _run(mode, updates, concurrency, query_ms, telegram_ms):
+    set_db_mode(mode)
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+    await asyncio.gather(*[_update(query_ms, telegram_ms, semaphore) for _ in range(updates)])
+    elapsed = time.perf_counter() - started
+    shutdown_db_executor()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--query-ms', type=float, default=5)
+    parser.add_argument('--telegram-ms', type=float, default=50)
+    args = parser.parse_args()
+
+    for mode in DBModes.all():
+        elapsed = asyncio.run(_run(mode,
+                                   args.updates,
+                                   args.concurrency,
+                                   args.query_ms,
+                                   args.telegram_ms))
+        print(f'{mode:>8}: {args.updates} updates in {elapsed:.2f} s -> '
+              f'{args.updates / elapsed:.1f} updates/s')
+
+
+if __name__ == '__main__':
+    main()
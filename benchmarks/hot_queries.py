@@ -0,0 +1,159 @@
+"""
+Query plans and timings of the set logging / training history queries
+without and with the indexes of migration 007.
+
+A synthetic dataset (users x trainings x sets, 4M sets by default) is generated
+in a scratch schema of the configured database, the schema is dropped afterwards.
+Ids grow with time across all users, like in production, so rows of one user are
+spread over the whole table.
+
+Usage:
+    python -m benchmarks.hot_queries --users 20000 --trainings 25 --sets 8 --runs 200
+"""
+import argparse
+import importlib
+import random
+import statistics
+import time
+
+import psycopg2
+
+from config import DB_CONFIG
+
+SCHEMA = 'bench_hot_queries'
+EXERCISES = 150
+
+QUERIES = {
+    'previous set': ('SELECT data FROM sets '
+                     'WHERE user_id = %(user_id)s AND exercise_id = %(exercise_id)s AND "end" IS NOT NULL '
+                     'ORDER BY id DESC LIMIT 1'),
+    'open training': ('SELECT id FROM trainings '
+                      'WHERE user_id = %(user_id)s AND "end" IS NULL LIMIT 1'),
+    'open set': ('SELECT id, data FROM sets '
+                 'WHERE user_id = %(user_id)s AND training_id = %(training_id)s '
+                 'AND exercise_id = %(exercise_id)s AND "end" IS NULL LIMIT 1'),
+    'training sets': 'SELECT * FROM sets WHERE training_id = %(training_id)s',
+    'training history': ('SELECT * FROM trainings '
+                         'WHERE user_id = %(user_id)s AND "end" IS NOT NULL '
+                         'ORDER BY id DESC LIMIT 5'),
+}
+
+
+def _connect():
+    connection = psycopg2.connect(dbname=DB_CONFIG['database'],
+                                  user=DB_CONFIG['user'],
+                                  password=DB_CONFIG['password'],
+                                  host=DB_CONFIG['host'],
+                                  port=DB_CONFIG['port'])
+    connection.autocommit = True
+    return connection
+
+
+def create_dataset(cursor, users, trainings, sets):
+    cursor.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {SCHEMA}')
+    cursor.execute(f'SET search_path TO {SCHEMA}')
+    cursor.execute('CREATE TABLE trainings (id serial PRIMARY KEY, user_id integer NOT NULL, '
+                   'created timestamp NOT NULL, "end" timestamp)')
+    cursor.execute('CREATE TABLE sets (id serial PRIMARY KEY, user_id integer NOT NULL, '
+                   'exercise_id integer NOT NULL, training_id integer NOT NULL, data jsonb NOT NULL, '
+                   'created timestamp NOT NULL, "end" timestamp)')
+    # the last training of every tenth user is still open
+    cursor.execute('INSERT INTO trainings (user_id, created, "end") '
+                   'SELECT u, now() - t * interval \'1 day\', '
+                   'CASE WHEN t = 1 AND u %% 10 = 0 THEN NULL '
+                   'ELSE now() - t * interval \'1 day\' + interval \'1 hour\' END '
+                   'FROM generate_series(1, %s) t, generate_series(1, %s) u '
+                   'ORDER BY t DESC, u',
+                   (trainings, users))
+    cursor.execute('INSERT INTO sets (user_id, exercise_id, training_id, data, created, "end") '
+                   'SELECT tr.user_id, 1 + floor(random() * %s)::integer, tr.id, '
+                   '\'[{"reps": 10, "weight": 50, "timestamp": 0}]\', '
+                   'tr.created + s * interval \'5 minutes\', '
+                   'CASE WHEN tr."end" IS NULL THEN NULL ELSE tr.created + s * interval \'5 minutes\' END '
+                   'FROM trainings tr, generate_series(1, %s) s '
+                   'ORDER BY tr.id, s',
+                   (EXERCISES, sets))
+    # what the tables have without migration 007: primary keys and the foreign key indexes
+    for table, column in (('sets', 'user_id'), ('sets', 'exercise_id'), ('sets', 'training_id'),
+                          ('trainings', 'user_id')):
+        cursor.execute(f'CREATE INDEX {table}_{column}_fk ON {table} ({column})')
+    cursor.execute('ANALYZE')
+
+
+def create_indexes(cursor):
+    migration = importlib.import_module('migrations.007_add_hot_path_indexes')
+    for name, table, definition in migration.INDEXES:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} {definition}')
+    cursor.execute('ANALYZE')
+
+
+def _parameters(cursor, number):
+    cursor.execute('SELECT user_id, id FROM trainings WHERE "end" IS NULL')
+    open_trainings = cursor.fetchall()
+    cursor.execute('SELECT max(id), max(user_id) FROM trainings')
+    max_training, max_user = cursor.fetchone()
+    parameters = []
+    for _ in range(number):
+        user_id, training_id = random.choice(open_trainings)
+        parameters.append(dict(user_id=user_id,
+                               exercise_id=random.randint(1, EXERCISES),
+                               training_id=training_id))
+    # history and finished sets are asked for every user, not only training ones
+    for item in parameters[::2]:
+        item['user_id'] = random.randint(1, max_user)
+    return parameters
+
+
+def measure(cursor, runs, show_plans):
+    parameters = _parameters(cursor, runs)
+    for name, query in QUERIES.items():
+        if show_plans:
+            cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + query, parameters[0])
+            print(f'--- {name}')
+            print('\n'.join(row[0] for row in cursor.fetchall()))
+        timings = []
+        for item in parameters:
+            started = time.perf_counter()
+            cursor.execute(query, item)
+            cursor.fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f'{name:>16}: median {statistics.median(timings):.3f} ms, '
+              f'p95 {timings[int(len(timings) * 0.95) - 1]:.3f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--trainings', type=int, default=25, help='trainings per user')
+    parser.add_argument('--sets', type=int, default=8, help='sets per training')
+    parser.add_argument('--runs', type=int, default=200, help='executions of every query')
+    parser.add_argument('--no-plans', action='store_true')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch schema')
+    args = parser.parse_args()
+
+    connection = _connect()
+    try:
+        with connection.cursor() as cursor:
+            started = time.perf_counter()
+            create_dataset(cursor, args.users, args.trainings, args.sets)
+            print(f'{args.users * args.trainings * args.sets} sets generated '
+                  f'in {time.perf_counter() - started:.1f} s')
+
+            print('\n=== foreign key indexes only')
+            measure(cursor, args.runs, not args.no_plans)
+
+            started = time.perf_counter()
+            create_indexes(cursor)
+            print(f'\n=== with migration 007 indexes (built in {time.perf_counter() - started:.1f} s)')
+            measure(cursor, args.runs, not args.no_plans)
+
+            if not args.keep:
+                cursor.execute(f'DROP SCHEMA {SCHEMA} CASCADE')
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+POST updates to a running webhook and measure how fast they are accepted.
+
+Updates come from a JSON lines file (one Telegram Update object per line, e.g. the
+`result` items of getUpdates) or, without --updates, are generated: a mix of menu taps
+and set messages from --chats different chats. update_id is renumbered so the bot
+does not drop them as already seen.
+
+Start the bot with APP_UPDATES_MODE=webhook first. Generated chats do not exist,
+so the handlers' Telegram calls fail - this measures ingestion, not handling.
+
+Usage:
+    python -m benchmarks.post_updates --url http://127.0.0.1:8443/telegram --secret-token ... \\
+        --updates recorded.jsonl --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from itertools import count, cycle
+
+import httpx
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def _user(chat_id):
+    return {'id': chat_id, 'is_bot': False, 'first_name': f'bench{chat_id}'}
+
+
+def _synthetic_updates(number, chats):
+    now = int(time.time())
+    for i in range(number):
+        chat_id = 10 ** 9 + i % chats
+        if i % 2:
+            yield {'callback_query': {'id': str(i),
+                                      'from': _user(chat_id),
+                                      'chat_instance': str(chat_id),
+                                      'message': {'message_id': i,
+                                                  'date': now,
+                                                  'chat': {'id': chat_id, 'type': 'private'},
+                                                  'text': 'menu'},
+                                      'data': 'start_training'}}
+        else:
+            yield {'message': {'message_id': i,
+                               'date': now,
+                               'from': _user(chat_id),
+                               'chat': {'id': chat_id, 'type': 'private'},
+                               'text': '10 50'}}
+
+
+def _recorded_updates(path, number):
+    with open(path) as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    for _, update in zip(range(number), cycle(updates)):
+        yield update
+
+
+async def _post(client, url, headers, queue, latencies, statuses):
+    while True:
+        update = await queue.get()
+        started = time.perf_counter()
+        try:
+            response = await client.post(url, json=update, headers=headers)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        except httpx.HTTPError as e:
+            statuses[type(e).__name__] = statuses.get(type(e).__name__, 0) + 1
+        latencies.append(time.perf_counter() - started)
+        queue.task_done()
+
+
+async def _run(args):
+    if args.updates:
+        updates = _recorded_updates(args.updates, args.number)
+    else:
+        updates = _synthetic_updates(args.number, args.chats)
+
+    queue = asyncio.Queue()
+    update_ids = count(int(time.time()))
+    for update in updates:
+        queue.put_nowait(dict(update, update_id=next(update_ids)))
+    total = queue.qsize()
+
+    headers = {SECRET_TOKEN_HEADER: args.secret_token} if args.secret_token else {}
+    latencies, statuses = [], {}
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        started = time.perf_counter()
+        workers = [asyncio.create_task(_post(client, args.url, headers, queue, latencies, statuses))
+                   for _ in range(args.concurrency)]
+        await queue.join()
+        elapsed = time.perf_counter() - started
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    latencies.sort()
+    print(f'{total} updates in {elapsed:.2f} s -> {total / elapsed:.1f} updates/s')
+    print(f'latency ms: p50 {statistics.median(latencies) * 1000:.1f}, '
+          f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}, '
+          f'max {latencies[-1] * 1000:.1f}')
+    print(f'responses: {statuses}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    parser.add_argument('--secret-token')
+    parser.add_argument('--updates', help='JSON lines file with recorded updates')
+    parser.add_argument('--number', type=int, default=5000)
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=40)
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+    asyncio.run(_run(args))
+
+
+if __name__ == '__main__':
+    main()
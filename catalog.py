@@ -0,0 +1,155 @@
+import asyncio
+import threading
+import traceback
+import typing
+from collections import defaultdict
+from types import MappingProxyType
+
+from constants import Languages
+from models import (
+    db,
+    db_connect_wrapper,
+    listen_connection,
+    run_db,
+    MuscleGroup,
+    Tool,
+    Exercise,
+    MediaVariant
+)
+from utils import logger
+
+CATALOG_CHANNEL = 'catalog'
+
+
+def _ordered(items):
+    return tuple(sorted(items, key=lambda item: (item.order, item.created, item.id)))
+
+
+def _names(items) -> MappingProxyType:
+    return MappingProxyType({lang: MappingProxyType({item.id: item.get_name(lang) for item in items})
+                             for lang in Languages.all()})
+
+
+class CatalogSnapshot:
+    """
+    muscle groups, tools, exercises and their video variants as of one catalog version with the lookups
+    the training menus need. Built once and never changed - a new version is a new snapshot
+    """
+
+    def __init__(self, version, groups, tools, exercises, media_variants=()):
+        self.version = version
+        self.groups = _ordered(groups)
+        self.group_by_id = MappingProxyType({group.id: group for group in groups})
+        self.tool_by_id = MappingProxyType({tool.id: tool for tool in tools})
+        self.exercise_by_id = MappingProxyType({exercise.id: exercise for exercise in exercises})
+        self.exercise_by_unique_id = MappingProxyType({exercise.unique_id: exercise for exercise in exercises})
+
+        group_tools = defaultdict(set)
+        group_tool_exercises = defaultdict(list)
+        for exercise in exercises:
+            # relations point to the snapshot's own objects, so they never hit the database
+            exercise.group = self.group_by_id[exercise.group_id]
+            exercise.tool = self.tool_by_id[exercise.tool_id]
+            group_tools[exercise.group_id].add(exercise.tool)
+            group_tool_exercises[(exercise.group_id, exercise.tool_id)].append(exercise)
+        self.group_tools = MappingProxyType({group_id: _ordered(group_tools[group_id])
+                                             for group_id in self.group_by_id})
+        self.group_tool_exercises = MappingProxyType({key: _ordered(items)
+                                                      for key, items in group_tool_exercises.items()})
+
+        self.group_names = _names(groups)
+        self.tool_names = _names(tools)
+        self.exercise_names = _names(exercises)
+
+        # source path -> transcoded variant, see transcode_media.py
+        self.media_variants = MappingProxyType({variant.source_path: variant for variant in media_variants})
+
+    def tools(self, group_id) -> typing.Tuple[Tool, ...]:
+        return self.group_tools.get(group_id, ())
+
+    def exercises(self, group_id, tool_id) -> typing.Tuple[Exercise, ...]:
+        return self.group_tool_exercises.get((group_id, tool_id), ())
+
+
+def catalog_version() -> int:
+    cursor = db.execute_sql('SELECT version FROM catalog_version WHERE id = 1')
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def load_snapshot() -> CatalogSnapshot:
+    with db.atomic():
+        version = catalog_version()
+        groups = list(MuscleGroup.select())
+        tools = list(Tool.select())
+        exercises = list(Exercise.select())
+        media_variants = list(MediaVariant.select())
+    return CatalogSnapshot(version, groups, tools, exercises, media_variants)
+
+
+class Catalog:
+    """
+    process-wide holder of the current snapshot. Readers take catalog.snapshot once
+    and work with it, a reload builds a new snapshot and swaps the reference
+    """
+
+    def __init__(self):
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    @property
+    def snapshot(self) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = db_connect_wrapper(load_snapshot)()
+                snapshot = self._snapshot
+        return snapshot
+
+    def reload(self):
+        snapshot = load_snapshot()
+        with self._lock:
+            if self._snapshot is None or snapshot.version >= self._snapshot.version:
+                self._snapshot = snapshot
+        logger.info(f'Catalog - version {snapshot.version} loaded')
+
+    def check_version(self):
+        if self._snapshot is None or catalog_version() != self._snapshot.version:
+            self.reload()
+
+
+catalog = Catalog()
+
+
+async def watch_catalog(interval):
+    """
+    reload the catalog on NOTIFY from the catalog triggers,
+    the version is also checked every interval seconds in case a notification was missed
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        connection = None
+        changed = asyncio.Event()
+        try:
+            connection = await loop.run_in_executor(None, listen_connection, CATALOG_CHANNEL)
+            loop.add_reader(connection.fileno(), changed.set)
+            await run_db(catalog.check_version)
+            while True:
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=interval)
+                except asyncio.TimeoutError:
+                    pass
+                changed.clear()
+                connection.poll()
+                connection.notifies.clear()
+                await run_db(catalog.check_version)
+        except asyncio.CancelledError:
+            raise
+        except:
+            logger.error(traceback.format_exc())
+            await asyncio.sleep(interval)
+        finally:
+            if connection is not None:
+                loop.remove_reader(connection.fileno())
+                connection.close()
@@ -27,9 +27,37 @@ with env.prefixed("APP_"):
             port=env.int("PORT"),
             max_connections=env.int("MAX_CONNECTIONS", 50),
             stale_timeout=env.int("STALE_TIMEOUT", 600),
+            timeout=env.int("POOL_TIMEOUT", 10),
             register_hstore=False,
             server_side_cursors=False
         )
+        DB_MODE = env.str("MODE", "sync")
+        DB_WORKERS = env.int("WORKERS", 16)
+        DB_METRICS_INTERVAL = env.int("METRICS_INTERVAL", 60)
+
+    with env.prefixed("WEBHOOK_"):
+        WEBHOOK = dict(
+            listen=env.str("LISTEN", "127.0.0.1"),
+            port=env.int("PORT", 8443),
+            url_path=env.str("PATH", "telegram"),
+            webhook_url=env.str("URL", None),
+            secret_token=env.str("SECRET_TOKEN", None),
+            max_connections=env.int("MAX_CONNECTIONS", 40),
+        )
+
+    with env.prefixed("SHARD_"):
+        SHARD_WORKERS = env.int("WORKERS", 4)
+        SHARD_DEDUP_SIZE = env.int("DEDUP_SIZE", 100000)
+        SHARD_DEDUP_TTL = env.int("DEDUP_TTL", 24 * 60 * 60)
+        SHARD_SUPERVISE_INTERVAL = env.int("SUPERVISE_INTERVAL", 5)
+        SHARD_STOP_TIMEOUT = env.int("STOP_TIMEOUT", 30)
+
+    with env.prefixed("PERSISTENCE_"):
+        PERSISTENCE_BACKEND = env.str("BACKEND", "postgres")
+        PERSISTENCE_SQLITE_PATH = env.str("SQLITE_PATH", "gymbuddybot.sqlite")
+        PERSISTENCE_TTL = env.int("TTL", 30 * 24 * 60 * 60)
+        PERSISTENCE_UPDATE_INTERVAL = env.int("UPDATE_INTERVAL", 60)
+        PERSISTENCE_CLEANUP_INTERVAL = env.int("CLEANUP_INTERVAL", 60 * 60)
 
     with env.prefixed("CELERY_"):
         CELERY = dict(BROKER=env.str("BROKER", "redis://127.0.0.1:6379"),
@@ -41,6 +69,28 @@ with env.prefixed("APP_"):
     BUTTONS_PER_MESSAGE = env.int('BUTTONS_PER_MESSAGE', 8)
     MAIN_PATH = env.str('MAIN_PATH', '/Users/kalishuk/GymBuddyBot/')
     WKHTMLTOPDF = env.str('WKHTMLTOPDF', '/usr/local/bin/wkhtmltopdf')
+    FFMPEG = env.str('FFMPEG', 'ffmpeg')
+    FFPROBE = env.str('FFPROBE', 'ffprobe')
     CURRENCY = env.str('CURRENCY', 'USD')
     LAST_TRAININGS_NUM = env.int('LAST_TRAININGS_NUM', 5)
+    CONCURRENT_UPDATES = env.int('CONCURRENT_UPDATES', 256)
+    UPDATES_MODE = env.str('UPDATES_MODE', 'polling')
+    UPDATE_QUEUE_SIZE = env.int('UPDATE_QUEUE_SIZE', 0)
+    LANES_METRICS_INTERVAL = env.int('LANES_METRICS_INTERVAL', 60)
+    LANE_MAX_DEPTH = env.int('LANE_MAX_DEPTH', 50)
+    CATALOG_CHECK_INTERVAL = env.int('CATALOG_CHECK_INTERVAL', 300)
+    MEDIA_STORAGE_CHAT_ID = env.int('MEDIA_STORAGE_CHAT_ID', 0)
+    USER_CACHE_SIZE = env.int('USER_CACHE_SIZE', 10000)
+    USER_CACHE_TTL = env.int('USER_CACHE_TTL', 300)
+    USER_CACHE_LISTEN_RETRY = env.int('USER_CACHE_LISTEN_RETRY', 5)
+    TRAINING_SESSION_CACHE_SIZE = env.int('TRAINING_SESSION_CACHE_SIZE', 10000)
+    TRAINING_SESSION_TTL = env.int('TRAINING_SESSION_TTL', 60 * 60)
+    INTERACTIONS_FLUSH_INTERVAL = env.int('INTERACTIONS_FLUSH_INTERVAL', 30)
+    INTERACTIONS_FLUSH_SIZE = env.int('INTERACTIONS_FLUSH_SIZE', 500)
+    RENDER_DELAY = env.float('RENDER_DELAY', 0.5)
+    SEND_RATE = env.int('SEND_RATE', 25)
+    SEND_CHAT_INTERVAL = env.float('SEND_CHAT_INTERVAL', 1)
+    TRAINING_SWEEP_INTERVAL = env.int('TRAINING_SWEEP_INTERVAL', 10 * 60)
+    TRAINING_IDLE_TIMEOUT = env.int('TRAINING_IDLE_TIMEOUT', 4 * 60 * 60)
+    TRAINING_SWEEP_BATCH = env.int('TRAINING_SWEEP_BATCH', 100)
 
@@ -2,6 +2,64 @@ DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 DATE_FORMAT = '%Y-%m-%d'
 
 
+class DBModes:
+    Sync = 'sync'
+    Thread = 'thread'
+
+    @classmethod
+    def all(cls):
+        return (cls.Sync,
+                cls.Thread)
+
+
+class UpdateModes:
+    Polling = 'polling'
+    Webhook = 'webhook'
+
+    @classmethod
+    def all(cls):
+        return (cls.Polling,
+                cls.Webhook)
+
+
+class PersistenceBackends:
+    Postgres = 'postgres'
+    SQLite = 'sqlite'
+
+    @classmethod
+    def all(cls):
+        return (cls.Postgres,
+                cls.SQLite)
+
+
+class MediaTypes:
+    Video = 'video'
+    Animation = 'animation'
+    Document = 'document'
+
+    @classmethod
+    def all(cls):
+        return (cls.Video,
+                cls.Animation,
+                cls.Document)
+
+
+class Routes:
+    ExerciseTools = 'et'
+    GroupExercises = 'ge'
+    Exercise = 'ex'
+    StartExercise = 'se'
+    AnalyticsPeriod = 'ap'
+    SetLanguage = 'sl'
+    Invoice = 'iv'
+    CalculatorLevel = 'cl'
+    CalculatorParams = 'cp'
+    ProgramLevels = 'pl'
+    Program = 'pg'
+    NextProgramDay = 'nd'
+    StopProgram = 'sp'
+
+
 class MuscleGroupTypes:
     Upper = 1
     Lower = 2
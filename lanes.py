@@ -0,0 +1,112 @@
+import asyncio
+import heapq
+import traceback
+import typing
+from collections import deque
+
+from telegram import Update
+from telegram.ext import Application
+
+from utils import logger
+
+
+class ChatLanes:
+    """
+    one FIFO lane per chat: jobs of a chat run one after another,
+    jobs of different chats run in parallel, at most `concurrency` running at a time.
+    Only running jobs count against `concurrency`, so a chat with a long lane doesn't hold others back.
+    A lane holds at most `max_depth` jobs, jobs beyond it are dropped - that bounds the memory
+    a flooding chat takes
+    """
+
+    def __init__(self, concurrency: int, max_depth: int):
+        self._concurrency = concurrency
+        self._max_depth = max_depth
+        self._semaphore = None
+        self._lanes = {}
+        self._dropped = 0
+
+    def depth(self, key) -> int:
+        lane = self._lanes.get(key)
+        return len(lane) if lane is not None else 0
+
+    def stats(self, top=5) -> dict:
+        depths = {key: len(lane) for key, lane in self._lanes.items()}
+        return dict(
+            lanes=len(depths),
+            queued=sum(depths.values()),
+            deepest=heapq.nlargest(top, depths.items(), key=lambda item: item[1]),
+            dropped=self._dropped,
+        )
+
+    def submit(self, key, job: typing.Callable[[], typing.Awaitable],
+               create_task=asyncio.create_task) -> bool:
+        """
+        queue job (a coroutine function without arguments) in the lane of key,
+        the lane gets a task draining it when it was empty.
+        False when the lane is full and the job was dropped
+        """
+        lane = self._lanes.get(key)
+        if lane is not None:
+            if len(lane) >= self._max_depth:
+                self._dropped += 1
+                return False
+            lane.append(job)
+            return True
+        lane = self._lanes[key] = deque([job])
+        create_task(self._drain(key, lane))
+        return True
+
+    async def _drain(self, key, lane):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        try:
+            while lane:
+                async with self._semaphore:
+                    try:
+                        await lane[0]()
+                    except:
+                        logger.error(traceback.format_exc())
+                lane.popleft()
+        finally:
+            del self._lanes[key]
+
+
+def update_lane_key(update: object):
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class LanedApplication(Application):
+    """
+    application which processes updates of a chat in the order they came,
+    updates of different chats concurrently, at most concurrent_updates handlers running at a time.
+    process_update only queues the update in its chat's lane, updates of a chat with
+    max_lane_depth updates waiting are dropped.
+    Handlers have to be blocking, otherwise their work leaves the lane
+    """
+
+    def __init__(self, max_lane_depth=50, **kwargs):
+        super().__init__(**kwargs)
+        self.lanes = ChatLanes(max(self.concurrent_updates, 1), max_lane_depth)
+
+    async def process_update(self, update: object) -> None:
+        key = update_lane_key(update)
+        if key is None:
+            return await super().process_update(update)
+        queued = self.lanes.submit(key,
+                                   lambda: super(LanedApplication, self).process_update(update),
+                                   create_task=self.create_task)
+        if not queued:
+            logger.warning(f'Chat lanes - lane of {key} is full, update {getattr(update, "update_id", None)} dropped')
+
+
+async def log_lane_metrics(application: LanedApplication, interval):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f'Chat lanes - {application.lanes.stats()}')
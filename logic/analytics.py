@@ -6,18 +6,23 @@ from config import (
     LAST_TRAININGS_NUM,
 )
 from constants import (
+    Routes,
     SubscriptionValue,
     DATE_FORMAT
 )
 from models import (
+    run_db,
     Set,
     Training
 )
+from catalog import catalog
 from logic.base import DefaultMessageHandler
+from logic.router import route_data
 from tasks.src.main import send_analytics
 
 
 class AnalyticsMenuController(DefaultMessageHandler):
+    route = 'analytics'
     check_subscription = True
     needed_subscription_value = SubscriptionValue.Medium
 
@@ -38,8 +43,6 @@ class AnalyticsMenuController(DefaultMessageHandler):
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-        if not self._update.message:
-            self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
         texts = {
@@ -55,18 +58,18 @@ class AnalyticsMenuController(DefaultMessageHandler):
             {'name': {'en': '1 month',
                       'ru': '1 месяц',
                       'ua': '1 місяць'},
-             "callback_data": {'analytics': True,
-                               'period': '1'}},
+             "callback_data": route_data(Routes.AnalyticsPeriod,
+                                         period='1')},
             {'name': {'en': '3 month',
                       'ru': '3 месяца',
                       'ua': '3 місяці'},
-             "callback_data": {'analytics': True,
-                               'period': '3'}},
+             "callback_data": route_data(Routes.AnalyticsPeriod,
+                                         period='3')},
             {'name': {'en': 'All time',
                       'ru': 'Всё время',
                       'ua': 'Весь час'},
-             "callback_data": {'analytics': True,
-                               'period': '-1'}},
+             "callback_data": route_data(Routes.AnalyticsPeriod,
+                                         period='-1')},
         ]
         buttons = [{'name': period['name'][self.lang],
                     'callback_data': period['callback_data']} for period in periods]
@@ -74,22 +77,16 @@ class AnalyticsMenuController(DefaultMessageHandler):
         buttons.extend(self.attach_back_button('menu'))
         return texts[self.lang], InlineKeyboardMarkup(buttons)
 
-    @staticmethod
-    def pattern(callback_data):
-        return 'analytics' == callback_data
-
 
 class AnalyticsGeneratorController(DefaultMessageHandler):
+    route = Routes.AnalyticsPeriod
     check_subscription = True
     needed_subscription_value = SubscriptionValue.Medium
 
     async def _call(self):
         await self.callback_query.answer()
         chat_id = self.chat_id
-        if (Training
-                .select()
-                .where(Training.user == self.user)
-                .exists()):
+        if await run_db(self._has_trainings):
             try:
                 await self.callback_query.delete_message()
             finally:
@@ -103,24 +100,24 @@ class AnalyticsGeneratorController(DefaultMessageHandler):
                     text=texts[self.lang],
                     disable_notification=self.silent
                 )
-        send_analytics.apply_async(args=[self.user.id, self.callback_query.data['period']])
-        self._context.drop_callback_data(self.callback_query)
+        send_analytics.apply_async(args=[self.user.id, self.callback_data['period']])
 
-    @staticmethod
-    def pattern(callback_data):
-        if type(callback_data) == dict:
-            return callback_data.get('analytics', False)
-        return False
+    def _has_trainings(self):
+        return (Training
+                .select()
+                .where(Training.user == self.user)
+                .exists())
 
 
 class MyTrainingsController(DefaultMessageHandler):
+    route = 'my_trainings'
     check_subscription = True
     needed_subscription_value = SubscriptionValue.Medium
 
     async def _call(self):
         await self.callback_query.answer()
 
-        text, buttons = await self._get_data()
+        text, buttons = await run_db(self._get_data)
         try:
             await self.callback_query.edit_message_text(
                 text=text,
@@ -133,9 +130,8 @@ class MyTrainingsController(DefaultMessageHandler):
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-        self._context.drop_callback_data(self.callback_query)
 
-    async def _get_data(self):
+    def _get_data(self):
         buttons = self.attach_back_button('analytics')
         headers = {
             'en': '📈Analytics | My trainings:\n',
@@ -147,8 +143,7 @@ class MyTrainingsController(DefaultMessageHandler):
                      .select()
                      .where(Training.user == self.user,
                             Training.end.is_null(False))
-                     .order_by(Training.id.desc(),
-                               Training.created.desc())
+                     .order_by(Training.id.desc())
                      .limit(LAST_TRAININGS_NUM))
 
         if not trainings.count():
@@ -158,7 +153,7 @@ class MyTrainingsController(DefaultMessageHandler):
                 'ua': "\nКамон, в тебе ще не було тренувань. \nЧас це виправити 💪",
             }
         else:
-            trainings_text = await self._get_sets_data(trainings)
+            trainings_text = self._get_sets_data(trainings)
             texts = {
                 'en': f'Your last trainings: \n {trainings_text}',
                 'ru': f'Твои последние тренировки: \n {trainings_text}',
@@ -167,22 +162,19 @@ class MyTrainingsController(DefaultMessageHandler):
 
         return headers[self.lang] + texts[self.lang], InlineKeyboardMarkup(buttons)
 
-    async def _get_sets_data(self, trainings):
+    def _get_sets_data(self, trainings):
         text = ''
+        snapshot = catalog.snapshot
         for training in trainings:
             text += f'\n📅 {training.created.strftime(DATE_FORMAT)} 📅\n'
             for s in (Set
                     .select()
                     .where(Set.training == training)
                     .order_by(Set.created)):
-                exercise = s.exercise
+                exercise = snapshot.exercise_by_id[s.exercise_id]
                 tool = exercise.tool
                 group = exercise.group
                 text += f'\t • {group.get_name(self.lang)} | ' \
                         f'{tool.get_name(self.lang)} | ' \
                         f'{exercise.get_name(self.lang)}\n'
         return text
-
-    @staticmethod
-    def pattern(callback_data):
-        return 'my_trainings' == callback_data
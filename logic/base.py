@@ -1,6 +1,7 @@
 import re
 import typing
 import traceback
+from contextvars import ContextVar
 
 from datetime import datetime, timedelta
 import telegram.constants
@@ -30,23 +31,38 @@ from config import (
     MAIN_PATH
 )
 from constants import Languages, USER_LANGUAGES
-from models import User, db_connect_wrapper
+from models import User, close_db_connection, interaction_buffer, run_db
+from logic.router import parse_data
 from utils import logger
 
 
+class RequestContext:
+    """
+    state of a single update processing: update, callback context,
+    cached user, language and subscription entitlements
+    """
+
+    def __init__(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        self.update = update
+        self.context = context
+        self.user = None
+        self.user_created = False
+        self.lang = None
+        self.subscription_value = None
+
+
+_request_context: ContextVar['RequestContext'] = ContextVar('request_context')
+
+
 class DefaultMessageHandler:
     check_subscription = False
     needed_subscription_value = 0
+    route = None
 
     def __init__(self, app: 'Application'):
         self._app = app
-        self._update = None
-        self._context = None
-        self._user = None
-        self._user_created = False
         self._log = logger
         self._static_path = MAIN_PATH
-        self._last_chat_id = None
         self._menu_buttons = {
             'ru': [{'name': '💪Упражнения', 'callback_data': 'start_training'},
                    {'name': '🧮Калькулятор', 'callback_data': 'calculator'},
@@ -78,6 +94,36 @@ class DefaultMessageHandler:
     def bot(self) -> 'Bot':
         return self._app.bot
 
+    @property
+    def request(self) -> 'RequestContext':
+        return _request_context.get()
+
+    @property
+    def _update(self) -> 'Update':
+        return self.request.update
+
+    @property
+    def _context(self) -> ContextTypes.DEFAULT_TYPE:
+        return self.request.context
+
+    @property
+    def _user(self) -> typing.Union[None, 'User']:
+        return self.request.user
+
+    @_user.setter
+    def _user(self, user: typing.Union[None, 'User']):
+        self.request.user = user
+        self.request.lang = None
+        self.request.subscription_value = None
+
+    @property
+    def _user_created(self) -> bool:
+        return self.request.user_created
+
+    @_user_created.setter
+    def _user_created(self, created: bool):
+        self.request.user_created = created
+
     @property
     def from_user(self) -> 'TGUser':
         if self._update.message:
@@ -87,21 +133,15 @@ class DefaultMessageHandler:
 
     @property
     def user(self) -> 'User':
-        if (self._user is None or
-                self._last_chat_id is None or
-                self._last_chat_id != self.chat_id):
-            self._user = User.get_or_none(
+        if self._user is None:
+            self._user = User.get_cached(
                 chat_id=self.chat_id,
             )
             self._user_created = False
             if self._user is None:
                 self.create_user()
-            self._last_chat_id = self.chat_id
         return self._user
 
-    def _clear_user(self):
-        self._user = None
-
     @property
     def gender(self) -> str:
         return self.user.extra_data.get('gender', 'male')
@@ -124,8 +164,17 @@ class DefaultMessageHandler:
     def callback_query(self) -> 'CallbackQuery':
         return self._update.callback_query
 
+    @property
+    def callback_data(self) -> typing.Union[None, str, dict]:
+        return parse_data(self.callback_query.data)
+
     @property
     def lang(self) -> str:
+        if self.request.lang is None:
+            self.request.lang = self._get_lang()
+        return self.request.lang
+
+    def _get_lang(self) -> str:
         if self.user is not None:
             return USER_LANGUAGES.get(self.user.id, self.user.lang)
         lang = self.from_user.language_code
@@ -133,14 +182,17 @@ class DefaultMessageHandler:
             lang = DEFAULT_LANGUAGE
         return lang
 
+    @property
+    def subscription_value(self) -> int:
+        if self.request.subscription_value is None:
+            subscription = self.user.subscription
+            self.request.subscription_value = subscription.value if subscription else 0
+        return self.request.subscription_value
+
     @property
     def silent(self):
         return self.user.extra_data.get('silent', False)
 
-    def _setter(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        self._update = update
-        self._context = context
-
     def build_menu(self, buttons, buttons_in_row=2, raw=False) -> typing.Union[InlineKeyboardMarkup, list]:
         markup = []
         new_row = []
@@ -173,24 +225,44 @@ class DefaultMessageHandler:
         )
 
     def save_interaction(self):
-        if self._user is not None:
-            self._user.last_interacted = datetime.now()
-            self._user.save(only=[User.last_interacted])
+        if interaction_buffer.touch(self.user.id):
+            interaction_buffer.flush()
 
-    @db_connect_wrapper
     async def call(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        every update gets its own RequestContext, so one handler instance
+        can serve any number of concurrent updates
+        """
+        token = _request_context.set(RequestContext(update, context))
         try:
-            self._setter(update, context)
-            self._clear_user()
-            self.save_interaction()
-            if self.check_subscription:
-                if not self.is_subscription_active():
-                    return await self.subscription_end()
-                elif not self.is_valid_subscription():
-                    return await self.not_valid_subscription()
+            denied = await run_db(self._prepare)
+            if denied is not None:
+                return await denied()
             return await self._call()
         except:
             self._log.error(traceback.format_exc())
+        finally:
+            _request_context.reset(token)
+            # queries are expected inside run_db units, a lazily opened
+            # connection must not stay checked out until the next update
+            close_db_connection()
+
+    def _prepare(self) -> typing.Union[None, typing.Callable]:
+        """
+        db work needed before every update, done as one unit:
+        loads the user and checks the subscription.
+        Returns the reply coroutine function if access is denied
+        """
+        if self._update.effective_chat is None:
+            return None
+        self.save_interaction()
+        if self.check_subscription:
+            if not self.is_subscription_active():
+                return self.subscription_end
+            if not self.is_valid_subscription():
+                return self.not_valid_subscription
+        self.request.lang = self._get_lang()
+        return None
 
     async def _call(self):
         raise NotImplementedError
@@ -234,8 +306,7 @@ class DefaultMessageHandler:
         return back_buttons
 
     def is_subscription_active(self):
-        user = User.get_or_none(chat_id=self.chat_id)
-        return user is None or user.subscription_end >= datetime.now()
+        return self.user.subscription_end >= datetime.now()
 
     async def subscription_end(self):
         if self.callback_query:
@@ -255,9 +326,6 @@ class DefaultMessageHandler:
                 disable_notification=self.silent
             )
 
-        if not self._update.message:
-            self._context.drop_callback_data(self.callback_query)
-
     def _get_subscription_end_data(self):
         texts = {
             'en': 'Your subscription has ended 😩\n'
@@ -271,9 +339,9 @@ class DefaultMessageHandler:
         return texts[self.lang], buttons
 
     def is_valid_subscription(self):
-        if self.user.subscription:
-            return self.user.subscription.value >= self.needed_subscription_value
-        return not self.needed_subscription_value
+        if self.needed_subscription_value <= 0:
+            return True
+        return self.subscription_value >= self.needed_subscription_value
 
     async def not_valid_subscription(self):
         if self.callback_query:
@@ -293,9 +361,6 @@ class DefaultMessageHandler:
                 disable_notification=self.silent
             )
 
-        if not self._update.message:
-            self._context.drop_callback_data(self.callback_query)
-
     def _get_not_valid_subscription_level_data(self):
         texts = {
             'en': 'This functionality is not included in your subscription😢\n'
@@ -329,7 +394,8 @@ class Registration(DefaultMessageHandler):
     BodyParamsRegEx = r'.*?\d+\.?\d+.*?\d+\.?\d+'
 
     async def start(self) -> typing.Union[None, int]:
-        self.create_user()
+        if self._user is None:
+            await run_db(self.create_user)
         if self._user_created:
             texts = {
                 'ru': f'Привет, я буду твоим партнёром в зале 💪. \n'
@@ -373,7 +439,7 @@ class Registration(DefaultMessageHandler):
                   f"Якщо хочеш тримати в секреті 🤫, то просто натисніть на /skip",
         }
 
-        self._save_gender()
+        await run_db(self._save_gender)
         await self._update.message.reply_text(
             texts[self.lang],
             reply_markup=ReplyKeyboardRemove(),
@@ -431,7 +497,7 @@ class Registration(DefaultMessageHandler):
                   f"So that I can correctly give advice, if you do not want to click on /skip. \n"
                   f"❗️Input format: 185 75❗️"
         }
-        self._save_age()
+        await run_db(self._save_age)
         await self._update.message.reply_text(
             texts[self.lang],
             reply_markup=ReplyKeyboardRemove(),
@@ -460,7 +526,7 @@ class Registration(DefaultMessageHandler):
             'en': f"And now, last but not least, choose for what purpose do you go to the gym?"
         }
 
-        self._save_body_params()
+        await run_db(self._save_body_params)
         await self._update.message.reply_text(
             texts[self.lang],
             reply_markup=ReplyKeyboardMarkup(
@@ -504,7 +570,7 @@ class Registration(DefaultMessageHandler):
         }
         if self._update.message:
             if self._update.message.text not in ['/menu', '/start']:
-                self._save_goals()
+                await run_db(self._save_goals)
                 try:
                     await self._update.message.reply_text(
                         text=texts[self.lang],
@@ -526,7 +592,6 @@ class Registration(DefaultMessageHandler):
                 text=menu_texts[self.lang],
                 reply_markup=self.build_menu(self._menu_buttons[self.lang]),
             )
-            self._context.drop_callback_data(self.callback_query)
 
     def _save_goals(self):
         goals = self.Goals[self.lang]
@@ -4,11 +4,14 @@ from telegram import (
     InlineKeyboardMarkup
 )
 
-from constants import Genders, ActivityLevelCoefficients
+from constants import Genders, ActivityLevelCoefficients, Routes
+from models import run_db
 from logic.base import DefaultMessageHandler
+from logic.router import route_data
 
 
 class CalculatorGenderController(DefaultMessageHandler):
+    route = 'calculator'
     check_subscription = True
 
     async def _call(self):
@@ -27,7 +30,6 @@ class CalculatorGenderController(DefaultMessageHandler):
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-        self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
         texts = {
@@ -42,16 +44,16 @@ class CalculatorGenderController(DefaultMessageHandler):
                 'ru': 'Мужчина',
                 'ua': 'Чоловік',
             },
-            'callback_data': {'calculator': True,
-                              'gender': Genders.Man}
+            'callback_data': route_data(Routes.CalculatorLevel,
+                                        gender=Genders.Man)
         }, {
             'text': {
                 'en': 'Woman',
                 'ru': 'Женщина',
                 'ua': "Жінка",
             },
-            'callback_data': {'calculator': True,
-                              'gender': Genders.Man}
+            'callback_data': route_data(Routes.CalculatorLevel,
+                                        gender=Genders.Man)
         }]
 
         buttons = [{'name': button['text'][self.lang],
@@ -60,12 +62,9 @@ class CalculatorGenderController(DefaultMessageHandler):
         buttons.extend(self.attach_back_button('menu'))
         return texts[self.lang], InlineKeyboardMarkup(buttons)
 
-    @staticmethod
-    def pattern(callback_data):
-        return 'calculator' == callback_data
-
 
 class CalculatorLevelController(DefaultMessageHandler):
+    route = Routes.CalculatorLevel
     check_subscription = True
 
     async def _call(self):
@@ -86,15 +85,14 @@ class CalculatorLevelController(DefaultMessageHandler):
                 disable_notification=self.silent,
                 parse_mode=constants.ParseMode.HTML
             )
-        self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
-        callback_data = self.callback_query.data
+        callback_data = self.callback_data
         datas = []
         for i in ActivityLevelCoefficients:
-            tmp = callback_data.copy()
-            tmp['activity_level'] = i
-            datas.append(tmp)
+            datas.append(route_data(Routes.CalculatorParams,
+                                    gender=callback_data['gender'],
+                                    activity_level=i))
         texts = {
             'en': '🧮 Calculator\n'
                   'Choose your activity level:\n\n'
@@ -163,21 +161,14 @@ class CalculatorLevelController(DefaultMessageHandler):
         buttons.extend(self.attach_back_button('calculator'))
         return texts[self.lang], InlineKeyboardMarkup(buttons)
 
-    @staticmethod
-    def pattern(callback_data):
-        if type(callback_data) == dict:
-            return (callback_data.get('calculator') and
-                    callback_data.get('gender') and
-                    not callback_data.get('activity_level'))
-        return False
-
 
 class CalculatorParamsController(DefaultMessageHandler):
+    route = Routes.CalculatorParams
     check_subscription = True
 
     async def _call(self):
         await self.callback_query.answer()
-        self._save_calculator_data()
+        await run_db(self._save_calculator_data)
 
         text, buttons = self._get_data()
         try:
@@ -192,10 +183,9 @@ class CalculatorParamsController(DefaultMessageHandler):
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-        self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
-        callback_data = self.callback_query.data
+        callback_data = self.callback_data
 
         texts = {
             'en': '🧮 Calculator\n'
@@ -208,22 +198,16 @@ class CalculatorParamsController(DefaultMessageHandler):
                   'Введи свій Вік | Зріст | Вагу:\n'
                   '❗Формат введення: 20 185 75 ❗',
         }
-        callback_data.pop('activity_level')
-        buttons = self.attach_back_button(callback_data)
+        buttons = self.attach_back_button(route_data(Routes.CalculatorLevel,
+                                                     gender=callback_data['gender']))
         return texts[self.lang], InlineKeyboardMarkup(buttons)
 
     def _save_calculator_data(self):
-        self.user.extra_data['calculator'] = self.callback_query.data
+        callback_data = self.callback_data
+        self.user.extra_data['calculator'] = {'gender': callback_data['gender'],
+                                              'activity_level': callback_data['activity_level']}
         self.user.save()
 
-    @staticmethod
-    def pattern(callback_data):
-        if type(callback_data) == dict:
-            return (callback_data.get('calculator') and
-                    callback_data.get('gender') and
-                    callback_data.get('activity_level'))
-        return False
-
 
 class CalculatorResultController(DefaultMessageHandler):
     check_subscription = True
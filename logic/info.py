@@ -4,10 +4,13 @@ from telegram import (
 )
 
 from logic.base import DefaultMessageHandler
+from media import registry
 from constants import SubscriptionValue
 
 
 class InfoMenuController(DefaultMessageHandler):
+    route = 'info'
+
     async def _call(self):
         if not self._update.message:
             await self.callback_query.answer()
@@ -28,8 +31,6 @@ class InfoMenuController(DefaultMessageHandler):
                     reply_markup=buttons,
                     disable_notification=self.silent
                 )
-            if not self._update.message:
-                self._context.drop_callback_data(self.callback_query)
         else:
             try:
                 await self.callback_query.delete_message()
@@ -84,31 +85,28 @@ class InfoMenuController(DefaultMessageHandler):
         buttons.extend(self.attach_back_button('menu'))
         return texts[self.lang], InlineKeyboardMarkup(buttons)
 
-    @staticmethod
-    def pattern(callback_data):
-        return 'info' == callback_data
-
 
 class InfoManualController(DefaultMessageHandler):
+    route = 'manual'
+
     async def _call(self):
         if not self._update.message:
             await self.callback_query.answer()
 
-        text, buttons, media = self._get_data()
+        text, buttons, path = self._get_data()
         try:
             await self.callback_query.delete_message()
         finally:
-            await self._context.bot.sendVideo(
+            await registry.send(
+                self._context.bot,
+                path,
                 chat_id=self.chat_id,
-                video=media,
                 width=886,
                 height=1920,
                 caption=text,
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-            if not self._update.message:
-                self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
         texts = {
@@ -123,18 +121,13 @@ class InfoManualController(DefaultMessageHandler):
                   'Якщо є питання, вся контактна інформація у розділі "Зворотній зв\'язок"',
         }
 
-        with open(self._static_path + 'static/info/manual.MOV', 'rb') as f:
-            media = f.read()
-
         buttons = self.attach_back_button('info')
-        return texts[self.lang], InlineKeyboardMarkup(buttons), media
-
-    @staticmethod
-    def pattern(callback_data):
-        return 'manual' == callback_data
+        return texts[self.lang], InlineKeyboardMarkup(buttons), 'static/info/manual.MOV'
 
 
 class FeedbackController(DefaultMessageHandler):
+    route = 'feedback'
+
     async def _call(self):
         await self.callback_query.answer()
 
@@ -151,7 +144,6 @@ class FeedbackController(DefaultMessageHandler):
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-        self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
         texts = {
@@ -176,29 +168,25 @@ class FeedbackController(DefaultMessageHandler):
         buttons = self.attach_back_button('info')
         return texts[self.lang], InlineKeyboardMarkup(buttons)
 
-    @staticmethod
-    def pattern(callback_data):
-        return 'feedback' == callback_data
-
 
 class OfertaController(DefaultMessageHandler):
+    route = 'oferta'
+
     async def _call(self):
         await self.callback_query.answer()
 
-        text, media, buttons = self._get_data()
+        text, path, buttons = self._get_data()
         try:
             await self.callback_query.delete_message()
         finally:
-            await self._context.bot.sendDocument(
+            await registry.send(
+                self._context.bot,
+                path,
                 chat_id=self.chat_id,
-                document=media,
-                filename='terms_of_use.pdf',
                 caption=text,
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-            if not self._update.message:
-                self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
         texts = {
@@ -225,18 +213,13 @@ class OfertaController(DefaultMessageHandler):
                   'вся контактна інформація у розділі "Зворотній зв\'язок"',
         }
 
-        with open(self._static_path + 'static/info/oferta.pdf', 'rb') as f:
-            media = f.read()
-
         buttons = self.attach_back_button('info')
-        return texts[self.lang], media, InlineKeyboardMarkup(buttons)
-
-    @staticmethod
-    def pattern(callback_data):
-        return 'oferta' == callback_data
+        return texts[self.lang], 'static/info/oferta.pdf', InlineKeyboardMarkup(buttons)
 
 
 class HelpController(DefaultMessageHandler):
+    route = 'help'
+
     async def _call(self):
         if not self._update.message:
             await self.callback_query.answer()
@@ -256,7 +239,6 @@ class HelpController(DefaultMessageHandler):
                     reply_markup=buttons,
                     disable_notification=self.silent
                 )
-            self._context.drop_callback_data(self.callback_query)
         else:
             try:
                 await self.callback_query.delete_message()
@@ -302,27 +284,24 @@ class HelpController(DefaultMessageHandler):
         buttons = self.attach_back_button('info')
         return texts[self.lang], InlineKeyboardMarkup(buttons)
 
-    @staticmethod
-    def pattern(callback_data):
-        return 'help' == callback_data
-
 
 class GuideController(DefaultMessageHandler):
+    route = 'guide'
     check_subscription = True
     needed_subscription_value = SubscriptionValue.Medium
 
     async def _call(self):
         await self.callback_query.answer()
 
-        text, buttons, file = self._get_data()
+        text, buttons, path = self._get_data()
 
         try:
             await self.callback_query.delete_message()
         finally:
-            await self.bot.sendDocument(
+            await registry.send(
+                self.bot,
+                path,
                 chat_id=self.chat_id,
-                document=file,
-                filename='boss_of_the_gym.pdf',
                 caption=text,
                 disable_notification=self.silent,
                 parse_mode=constants.ParseMode.HTML
@@ -340,7 +319,6 @@ class GuideController(DefaultMessageHandler):
                 reply_markup=menu_buttons,
                 disable_notification=self.silent
             )
-        self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
         texts = {
@@ -367,12 +345,5 @@ class GuideController(DefaultMessageHandler):
                   "Приємного перегляду✌️",
         }
 
-        with open(self._static_path + 'static/guide.pdf', 'rb') as f:
-            file = f.read()
-
         buttons = self.attach_back_button('menu')
-        return texts[self.lang], InlineKeyboardMarkup(buttons), file
-
-    @staticmethod
-    def pattern(callback_data):
-        return 'guide' == callback_data
+        return texts[self.lang], InlineKeyboardMarkup(buttons), 'static/guide.pdf'
@@ -5,24 +5,27 @@ from telegram import (
 )
 from datetime import datetime, timedelta
 
-from constants import SubscriptionValue
+from constants import Routes, SubscriptionValue
 from models import (
+    run_db,
     ProgramGroup,
     ProgramLevel,
-    Program,
-    Exercise
+    Program
 )
+from catalog import catalog
 from logic.base import DefaultMessageHandler
+from logic.router import route_data
 
 
 class ProgramGroupController(DefaultMessageHandler):
+    route = 'programs'
     check_subscription = True
     needed_subscription_value = SubscriptionValue.Medium
 
     async def _call(self):
         await self.callback_query.answer()
 
-        text, buttons = self._get_data()
+        text, buttons = await run_db(self._get_data)
         try:
             await self.callback_query.edit_message_text(
                 text=text,
@@ -35,7 +38,6 @@ class ProgramGroupController(DefaultMessageHandler):
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-        self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
         texts = {
@@ -45,11 +47,11 @@ class ProgramGroupController(DefaultMessageHandler):
         }
 
         buttons = [{'name': p.name[self.lang],
-                    'callback_data': {'programs': True,
-                                      'program_group': p.id}} for p in (ProgramGroup
-                                                                        .select()
-                                                                        .order_by(ProgramGroup.order,
-                                                                                  ProgramGroup.id))]
+                    'callback_data': route_data(Routes.ProgramLevels,
+                                                program_group=p.id)} for p in (ProgramGroup
+                                                                               .select()
+                                                                               .order_by(ProgramGroup.order,
+                                                                                         ProgramGroup.id))]
         program = self.user.program
         if program:
             my_trainings = {
@@ -59,27 +61,24 @@ class ProgramGroupController(DefaultMessageHandler):
             }
             buttons.append({
                 'name': my_trainings[self.lang],
-                'callback_data': {'programs': True,
-                                  'program_group': program.group.id,
-                                  'program_level': program.level.id}
+                'callback_data': route_data(Routes.Program,
+                                            program_group=program.group_id,
+                                            program_level=program.level_id)
             })
         buttons = self.build_menu(buttons, raw=True, buttons_in_row=1)
         buttons.extend(self.attach_back_button('menu'))
         return texts[self.lang], InlineKeyboardMarkup(buttons)
 
-    @staticmethod
-    def pattern(callback_data):
-        return 'programs' == callback_data
-
 
 class ProgramLevelController(DefaultMessageHandler):
+    route = Routes.ProgramLevels
     check_subscription = True
     needed_subscription_value = SubscriptionValue.Medium
 
     async def _call(self):
         await self.callback_query.answer()
 
-        text, buttons = self._get_data()
+        text, buttons = await run_db(self._get_data)
         try:
             await self.callback_query.edit_message_text(
                 text=text,
@@ -92,7 +91,6 @@ class ProgramLevelController(DefaultMessageHandler):
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-        self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
         texts = {
@@ -100,42 +98,35 @@ class ProgramLevelController(DefaultMessageHandler):
             'ru': '✍️ Программы тренировок\nВыбери подходящий вариант:',
             'ua': '✍️ Програми тренувань\nОбери потрібний варіант:',
         }
-        callback_data = self.callback_query.data
+        callback_data = self.callback_data
         group_id = callback_data['program_group']
         buttons = [{'name': p.name[self.lang],
-                    'callback_data': {'programs': True,
-                                      'program_group': group_id,
-                                      'program_level': p.id}} for p in (ProgramLevel
-                                                                        .select(fn.DISTINCT(ProgramLevel.id),
-                                                                                ProgramLevel.name,
-                                                                                ProgramLevel.order)
-                                                                        .join(Program)
-                                                                        .join(ProgramGroup)
-                                                                        .where(ProgramGroup.id == group_id)
-                                                                        .order_by(ProgramLevel.order,
-                                                                                  ProgramLevel.id)
-                                                                        )]
+                    'callback_data': route_data(Routes.Program,
+                                                program_group=group_id,
+                                                program_level=p.id)} for p in (ProgramLevel
+                                                                               .select(fn.DISTINCT(ProgramLevel.id),
+                                                                                       ProgramLevel.name,
+                                                                                       ProgramLevel.order)
+                                                                               .join(Program)
+                                                                               .join(ProgramGroup)
+                                                                               .where(ProgramGroup.id == group_id)
+                                                                               .order_by(ProgramLevel.order,
+                                                                                         ProgramLevel.id)
+                                                                               )]
         buttons = self.build_menu(buttons, raw=True, buttons_in_row=1)
         buttons.extend(self.attach_back_button('programs'))
         return texts[self.lang], InlineKeyboardMarkup(buttons)
 
-    @staticmethod
-    def pattern(callback_data):
-        if type(callback_data) == dict:
-            return (callback_data.get('programs') and
-                    callback_data.get('program_group') is not None and
-                    callback_data.get('program_level') is None)
-        return False
-
 
 class ProgramController(DefaultMessageHandler):
+    route = Routes.Program
     check_subscription = True
     needed_subscription_value = SubscriptionValue.Medium
 
     async def _call(self):
         await self.callback_query.answer()
 
-        text, buttons = self._get_data()
+        text, buttons = await run_db(self._get_data)
         try:
             await self.callback_query.edit_message_text(
                 text=text,
@@ -148,10 +139,9 @@ class ProgramController(DefaultMessageHandler):
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-        self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
-        callback_data = self.callback_query.data
+        callback_data = self.callback_data
         program = Program.get(
             group_id=callback_data['program_group'],
             level_id=callback_data['program_level'],
@@ -185,8 +175,8 @@ class ProgramController(DefaultMessageHandler):
                         'ru': '💪 Следующий день',
                         'ua': '💪 Наступний день',
                     },
-                    'callback_data': {'new_day': True,
-                                      'program': program.id}
+                    'callback_data': route_data(Routes.NextProgramDay,
+                                                program=program.id)
                 },
                 {
                     'text': {
@@ -194,8 +184,8 @@ class ProgramController(DefaultMessageHandler):
                         'ru': '🚫 Закончить программу',
                         'ua': '🚫 Закінчити програму',
                     },
-                    'callback_data': {'stop_program': True,
-                                      'program': program.id}
+                    'callback_data': route_data(Routes.StopProgram,
+                                                program=program.id)
                 }
             ]
         else:
@@ -206,35 +196,28 @@ class ProgramController(DefaultMessageHandler):
                         'ru': '💪 Начать программу',
                         'ua': '💪 Почати програму',
                     },
-                    'callback_data': {'new_day': True,
-                                      'program': program.id}
+                    'callback_data': route_data(Routes.NextProgramDay,
+                                                program=program.id)
                 }
             ]
         buttons = [{'name': b['text'][self.lang],
                     'callback_data': b['callback_data']} for b in buttons]
 
         buttons = self.build_menu(buttons, raw=True, buttons_in_row=1)
-        callback_data.pop('program_level')
-        buttons.extend(self.attach_back_button(callback_data))
+        buttons.extend(self.attach_back_button(route_data(Routes.ProgramLevels,
+                                                          program_group=callback_data['program_group'])))
         return text, InlineKeyboardMarkup(buttons)
 
-    @staticmethod
-    def pattern(callback_data):
-        if type(callback_data) == dict:
-            return (callback_data.get('programs') and
-                    callback_data.get('program_group') is not None and
-                    callback_data.get('program_level') is not None)
-        return False
-
 
 class StopProgramController(DefaultMessageHandler):
+    route = Routes.StopProgram
     check_subscription = True
     needed_subscription_value = SubscriptionValue.Medium
 
     async def _call(self):
         await self.callback_query.answer()
 
-        text, buttons = self._get_data()
+        text, buttons = await run_db(self._get_data)
         try:
             await self.callback_query.edit_message_text(
                 text=text,
@@ -249,10 +232,9 @@ class StopProgramController(DefaultMessageHandler):
                 disable_notification=self.silent,
                 parse_mode=tg_constants.ParseMode.HTML
             )
-        self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
-        callback_data = self.callback_query.data
+        callback_data = self.callback_data
         program = Program.get_by_id(callback_data['program'])
         name = program.group.name[self.lang]
         texts = {
@@ -300,22 +282,16 @@ class StopProgramController(DefaultMessageHandler):
         buttons = self.build_menu(buttons, raw=True, buttons_in_row=1)
         return texts[self.lang], InlineKeyboardMarkup(buttons)
 
-    @staticmethod
-    def pattern(callback_data):
-        if type(callback_data) == dict:
-            return (callback_data.get('stop_program') and
-                    callback_data.get('program') is not None)
-        return False
-
 
 class NextDayProgramController(DefaultMessageHandler):
+    route = Routes.NextProgramDay
     check_subscription = True
     needed_subscription_value = SubscriptionValue.Medium
 
     async def _call(self):
         await self.callback_query.answer()
 
-        text, buttons = self._get_data()
+        text, buttons = await run_db(self._get_data)
         try:
             await self.callback_query.edit_message_text(
                 text=text,
@@ -330,10 +306,9 @@ class NextDayProgramController(DefaultMessageHandler):
                 disable_notification=self.silent,
                 parse_mode=tg_constants.ParseMode.HTML
             )
-        self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
-        callback_data = self.callback_query.data
+        callback_data = self.callback_data
         program = Program.get_by_id(callback_data['program'])
         description = program.description[self.lang]
         texts = {
@@ -368,8 +343,8 @@ class NextDayProgramController(DefaultMessageHandler):
             }
             buttons = [
                 {'name': button_text[self.lang],
-                 'callback_data': {'stop_program': True,
-                                   'program': program.id}
+                 'callback_data': route_data(Routes.StopProgram,
+                                             program=program.id)
                  }
             ]
             buttons = self.build_menu(buttons, raw=True, buttons_in_row=1)
@@ -399,10 +374,8 @@ class NextDayProgramController(DefaultMessageHandler):
         self.user.extra_data['next_program_trainings'] = list(reversed(exercises))
         self.user.save()
 
-        exs = list(Exercise.select().where(Exercise.id.in_(exercises)))
-        ex_dict = {e: i for i, e in enumerate(exercises)}
-        exs = sorted(exs, key=lambda x: ex_dict[x.id])
-        for e in exs:
+        snapshot = catalog.snapshot
+        for e in (snapshot.exercise_by_id[exercise_id] for exercise_id in exercises):
             tool = e.tool
             group = e.group
             text += f'\t • {group.get_name(self.lang)} | ' \
@@ -436,26 +409,16 @@ class NextDayProgramController(DefaultMessageHandler):
             }
             text += texts[self.lang]
 
-        exercise = Exercise.get_by_id(exercises[0])
         button_texts = {
             'en': 'Start training 💪',
             'ru': 'Начать тренировку 💪',
             'ua': 'Почати тренування 💪'
         }
         buttons = [{'name': button_texts[self.lang],
-                    'callback_data': {
-                        "group": exercise.group.id,
-                        "tool": exercise.tool.id,
-                        "exercise": exercise.unique_id}
+                    'callback_data': route_data(Routes.Exercise,
+                                                exercise=exercises[0])
                     }]
 
         buttons = self.build_menu(buttons, raw=True, buttons_in_row=1)
         buttons.extend(self.attach_back_button('menu'))
         return text, InlineKeyboardMarkup(buttons)
-
-    @staticmethod
-    def pattern(callback_data):
-        if type(callback_data) == dict:
-            return (callback_data.get('new_day') and
-                    callback_data.get('program') is not None)
-        return False
@@ -0,0 +1,134 @@
+import typing
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from constants import Routes
+
+CALLBACK_DATA_LIMIT = 64
+SEPARATOR = ':'
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+BASE58_INDEX = {char: i for i, char in enumerate(BASE58_ALPHABET)}
+
+# fields of every route in the order they are encoded
+ROUTE_FIELDS = {
+    Routes.ExerciseTools: (('group', int),),
+    Routes.GroupExercises: (('group', int), ('tool', int)),
+    Routes.Exercise: (('exercise', int),),
+    Routes.StartExercise: (('exercise', int),),
+    Routes.AnalyticsPeriod: (('period', str),),
+    Routes.SetLanguage: (('lang', str),),
+    Routes.Invoice: (('subscription', int),),
+    Routes.CalculatorLevel: (('gender', str),),
+    Routes.CalculatorParams: (('gender', str), ('activity_level', float)),
+    Routes.ProgramLevels: (('program_group', int),),
+    Routes.Program: (('program_group', int), ('program_level', int)),
+    Routes.NextProgramDay: (('program', int),),
+    Routes.StopProgram: (('program', int),),
+}
+
+
+def b58encode(number: int) -> str:
+    if number < 0:
+        raise ValueError(f'Can not encode negative number {number}')
+    encoded = ''
+    while True:
+        number, rest = divmod(number, 58)
+        encoded = BASE58_ALPHABET[rest] + encoded
+        if not number:
+            return encoded
+
+
+def b58decode(value: str) -> int:
+    if not value:
+        raise ValueError('Can not decode empty string')
+    number = 0
+    for char in value:
+        number = number * 58 + BASE58_INDEX[char]
+    return number
+
+
+def _encode_field(value, field_type) -> str:
+    if field_type is int:
+        return b58encode(int(value))
+    value = str(value)
+    if SEPARATOR in value:
+        raise ValueError(f'Separator in callback data field {value!r}')
+    return value
+
+
+def _decode_field(value: str, field_type):
+    if field_type is int:
+        return b58decode(value)
+    return field_type(value)
+
+
+def route_data(route: str, **fields) -> str:
+    """
+    callback data of a button: route code and its fields joined with a separator,
+    ids in base58, so the button carries everything and nothing is kept on the server
+    """
+    parts = [route]
+    for name, field_type in ROUTE_FIELDS[route]:
+        parts.append(_encode_field(fields[name], field_type))
+    data = SEPARATOR.join(parts)
+    if len(data.encode()) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f'Callback data {data!r} is longer than {CALLBACK_DATA_LIMIT} bytes')
+    return data
+
+
+def parse_data(callback_data) -> typing.Union[None, str, dict]:
+    """
+    plain routes are returned as is, encoded ones as a dict of their fields with the route.
+    Data which can not be decoded (buttons rendered by an older version of the bot) gives None
+    """
+    if not isinstance(callback_data, str):
+        return None
+    route, *values = callback_data.split(SEPARATOR)
+    fields = ROUTE_FIELDS.get(route)
+    if fields is None:
+        return callback_data if not values else None
+    if len(values) != len(fields):
+        return None
+    try:
+        data = {name: _decode_field(value, field_type) for (name, field_type), value in zip(fields, values)}
+    except (KeyError, ValueError):
+        return None
+    data['route'] = route
+    return data
+
+
+class CallbackRouter:
+    """
+    single entry point for all callback queries.
+    The controller is found by the route of the callback data with one dict lookup,
+    data no controller can handle goes to the fallback (main menu)
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._fallback = None
+
+    def add(self, route: str, callback: typing.Callable):
+        self._routes[route] = callback
+
+    def add_controller(self, controller):
+        self.add(controller.route, controller.call)
+
+    def set_fallback(self, callback: typing.Callable):
+        self._fallback = callback
+
+    @staticmethod
+    def route_key(callback_data) -> typing.Union[None, str]:
+        data = parse_data(callback_data)
+        if isinstance(data, dict):
+            return data['route']
+        return data
+
+    def resolve(self, callback_data) -> typing.Union[None, typing.Callable]:
+        return self._routes.get(self.route_key(callback_data), self._fallback)
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        callback = self.resolve(update.callback_query.data)
+        if callback is not None:
+            return await callback(update, context)
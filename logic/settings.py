@@ -2,12 +2,15 @@ from telegram import (
     InlineKeyboardMarkup,
 )
 
-from constants import Languages, BOOLS, USER_LANGUAGES
-from models import User
+from constants import Languages, Routes, BOOLS, USER_LANGUAGES
+from models import run_db
 from logic.base import DefaultMessageHandler
+from logic.router import route_data
 
 
 class SettingsController(DefaultMessageHandler):
+    route = 'settings'
+
     async def _call(self):
         if not self._update.message:
             await self.callback_query.answer()
@@ -25,8 +28,6 @@ class SettingsController(DefaultMessageHandler):
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-        if not self._update.message:
-            self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
         texts = {
@@ -61,16 +62,14 @@ class SettingsController(DefaultMessageHandler):
         buttons.extend(self.attach_back_button('menu'))
         return texts[self.lang], InlineKeyboardMarkup(buttons)
 
-    @staticmethod
-    def pattern(callback_data):
-        return 'settings' == callback_data
-
 
 class NotificationsController(SettingsController):
+    route = 'change_notifications'
+
     async def _call(self):
         await self.callback_query.answer()
 
-        await self.update_settings()
+        await run_db(self.update_settings)
         text, buttons = self._get_data()
         try:
             await self.callback_query.edit_message_text(
@@ -85,21 +84,17 @@ class NotificationsController(SettingsController):
                 disable_notification=self.silent
             )
 
-        self._context.drop_callback_data(self.callback_query)
-
-    async def update_settings(self):
-        user = User.get_by_id(self.user.id)
+    def update_settings(self):
+        user = self.user
         user.extra_data['silent'] = not user.extra_data.get('silent', False)
         user.save()
         self._user = user
 
-    @staticmethod
-    def pattern(callback_data):
-        return 'change_notifications' == callback_data
-
 
 class LanguageController(NotificationsController):
-    async def update_settings(self):
+    route = 'change_language'
+
+    def update_settings(self):
         pass
 
     def _get_data(self):
@@ -110,26 +105,18 @@ class LanguageController(NotificationsController):
         }
 
         buttons = [{'name': Languages.Names[key][self.lang],
-                    'callback_data': {'set_lang': key}} for key in Languages.all()]
+                    'callback_data': route_data(Routes.SetLanguage, lang=key)} for key in Languages.all()]
         buttons = self.build_menu(buttons, raw=True, buttons_in_row=1)
         buttons.extend(self.attach_back_button('settings'))
         return texts[self.lang], InlineKeyboardMarkup(buttons)
 
-    @staticmethod
-    def pattern(callback_data):
-        return 'change_language' == callback_data
-
 
 class LanguageSetterController(LanguageController):
-    async def update_settings(self):
-        user = User.get_by_id(self.user.id)
-        user.lang = self.callback_query.data['set_lang']
+    route = Routes.SetLanguage
+
+    def update_settings(self):
+        user = self.user
+        user.lang = self.callback_data['lang']
         user.save()
         self._user = user
         USER_LANGUAGES[user.id] = user.lang
-
-    @staticmethod
-    def pattern(callback_data):
-        if type(callback_data) == dict:
-            return callback_data.get('set_lang')
-        return False
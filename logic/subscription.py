@@ -9,22 +9,27 @@ from datetime import timedelta, datetime
 
 from constants import (
     DATE_FORMAT,
+    Routes,
     SubscriptionValue
 )
 from config import PAYMENT_TOKEN, CURRENCY
 from models import (
+    run_db,
     User,
     Subscription
 )
 from logic.base import DefaultMessageHandler
+from logic.router import route_data
 
 
 class SubscriptionMenuController(DefaultMessageHandler):
+    route = 'subscription'
+
     async def _call(self):
         if not self._update.message:
             await self.callback_query.answer()
 
-        text, buttons = self._get_data()
+        text, buttons = await run_db(self._get_data)
         try:
             await self.callback_query.edit_message_text(
                 text=text,
@@ -37,8 +42,6 @@ class SubscriptionMenuController(DefaultMessageHandler):
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-        if not self._update.message:
-            self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
         end_date = self.user.subscription_end.strftime(DATE_FORMAT)
@@ -66,25 +69,23 @@ class SubscriptionMenuController(DefaultMessageHandler):
         }
 
         buttons = [{'name': s.name[self.lang],
-                    'callback_data': {'subscription': True,
-                                      'subscription_id': s.unique_id}} for s in (Subscription
-                                                                                 .select()
-                                                                                 .order_by(Subscription.id.asc()))]
+                    'callback_data': route_data(Routes.Invoice,
+                                                subscription=s.id)} for s in (Subscription
+                                                                              .select()
+                                                                              .order_by(Subscription.id.asc()))]
         buttons = self.build_menu(buttons, raw=True, buttons_in_row=1)
         buttons.extend(self.attach_back_button('menu'))
         return texts[self.lang], InlineKeyboardMarkup(buttons)
 
-    @staticmethod
-    def pattern(callback_data):
-        return 'subscription' == callback_data
-
 
 class InvoiceController(DefaultMessageHandler):
+    route = Routes.Invoice
+
     async def _call(self):
         if not self._update.message:
             await self.callback_query.answer()
 
-        title, description, prices, payload = self._get_data()
+        title, description, prices, payload = await run_db(self._get_data)
         try:
             await self.callback_query.delete_message()
         finally:
@@ -100,13 +101,11 @@ class InvoiceController(DefaultMessageHandler):
                 suggested_tip_amounts=[100, 500, 1000, 2500],
                 disable_notification=self.silent
             )
-        if not self._update.message:
-            self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
-        callback_data = self.callback_query.data
+        callback_data = self.callback_data
         self._log.info(f'Callback data - {callback_data}')
-        subscription = Subscription.get(unique_id=callback_data["subscription_id"])
+        subscription = Subscription.get_by_id(callback_data["subscription"])
 
         payload = {
             'subscription_id': subscription.unique_id,
@@ -135,12 +134,6 @@ class InvoiceController(DefaultMessageHandler):
 
         return title[self.lang], description[self.lang], prices, payload
 
-    @staticmethod
-    def pattern(callback_data):
-        if type(callback_data) == dict:
-            return callback_data.get('subscription')
-        return False
-
 
 class CheckoutController(DefaultMessageHandler):
     async def _call(self):
@@ -148,13 +141,7 @@ class CheckoutController(DefaultMessageHandler):
         invoice_payload = query.invoice_payload
         try:
             if type(invoice_payload) == dict:
-                if ((User.select()
-                        .where(User.id == invoice_payload['user_id'])
-                        .exists())
-                        and (Subscription
-                                .select()
-                                .where(Subscription.unique_id == invoice_payload['subscription_id'])
-                                .exists())):
+                if await run_db(self._is_valid_payload, invoice_payload):
                     await query.answer(ok=True)
                     return
             await query.answer(ok=True)
@@ -162,11 +149,20 @@ class CheckoutController(DefaultMessageHandler):
             self._log(traceback.format_exc())
             await query.answer(ok=False, error_message="Something went wrong...")
 
+    @staticmethod
+    def _is_valid_payload(invoice_payload):
+        return ((User.select()
+                 .where(User.id == invoice_payload['user_id'])
+                 .exists())
+                and (Subscription
+                     .select()
+                     .where(Subscription.unique_id == invoice_payload['subscription_id'])
+                     .exists()))
+
 
 class SuccessInvoiceController(DefaultMessageHandler):
     async def _call(self):
-        user = await self._update_subscription_end()
-        text, buttons = self._get_data(user)
+        text, buttons = await run_db(self._get_success_data)
         await self._context.bot.sendMessage(
             chat_id=self.chat_id,
             text=text,
@@ -174,6 +170,10 @@ class SuccessInvoiceController(DefaultMessageHandler):
             disable_notification=self.silent
         )
 
+    def _get_success_data(self):
+        user = self._update_subscription_end()
+        return self._get_data(user)
+
     def _get_data(self, user):
         subscription = user.subscription
         text = {
@@ -192,11 +192,11 @@ class SuccessInvoiceController(DefaultMessageHandler):
 
         return text[self.lang], buttons
 
-    async def _update_subscription_end(self):
+    def _update_subscription_end(self):
         payload_data = self._update.message.effective_attachment['invoice_payload']
         payload_data = json.loads(payload_data) if type(payload_data) == str else payload_data
         self._log.info(f'Invoice data - {payload_data}')
-        user = User.get_by_id(payload_data['user_id'])
+        user = User.get_cached(user_id=payload_data['user_id'])
         user.subscription_end = max(user.subscription_end,
                                     datetime.now()) + timedelta(days=30)
         subscription = Subscription.get(unique_id=payload_data['subscription_id'])
@@ -1,32 +1,37 @@
 import re
-import typing
-from collections import defaultdict
 from datetime import datetime
 from peewee import fn
-from random import choice
 from telegram import (
     InlineKeyboardMarkup,
 )
 
 from models import (
     db,
-    MuscleGroup,
-    Exercise,
-    Tool,
+    end_training,
+    run_db,
+    training_sessions,
     Set,
+    LastSet,
     Training,
-    User
+    TrainingSession
 )
+from catalog import catalog
+from constants import Routes
 from logic.base import DefaultMessageHandler
+from logic.router import route_data
+from managers.end_training import training_summary
+from media import registry
+from renders import message_renders
 
 
 class MuscleGroupsController(DefaultMessageHandler):
+    route = 'start_training'
     check_subscription = True
 
     async def _call(self):
         await self.callback_query.answer()
 
-        text, buttons = self._get_data()
+        text, buttons = await run_db(self._get_data)
         if (self.callback_query.message.video or
                 self.callback_query.message.photo):
             try:
@@ -52,33 +57,29 @@ class MuscleGroupsController(DefaultMessageHandler):
                     disable_notification=self.silent
                 )
 
-        self._context.drop_callback_data(self.callback_query)
-
     def _get_data(self):
         texts = {
             'en': '💪Select muscle group:',
             'ru': '💪Выбери группу мышц:',
             'ua': "💪Обери групу м'язів",
         }
-        groups = MuscleGroup.select().order_by(MuscleGroup.order)
+        groups = catalog.snapshot.groups
         buttons = [{'name': group.name[self.lang],
-                    'callback_data': {'group': group.unique_id}} for group in groups]
+                    'callback_data': route_data(Routes.ExerciseTools,
+                                               group=group.id)} for group in groups]
         buttons = self.build_menu(buttons, raw=True)
         buttons.extend(self.attach_back_button('menu'))
         return texts[self.lang], InlineKeyboardMarkup(buttons)
 
-    @staticmethod
-    def pattern(callback_data):
-        return 'start_training' == callback_data
-
 
 class ExerciseToolController(DefaultMessageHandler):
+    route = Routes.ExerciseTools
     check_subscription = True
 
     async def _call(self):
         await self.callback_query.answer()
 
-        text, buttons = self._get_data()
+        text, buttons = await run_db(self._get_data)
 
         try:
             await self.callback_query.edit_message_text(
@@ -92,13 +93,13 @@ class ExerciseToolController(DefaultMessageHandler):
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-        self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
-        callback_data = self.callback_query.data
+        callback_data = self.callback_data
         self._log.info(f'Callback data - {callback_data}')
 
-        group = MuscleGroup.get(unique_id=callback_data['group'])
+        snapshot = catalog.snapshot
+        group = snapshot.group_by_id[callback_data['group']]
 
         header = f'💪 {group.name[self.lang].upper()}\n'
         texts = {
@@ -108,36 +109,21 @@ class ExerciseToolController(DefaultMessageHandler):
         }
 
         buttons = [{'name': tool.name[self.lang],
-                    'callback_data': {
-                        'group': callback_data['group'],
-                        'tool': tool.id}} for tool in (Tool
-                                                       .select(fn.DISTINCT(Tool.id),
-                                                               Tool.name,
-                                                               Tool.order,
-                                                               Tool.created)
-                                                       .join(Exercise)
-                                                       .join(MuscleGroup)
-                                                       .where(MuscleGroup.unique_id == callback_data['group'])
-                                                       .order_by(Tool.order,
-                                                                 Tool.created))]
+                    'callback_data': route_data(Routes.GroupExercises,
+                                                group=callback_data['group'],
+                                                tool=tool.id)} for tool in snapshot.tools(group.id)]
         buttons = self.build_menu(buttons, buttons_in_row=1, raw=True)
         buttons.extend(self.attach_back_button('start_training'))
         return texts[self.lang], InlineKeyboardMarkup(buttons)
 
-    @staticmethod
-    def pattern(callback_data):
-        if type(callback_data) == dict:
-            return (callback_data.get('group') is not None and
-                    callback_data.get('tool') is None)
-        return False
-
 
 class GroupExercisesController(DefaultMessageHandler):
+    route = Routes.GroupExercises
     check_subscription = True
 
     async def _call(self):
         await self.callback_query.answer()
-        buttons, text = self._get_data()
+        buttons, text = await run_db(self._get_data)
         if self.callback_query.message.text:
             try:
                 await self.callback_query.edit_message_text(
@@ -161,31 +147,22 @@ class GroupExercisesController(DefaultMessageHandler):
                     reply_markup=buttons,
                     disable_notification=self.silent
                 )
-        self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
-        callback_data = self.callback_query.data
+        callback_data = self.callback_data
         self._log.info(f'Callback data - {callback_data}')
 
-        exercises = list(Exercise
-                         .select()
-                         .join(MuscleGroup)
-                         .where(MuscleGroup.unique_id == callback_data['group'],
-                                Exercise.tool_id == callback_data['tool'])
-                         .order_by(Exercise.order,
-                                   Exercise.created)
-                         )
+        snapshot = catalog.snapshot
+        exercises = snapshot.exercises(callback_data['group'], callback_data['tool'])
         sets = (Set
-                .select()
+                .select(Set.exercise_id, fn.COUNT(Set.id).alias('sets'))
                 .where(Set.user == self.user,
-                       Set.exercise_id.in_([e.id for e in exercises])))
-        exercise_order = defaultdict(int)
-        recent_exercises = []
-        for s in sets:
-            exercise_order[s.exercise_id] += 1
-            name = s.exercise.name
-            name = name.get(self.lang, name['en'])
-            recent_exercises.append(f'• {name}')
+                       Set.exercise_id.in_([e.id for e in exercises]))
+                .group_by(Set.exercise_id)
+                .tuples())
+        exercise_order = dict(sets)
+        exercise_names = snapshot.exercise_names[self.lang]
+        recent_exercises = [f'• {exercise_names[exercise_id]}' for exercise_id in exercise_order]
 
         ex = exercises[0]
         header = f'💪 {ex.group.name[self.lang].upper()} | {ex.tool.name[self.lang].upper()}\n'
@@ -208,52 +185,43 @@ class GroupExercisesController(DefaultMessageHandler):
         exercises = sorted(exercises, key=lambda x: exercise_order.get(x.id, 0), reverse=True)
 
         buttons = [{'name': exc.get_name(self.lang),
-                    'callback_data': {'group': exc.group.unique_id,
-                                      'tool': exc.tool_id,
-                                      'exercise': exc.unique_id}} for exc in exercises]
+                    'callback_data': route_data(Routes.Exercise,
+                                                exercise=exc.id)} for exc in exercises]
 
         buttons = self.build_menu(buttons, buttons_in_row=2, raw=True)
 
-        buttons.extend(self.attach_back_button({'group': callback_data['group']}))
+        buttons.extend(self.attach_back_button(route_data(Routes.ExerciseTools,
+                                                          group=callback_data['group'])))
         return InlineKeyboardMarkup(buttons), text
 
-    @staticmethod
-    def pattern(callback_data):
-        if type(callback_data) == dict:
-            return (callback_data.get('group') is not None and
-                    callback_data.get('tool') is not None and
-                    callback_data.get('exercise') is None)
-        return False
-
 
 class ExerciseController(DefaultMessageHandler):
+    route = Routes.Exercise
     check_subscription = True
 
     async def _call(self):
         await self.callback_query.answer()
-        media, text, buttons = self._get_data()
+        path, text, buttons = await run_db(self._get_data)
         try:
             await self.callback_query.delete_message()
         finally:
-            await self._context.bot.sendVideo(
+            await registry.send(
+                self._context.bot,
+                path,
                 chat_id=self.chat_id,
                 height=1920,
                 width=1080,
-                video=media,
                 caption=text,
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-            self._context.drop_callback_data(self.callback_query)
 
     def _get_data(self):
-        callback_data = self.callback_query.data
+        callback_data = self.callback_data
         self._log.info(f'Callback data - {callback_data}')
-        exercise = Exercise.get(unique_id=callback_data['exercise'])
+        exercise = catalog.snapshot.exercise_by_id[callback_data['exercise']]
 
-        path = self._static_path + exercise.media[self.gender][0]
-        with open(path, 'rb') as f:
-            media = f.read()
+        path = exercise.media[self.gender][0]
 
         ex_name = exercise.get_name(self.lang)
         header = f'💪 {exercise.group.name[self.lang].upper()} | {exercise.tool.name[self.lang].upper()}'
@@ -263,31 +231,28 @@ class ExerciseController(DefaultMessageHandler):
         text = f'{header}\n\n{ex_name}\n\n{description}'
 
         buttons_texts = {'ru': [{'name': 'Начать упражнение 💪',
-                                 'callback_data': {'start_exercise': exercise.unique_id}}],
+                                 'callback_data': route_data(Routes.StartExercise,
+                                                             exercise=exercise.id)}],
                          'en': [{'name': 'Start exercise 💪',
-                                 'callback_data': {'start_exercise': exercise.unique_id}}],
+                                 'callback_data': route_data(Routes.StartExercise,
+                                                             exercise=exercise.id)}],
                          'ua': [{'name': 'Почати вправу 💪',
-                                 'callback_data': {'start_exercise': exercise.unique_id}}]
+                                 'callback_data': route_data(Routes.StartExercise,
+                                                             exercise=exercise.id)}]
                          }
 
         buttons = self.build_menu(buttons_texts[self.lang],
                                   buttons_in_row=1,
                                   raw=True)
         if self.user.extra_data.get('next_program_trainings') is None:
-            buttons.extend(self.attach_back_button({'group': exercise.group.unique_id,
-                                                    'tool': exercise.tool_id}))
-        return media, text, InlineKeyboardMarkup(buttons)
-
-    @staticmethod
-    def pattern(callback_data):
-        if type(callback_data) == dict:
-            return (callback_data.get('group') is not None and
-                    callback_data.get('tool') is not None and
-                    callback_data.get('exercise') is not None)
-        return False
+            buttons.extend(self.attach_back_button(route_data(Routes.GroupExercises,
+                                                              group=exercise.group_id,
+                                                              tool=exercise.tool_id)))
+        return path, text, InlineKeyboardMarkup(buttons)
 
 
 class StartExerciseController(DefaultMessageHandler):
+    route = Routes.StartExercise
     check_subscription = True
     end_buttons = {
         'ru': [{'name': 'Закончить тренировку 🚫',
@@ -300,7 +265,7 @@ class StartExerciseController(DefaultMessageHandler):
 
     async def _call(self):
         await self.callback_query.answer()
-        text, buttons, exercise = self._get_data()
+        text, buttons, exercise = await run_db(self._get_data)
         try:
             await self.callback_query.delete_message()
         finally:
@@ -310,13 +275,12 @@ class StartExerciseController(DefaultMessageHandler):
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-            await self._update_training(exercise, msg)
-            self._context.drop_callback_data(self.callback_query)
+            await run_db(self._update_training, exercise, msg)
 
     def _get_data(self):
-        callback_data = self.callback_query.data
+        callback_data = self.callback_data
         self._log.info(f'Callback data - {callback_data}')
-        exercise = Exercise.get(unique_id=callback_data['start_exercise'])
+        exercise = catalog.snapshot.exercise_by_id[callback_data['exercise']]
 
         text = self._get_text(exercise)
 
@@ -333,8 +297,9 @@ class StartExerciseController(DefaultMessageHandler):
             buttons = self.build_menu(self.end_buttons[self.lang],
                                       buttons_in_row=1,
                                       raw=True)
-            buttons.extend(self.attach_back_button({'group': exercise.group.unique_id,
-                                                    'tool': exercise.tool_id},
+            buttons.extend(self.attach_back_button(route_data(Routes.GroupExercises,
+                                                              group=exercise.group_id,
+                                                              tool=exercise.tool_id),
                                                    names={'en': 'Next exercise 💪',
                                                           'ru': 'Следующее упражнение 💪',
                                                           'ua': 'Наступна вправа 💪'}))
@@ -343,10 +308,8 @@ class StartExerciseController(DefaultMessageHandler):
                                                           'ru': 'К группам мышц 👈',
                                                           'ua': "До груп м'язiв 👈"}))
         elif next_program_trainings:
-            next_exercise = Exercise.get_by_id(next_program_trainings[-2])
-            buttons = self.attach_back_button({"group": next_exercise.group.id,
-                                               "tool": next_exercise.tool.id,
-                                               "exercise": next_exercise.unique_id},
+            buttons = self.attach_back_button(route_data(Routes.Exercise,
+                                                         exercise=next_program_trainings[-2]),
                                               names={'en': 'Next exercise 💪',
                                                      'ru': 'Следующее упражнение 💪',
                                                      'ua': 'Наступна вправа 💪'})
@@ -356,32 +319,20 @@ class StartExerciseController(DefaultMessageHandler):
                                       raw=True)
         return text, InlineKeyboardMarkup(buttons), exercise
 
-    @staticmethod
-    def pattern(callback_data):
-        if type(callback_data) == dict:
-            return callback_data.get('start_exercise') is not None
-        return False
-
     def _get_text(self, exercise):
-        previous_set = (Set
-                        .select()
-                        .where(Set.user == self.user,
-                               Set.exercise == exercise,
-                               Set.end.is_null(False))
-                        .order_by(Set.id.desc()))
+        previous_reps = LastSet.reps_of(self.user.id, exercise.id)
 
         need_weight = exercise.tool.need_weight
         ex_name = exercise.get_name(self.lang)
         if ex_name is None:
             ex_name = exercise.name['en']
-        if previous_set.exists():
-            previous_set = previous_set.first()
+        if previous_reps is not None:
             if need_weight:
                 data = '\n'.join(['{}. {} - {} kg'.format(index + 1, rep['reps'], rep['weight'])
-                                  for index, rep in enumerate(previous_set.data)])
+                                  for index, rep in enumerate(previous_reps)])
             else:
                 data = '\n'.join(
-                    ['{}. {}'.format(index + 1, rep['reps']) for index, rep in enumerate(previous_set.data)])
+                    ['{}. {}'.format(index + 1, rep['reps']) for index, rep in enumerate(previous_reps)])
             text = {
                 'en': f'Exercise - {ex_name}\n'
                       f'Previous reps:\n'
@@ -411,7 +362,7 @@ class StartExerciseController(DefaultMessageHandler):
             }
         return text[self.lang]
 
-    async def _update_training(self, exercise, msg):
+    def _update_training(self, exercise, msg):
         with db.atomic():
             training = (Training
                         .select()
@@ -423,11 +374,11 @@ class StartExerciseController(DefaultMessageHandler):
                 )
                 self._get_set(exercise, training)
 
-            user = User.get_by_id(self.user.id)
+            training_sessions.drop(self.user.id)
+            user = self.user
             user.extra_data['last_exercise'] = exercise.id
             user.extra_data['message_id'] = msg.message_id
             user.save()
-            self._user = user
             return training
 
     def _get_set(self, exercise, training):
@@ -448,55 +399,130 @@ class StartExerciseController(DefaultMessageHandler):
 
 class UpdateSetController(StartExerciseController):
     update_set = True
+    closed_texts = {
+        'en': 'Your training was finished automatically after a long break 🏁\n'
+              'Choose an exercise to start a new one',
+        'ru': 'Ваша тренировка была завершена автоматически после долгого перерыва 🏁\n'
+              'Выберите упражнение, чтобы начать новую',
+        'ua': 'Ваше тренування було завершено автоматично після довгої перерви 🏁\n'
+              'Оберіть вправу, щоб почати нове'
+    }
+    not_saved_texts = {
+        'en': 'The set was not saved, please send it again',
+        'ru': 'Подход не сохранён, отправьте его ещё раз',
+        'ua': 'Підхід не збережено, надішліть його ще раз'
+    }
 
     async def _call(self):
-        current_set = self._update_set()
-        text, buttons = self._get_data(current_set)
-        user = User.get_by_id(self.user.id)
-        if user.extra_data.get('message_id'):
-            await self.bot.edit_message_text(
-                text=text,
+        text, buttons, notice, message_id = await run_db(self._get_update_data)
+        if notice:
+            await self._context.bot.sendMessage(
                 chat_id=self.chat_id,
-                message_id=user.extra_data['message_id'],
+                text=text,
                 reply_markup=buttons,
+                disable_notification=self.silent
             )
-
-    def _update_set(self):
-        user = User.get_by_id(self.user.id)
-        exercise = Exercise.get_by_id(user.extra_data['last_exercise'])
+        elif message_id:
+            message_renders.edit(self.bot, self.chat_id, message_id, text, buttons)
+
+    def _get_update_data(self):
+        text, buttons, notice = self._get_set_data()
+        return text, buttons, notice, self.user.extra_data.get('message_id')
+
+    def _get_set_data(self):
+        """
+        text and buttons of the live set message, or of a notice (the third item is True then)
+        when the training was finished meanwhile, e.g. by the sweeper, or the rep was not saved
+        """
+        session = self._get_session()
+        if session is None:
+            return self._get_closed_data()
+        if self.update_set:
+            session, saved = self._update_set(session)
+            if session is None:
+                return self._get_closed_data()
+            if not saved:
+                return self.not_saved_texts[self.lang], None, True
+        return (*self._get_data(session), False)
+
+    def _get_closed_data(self):
+        buttons = self.attach_back_button('start_training',
+                                          names={'en': 'To muscle groups 👈',
+                                                 'ru': 'К группам мышц 👈',
+                                                 'ua': "До груп м'язiв 👈"})
+        return self.closed_texts[self.lang], InlineKeyboardMarkup(buttons), True
+
+    def _get_session(self):
+        exercise_id = self.user.extra_data['last_exercise']
+        session = training_sessions.get(self.user.id)
+        if session is None or session.exercise_id != exercise_id:
+            session = self._load_session(exercise_id)
+        return session
+
+    def _load_session(self, exercise_id):
+        """
+        the session of the user's open training, None if there is none
+        """
         training = (Training
-                    .select()
+                    .select(Training.id)
                     .where(Training.user == self.user,
                            Training.end.is_null())
                     .first())
-        tr_set = self._get_set(exercise, training)
-        if self.update_set:
-            if self._update.edited_message:
-                text = self._update.edited_message.text
-                tr_set.data.pop()
-            else:
-                text = self._update.message.text
-            data = re.findall(r'\d+(?:[.,]\d+)?', text)
-            tr_set.data.append({
-                'reps': int(data[0]),
-                'weight': 0 if len(data) == 1 else float(data[1].replace(',', '.')),
-                'timestamp': datetime.now().timestamp()
-            })
-            tr_set.save()
-        return tr_set
-
-    def _get_data(self, tr_set):
-        text = self._get_text(tr_set)
-
-        exercise = tr_set.exercise
+        if training is None:
+            return None
+        tr_set = (Set
+                  .select(Set.id, Set.data)
+                  .where(Set.user == self.user,
+                         Set.training_id == training.id,
+                         Set.exercise_id == exercise_id,
+                         Set.end.is_null())
+                  .first())
+        session = TrainingSession(user_id=self.user.id,
+                                  training_id=training.id,
+                                  exercise_id=exercise_id,
+                                  set_id=tr_set.id if tr_set else None,
+                                  reps=tr_set.data if tr_set else None,
+                                  previous_reps=LastSet.reps_of(self.user.id, exercise_id))
+        training_sessions.put(session)
+        return session
+
+    def _update_set(self, session):
+        """
+        log the rep of the message, returns the session it went to (None if the training was finished)
+        and whether it was saved
+        """
+        replace_last = bool(self._update.edited_message)
+        if replace_last:
+            text = self._update.edited_message.text
+        else:
+            text = self._update.message.text
+        data = re.findall(r'\d+(?:[.,]\d+)?', text)
+        rep = {
+            'reps': int(data[0]),
+            'weight': 0 if len(data) == 1 else float(data[1].replace(',', '.')),
+            'timestamp': datetime.now().timestamp()
+        }
+        if not training_sessions.log_rep(session, rep, replace_last):
+            # the set or the training was finished outside of this process, e.g. by the sweeper
+            session = self._load_session(session.exercise_id)
+            if session is None:
+                return None, False
+            return session, training_sessions.log_rep(session, rep, replace_last)
+        return session, True
+
+    def _get_data(self, session):
+        text = self._get_text(session)
+
+        exercise = catalog.snapshot.exercise_by_id[session.exercise_id]
         next_program_trainings = self.user.extra_data.get('next_program_trainings')
 
         if next_program_trainings is None:
             buttons = self.build_menu(self.end_buttons[self.lang],
                                       buttons_in_row=1,
                                       raw=True)
-            buttons.extend(self.attach_back_button({'group': exercise.group.unique_id,
-                                                    'tool': exercise.tool_id},
+            buttons.extend(self.attach_back_button(route_data(Routes.GroupExercises,
+                                                              group=exercise.group_id,
+                                                              tool=exercise.tool_id),
                                                    names={'en': 'Next exercise 💪',
                                                           'ru': 'Следующее упражнение 💪',
                                                           'ua': 'Наступна вправа 💪'}))
@@ -505,10 +531,8 @@ class UpdateSetController(StartExerciseController):
                                                           'ru': 'К группам мышц 👈',
                                                           'ua': "До груп м'язiв 👈"}))
         elif next_program_trainings:
-            exercise = Exercise.get_by_id(next_program_trainings[-2])
-            buttons = self.attach_back_button({"group": exercise.group.id,
-                                               "tool": exercise.tool.id,
-                                               "exercise": exercise.unique_id},
+            buttons = self.attach_back_button(route_data(Routes.Exercise,
+                                                         exercise=next_program_trainings[-2]),
                                               names={'en': 'Next exercise 💪',
                                                      'ru': 'Следующее упражнение 💪',
                                                      'ua': 'Наступна вправа 💪'})
@@ -518,31 +542,25 @@ class UpdateSetController(StartExerciseController):
                                       raw=True)
         return text, InlineKeyboardMarkup(buttons)
 
-    def _get_text(self, tr_set):
-        need_weight = tr_set.exercise.tool.need_weight
-        ex_name = tr_set.exercise.get_name(self.lang)
-        previous_set = (Set
-                        .select()
-                        .where(Set.user == self.user,
-                               Set.exercise == tr_set.exercise,
-                               Set.end.is_null(False))
-                        .order_by(Set.created.desc()))
+    def _get_text(self, session):
+        exercise = catalog.snapshot.exercise_by_id[session.exercise_id]
+        need_weight = exercise.tool.need_weight
+        ex_name = exercise.get_name(self.lang)
         previous_data = []
-        if previous_set.exists():
-            previous_set = previous_set.first()
+        if session.previous_reps is not None:
             if need_weight:
                 previous_data = '\n'.join(
                     ['{}. {} - {} kg'.format(index + 1, rep['reps'], rep['weight'])
-                     for index, rep in enumerate(previous_set.data)])
+                     for index, rep in enumerate(session.previous_reps)])
             else:
                 previous_data = '\n'.join(['{}. {}'.format(index + 1, rep['reps'])
-                                           for index, rep in enumerate(previous_set.data)])
+                                           for index, rep in enumerate(session.previous_reps)])
 
         if need_weight:
             data = '\n'.join(['{}. {} - {} kg'.format(index + 1, rep['reps'], rep['weight'])
-                              for index, rep in enumerate(tr_set.data)])
+                              for index, rep in enumerate(session.reps)])
         else:
-            data = '\n'.join(['{}. {}'.format(index + 1, rep['reps']) for index, rep in enumerate(tr_set.data)])
+            data = '\n'.join(['{}. {}'.format(index + 1, rep['reps']) for index, rep in enumerate(session.reps)])
         text = {
             'en': f'Exercise - {ex_name}\n' + ("Last reps:\n" + f"{previous_data}" + '\n' if previous_data else '') +
                   f'Current reps:\n'
@@ -570,6 +588,7 @@ class UpdateSetController(StartExerciseController):
 
 
 class CheckEndTrainingController(UpdateSetController):
+    route = 'stop_training_check'
     update_set = False
     end_buttons = {
         'ru': [{'name': 'Вы уверены ⁉️',
@@ -582,8 +601,8 @@ class CheckEndTrainingController(UpdateSetController):
 
     async def _call(self):
         await self.callback_query.answer()
-        current_set = self._update_set()
-        text, buttons = self._get_data(current_set)
+        text, buttons, _ = await run_db(self._get_set_data)
+        message_renders.discard(self.chat_id, self.callback_query.message.message_id)
         try:
             await self.callback_query.edit_message_text(
                 text=text,
@@ -596,48 +615,34 @@ class CheckEndTrainingController(UpdateSetController):
                 reply_markup=buttons,
                 disable_notification=self.silent
             )
-        self._context.drop_callback_data(self.callback_query)
-
-    @staticmethod
-    def pattern(callback_data):
-        return callback_data == 'stop_training_check'
 
 
 class EndTrainingController(DefaultMessageHandler):
-    gifs = (
-        'static/end_training/cat-meme.mp4',
-        'static/end_training/curls-gym.mp4',
-        'static/end_training/funny-workout.mp4',
-        'static/end_training/gym-fail.mp4',
-        'static/end_training/gym-passedout.mp4',
-        'static/end_training/gym-time.mp4',
-        'static/end_training/hasbulla-hasbullah.mp4',
-        'static/end_training/ukr.mp4'
-    )
+    route = 'stop_training'
 
     async def _call(self):
         if not self._update.message:
             await self.callback_query.answer()
 
-        training, sets = self._end_training()
-        texts, gif = self._get_data(training, sets)
+        text, gif = await run_db(self._get_end_data)
         if gif is not None:
             try:
                 await self.callback_query.delete_message()
             finally:
-                await self._context.bot.sendVideo(
+                await registry.send(
+                    self._context.bot,
+                    gif,
                     chat_id=self.chat_id,
-                    video=gif,
-                    caption=texts[self.lang],
+                    caption=text,
                     disable_notification=self.silent
                 )
-                text = {
+                menu_texts = {
                     'en': 'Menu:',
                     'ru': 'Меню:',
                     'ua': 'Меню:'
                 }
                 await self._context.bot.sendMessage(
-                    text=text[self.lang],
+                    text=menu_texts[self.lang],
                     chat_id=self.chat_id,
                     reply_markup=self.build_menu(self._menu_buttons[self.lang]),
                     disable_notification=self.silent
@@ -645,95 +650,10 @@ class EndTrainingController(DefaultMessageHandler):
         else:
             await self._context.bot.sendMessage(
                 chat_id=self.chat_id,
-                text=texts[self.lang],
+                text=text,
                 reply_markup=self.build_menu(self._menu_buttons[self.lang]),
                 disable_notification=self.silent
             )
-        if not self._update.message:
-            self._context.drop_callback_data(self.callback_query)
-
-    def _get_data(self, training: typing.Union['Training', None], sets: list['Set']):
-        if training is None:
-            texts = {
-                'en': "You didn't start a workout to finish it. Let's fix it!",
-                'ru': 'Ты не начинал тренировку, чтобы её заканчивать. Надо это исправлять!',
-                'ua': 'Ти не починав тренування, щоб його закінчувати. Потрібно це виправляти!'
-            }
-            return texts, None
-
-        training_time = (training.end - training.created).total_seconds()
-        exercises = []
-        weight_lifted = 0
-        avg_set_duration = 0
-        avg_rest_duration = 0
-        exc_num = 0
-        for s in sets:
-            exc = f'\t - {s.exercise.get_name(self.lang)}'
-            if exc not in exercises:
-                exercises.append(exc)
-            for i in range(len(s.data)):
-                weight_lifted += s.data[i].get('weight', 0) * s.data[i].get('reps', 0)
-                if i == len(s.data) - 1:
-                    pass
-                else:
-                    avg_rest_duration += s.data[i + 1]['timestamp'] - s.data[i]['timestamp']
-            exc_num += len(s.data)
-            avg_set_duration += s.data[-1]['timestamp'] - s.data[0]['timestamp']
-        exercises = '\n'.join(exercises)
-        weight_lifted = round(weight_lifted)
-        avg_set_duration = round(avg_set_duration / max(len(sets), 1))
-        avg_rest_duration = round(avg_rest_duration / max(exc_num, 1))
-
-        texts = {'en': 'Training summary:\n'
-                       f'• Exercises: \n{exercises}\n'
-                       f'• Weight lifted: {weight_lifted} kg\n'
-                       f'• Training time: {int(training_time // 60)} min. {int(training_time % 60)} sec. \n'
-                       f'• Avg. set duration: {avg_set_duration // 60} min. {avg_set_duration % 60} sec.\n'
-                       f'• Avg. rest duration: {avg_rest_duration // 60} min. {avg_rest_duration % 60} sec.',
-                 'ru': 'Итог тренировки:\n'
-                       f'• Упражнения: \n{exercises}\n'
-                       f'• Поднятый вес: {weight_lifted} kg\n'
-                       f'• Время тренировки: {int(training_time // 60)} min. {int(training_time % 60)} sec. \n'
-                       f'• Среднее время на упражнение: {avg_set_duration // 60} min. {avg_set_duration % 60} sec.\n'
-                       f'• Среднее время отдыха: {avg_rest_duration // 60} min. {avg_rest_duration % 60} sec.',
-                 'ua': 'Підсумок тренування:\n'
-                       f'• Вправи: \n{exercises}\n'
-                       f'• Піднята вага: {weight_lifted} kg\n'
-                       f'• Час тренування: {int(training_time // 60)} min. {int(training_time % 60)} sec. \n'
-                       f'• Середній час на вправу: {avg_set_duration // 60} min. {avg_set_duration % 60} sec.\n'
-                       f'• Сeредній час відпочинку: {avg_rest_duration // 60} min. {avg_rest_duration % 60} sec.', }
-
-        with open(self._static_path + choice(self.gifs), 'rb') as f:
-            gif = f.read()
-
-        return texts, gif
-
-    def _end_training(self):
-        sets = []
-        with db.atomic():
-            last_training = (
-                Training
-                .select()
-                .where(Training.user == self.user,
-                       Training.end.is_null()))
-            last_training = last_training.first()
-            if last_training is not None:
-                tr_sets = Set.select().where(Set.training == last_training)
-                for tr_set in tr_sets:
-                    tr_set = Set.get_by_id(tr_set)
-                    if tr_set.data:
-                        end = tr_set.data[-1]
-                        tr_set.end = datetime.fromtimestamp(end['timestamp'])
-                        sets.append(tr_set)
-                        tr_set.save()
-                    else:
-                        tr_set.delete_instance()
-                last_training.end = datetime.now()
-                last_training.save()
-            self.user.extra_data['next_program_trainings'] = None
-            self.user.save()
-        return last_training, sets
 
-    @staticmethod
-    def pattern(callback_data):
-        return callback_data == 'stop_training'
+    def _get_end_data(self):
+        return training_summary(end_training(self.user), self.lang)
@@ -1,16 +1,47 @@
+import asyncio
+
 from telegram import Update
 from telegram.ext import (
     filters,
     Application,
-    PicklePersistence,
     CallbackQueryHandler,
     CommandHandler,
     MessageHandler,
     PreCheckoutQueryHandler
 )
 
-from config import TOKEN
+from config import (
+    TOKEN,
+    CATALOG_CHECK_INTERVAL,
+    CONCURRENT_UPDATES,
+    DB_METRICS_INTERVAL,
+    INTERACTIONS_FLUSH_INTERVAL,
+    LANE_MAX_DEPTH,
+    LANES_METRICS_INTERVAL,
+    PERSISTENCE_CLEANUP_INTERVAL,
+    TRAINING_IDLE_TIMEOUT,
+    TRAINING_SWEEP_BATCH,
+    TRAINING_SWEEP_INTERVAL,
+    UPDATE_QUEUE_SIZE,
+    UPDATES_MODE,
+    USER_CACHE_LISTEN_RETRY,
+    WEBHOOK
+)
+from constants import UpdateModes
+from models import (
+    flush_interactions,
+    interaction_buffer,
+    log_pool_metrics,
+    run_db,
+    watch_users
+)
+from catalog import catalog, watch_catalog
+from lanes import LanedApplication, log_lane_metrics
+from managers.end_training import sweep_trainings
+from persistence import cleanup_persistence, get_persistence
+from renders import message_renders
 from logic.base import Registration
+from logic.router import CallbackRouter
 from logic.training import (
     MuscleGroupsController,
     ExerciseToolController,
@@ -62,18 +93,110 @@ from logic.programs import (
 )
 
 
-def init_app():
-    persistence = PicklePersistence(filepath="gymbuddybot")
+_background_tasks = []
+
+
+def start_background_task(coroutine):
+    _background_tasks.append(asyncio.get_running_loop().create_task(coroutine))
+
+
+async def post_init(application):
+    await run_db(catalog.reload)
+    start_background_task(watch_catalog(CATALOG_CHECK_INTERVAL))
+    start_background_task(watch_users(USER_CACHE_LISTEN_RETRY))
+    if DB_METRICS_INTERVAL:
+        start_background_task(log_pool_metrics(DB_METRICS_INTERVAL))
+    if LANES_METRICS_INTERVAL:
+        start_background_task(log_lane_metrics(application, LANES_METRICS_INTERVAL))
+    start_background_task(flush_interactions(INTERACTIONS_FLUSH_INTERVAL))
+    if PERSISTENCE_CLEANUP_INTERVAL:
+        start_background_task(cleanup_persistence(application, PERSISTENCE_CLEANUP_INTERVAL))
+    if TRAINING_SWEEP_INTERVAL:
+        start_background_task(sweep_trainings(application.bot, TRAINING_SWEEP_INTERVAL,
+                                              TRAINING_IDLE_TIMEOUT, TRAINING_SWEEP_BATCH))
+
+
+async def post_stop(application):
+    # edits still waiting to be coalesced, the bot is shut down after this
+    await message_renders.close()
+
+
+async def post_shutdown(application):
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+    await run_db(interaction_buffer.flush)
 
-    application = (
+
+def build_application(updater=True):
+    builder = (
         Application.builder()
+        .application_class(LanedApplication, kwargs=dict(max_lane_depth=LANE_MAX_DEPTH))
         .token(TOKEN)
-        .persistence(persistence)
-        .arbitrary_callback_data(True)
-        .build()
+        .persistence(get_persistence())
+        .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
     )
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
     add_handlers(application)
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    return application
+
+
+def init_app():
+    if UPDATES_MODE not in UpdateModes.all():
+        raise ValueError(f'Unknown updates mode - {UPDATES_MODE}')
+
+    application = build_application()
+    if UPDATES_MODE == UpdateModes.Webhook:
+        # the webhook server checks X-Telegram-Bot-Api-Secret-Token and waits
+        # for room in the update queue before answering Telegram
+        application.run_webhook(allowed_updates=Update.ALL_TYPES, **WEBHOOK)
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+
+def build_router(application):
+    router = CallbackRouter()
+    router.add_controller(MuscleGroupsController(application))
+    router.add_controller(ExerciseToolController(application))
+    router.add_controller(GroupExercisesController(application))
+    router.add_controller(ExerciseController(application))
+    router.add_controller(StartExerciseController(application))
+    router.add_controller(MyTrainingsController(application))
+    router.add_controller(CheckEndTrainingController(application))
+    router.add_controller(EndTrainingController(application))
+    router.add_controller(AnalyticsMenuController(application))
+    router.add_controller(AnalyticsGeneratorController(application))
+    router.add_controller(SettingsController(application))
+    router.add_controller(NotificationsController(application))
+    router.add_controller(LanguageController(application))
+    router.add_controller(LanguageSetterController(application))
+    router.add_controller(SubscriptionMenuController(application))
+    router.add_controller(InvoiceController(application))
+    router.add_controller(InfoMenuController(application))
+    router.add_controller(InfoManualController(application))
+    router.add_controller(FeedbackController(application))
+    router.add_controller(OfertaController(application))
+    router.add_controller(HelpController(application))
+    router.add_controller(GuideController(application))
+    router.add_controller(CalculatorGenderController(application))
+    router.add_controller(CalculatorLevelController(application))
+    router.add_controller(CalculatorParamsController(application))
+    router.add_controller(ProgramGroupController(application))
+    router.add_controller(ProgramLevelController(application))
+    router.add_controller(ProgramController(application))
+    router.add_controller(StopProgramController(application))
+    router.add_controller(NextDayProgramController(application))
+    menu = Registration(application).set_bot_menu().call
+    router.add('menu', menu)
+    router.set_fallback(menu)
+    return router
 
 
 def add_handlers(application):
@@ -82,131 +205,38 @@ def add_handlers(application):
                                            Registration(application).set_start().call))
 
     # callbacks handlers
-    application.add_handler(CallbackQueryHandler(MuscleGroupsController(application).call,
-                                                 pattern=MuscleGroupsController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(ExerciseToolController(application).call,
-                                                 pattern=ExerciseToolController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(GroupExercisesController(application).call,
-                                                 pattern=GroupExercisesController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(ExerciseController(application).call,
-                                                 pattern=ExerciseController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(StartExerciseController(application).call,
-                                                 pattern=StartExerciseController.pattern,
-                                                 block=False))
+    application.add_handler(CallbackQueryHandler(build_router(application).dispatch,
+                                                 block=True))
+
+    # messages handlers
     application.add_handler(MessageHandler((filters.UpdateType.EDITED_MESSAGE &
                                             (filters.Regex(UpdateSetController.pattern())) |
                                             filters.Regex(UpdateSetController.extended_pattern())),
                                            UpdateSetController(application).call,
-                                           block=False))
+                                           block=True))
     application.add_handler(MessageHandler((filters.Regex(UpdateSetController.pattern()) |
                                             filters.Regex(UpdateSetController.extended_pattern())),
                                            UpdateSetController(application).call,
-                                           block=False))
-    application.add_handler(CallbackQueryHandler(MyTrainingsController(application).call,
-                                                 pattern=MyTrainingsController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(CheckEndTrainingController(application).call,
-                                                 pattern=CheckEndTrainingController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(EndTrainingController(application).call,
-                                                 pattern=EndTrainingController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(AnalyticsMenuController(application).call,
-                                                 pattern=AnalyticsMenuController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(AnalyticsGeneratorController(application).call,
-                                                 pattern=AnalyticsGeneratorController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(AnalyticsGeneratorController(application).call,
-                                                 pattern=AnalyticsGeneratorController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(SettingsController(application).call,
-                                                 pattern=SettingsController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(NotificationsController(application).call,
-                                                 pattern=NotificationsController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(LanguageController(application).call,
-                                                 pattern=LanguageController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(LanguageSetterController(application).call,
-                                                 pattern=LanguageSetterController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(SubscriptionMenuController(application).call,
-                                                 pattern=SubscriptionMenuController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(InvoiceController(application).call,
-                                                 pattern=InvoiceController.pattern,
-                                                 block=False))
+                                           block=True))
     application.add_handler(PreCheckoutQueryHandler(CheckoutController(application).call,
                                                     block=True))
     application.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT,
                                            SuccessInvoiceController(application).call,
                                            block=True))
-    application.add_handler(CallbackQueryHandler(InfoMenuController(application).call,
-                                                 pattern=InfoMenuController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(InfoManualController(application).call,
-                                                 pattern=InfoManualController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(FeedbackController(application).call,
-                                                 pattern=FeedbackController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(OfertaController(application).call,
-                                                 pattern=OfertaController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(HelpController(application).call,
-                                                 pattern=HelpController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(GuideController(application).call,
-                                                 pattern=GuideController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(CalculatorGenderController(application).call,
-                                                 pattern=CalculatorGenderController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(CalculatorLevelController(application).call,
-                                                 pattern=CalculatorLevelController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(CalculatorParamsController(application).call,
-                                                 pattern=CalculatorParamsController.pattern,
-                                                 block=False))
     application.add_handler(MessageHandler(filters.Regex(CalculatorResultController.pattern()),
                                            CalculatorResultController(application).call,
-                                           block=False))
-    application.add_handler(CallbackQueryHandler(ProgramGroupController(application).call,
-                                                 pattern=ProgramGroupController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(ProgramLevelController(application).call,
-                                                 pattern=ProgramLevelController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(ProgramController(application).call,
-                                                 pattern=ProgramController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(StopProgramController(application).call,
-                                                 pattern=StopProgramController.pattern,
-                                                 block=False))
-    application.add_handler(CallbackQueryHandler(NextDayProgramController(application).call,
-                                                 pattern=NextDayProgramController.pattern,
-                                                 block=False))
-
-    application.add_handler(CallbackQueryHandler(Registration(application).set_bot_menu().call,
-                                                 pattern='menu',
-                                                 block=False))
+                                           block=True))
 
     # commands handlers
-    application.add_handler(CommandHandler('start', Registration(application).set_start().call, block=False))
-    application.add_handler(CommandHandler('menu', Registration(application).set_bot_menu().call, block=False))
-    application.add_handler(CommandHandler('end_training', EndTrainingController(application).call, block=False))
-    application.add_handler(CommandHandler('info', InfoMenuController(application).call, block=False))
-    application.add_handler(CommandHandler('information', InfoMenuController(application).call, block=False))
-    application.add_handler(CommandHandler('help', HelpController(application).call, block=False))
-    application.add_handler(CommandHandler('show_analytics', AnalyticsMenuController(application).call, block=False))
-    application.add_handler(CommandHandler('subscription', SubscriptionMenuController(application).call, block=False))
-    application.add_handler(CommandHandler('settings', SettingsController(application).call, block=False))
+    application.add_handler(CommandHandler('start', Registration(application).set_start().call, block=True))
+    application.add_handler(CommandHandler('menu', Registration(application).set_bot_menu().call, block=True))
+    application.add_handler(CommandHandler('end_training', EndTrainingController(application).call, block=True))
+    application.add_handler(CommandHandler('info', InfoMenuController(application).call, block=True))
+    application.add_handler(CommandHandler('information', InfoMenuController(application).call, block=True))
+    application.add_handler(CommandHandler('help', HelpController(application).call, block=True))
+    application.add_handler(CommandHandler('show_analytics', AnalyticsMenuController(application).call, block=True))
+    application.add_handler(CommandHandler('subscription', SubscriptionMenuController(application).call, block=True))
+    application.add_handler(CommandHandler('settings', SettingsController(application).call, block=True))
 
 
 if __name__ == '__main__':
@@ -16,10 +16,10 @@ from config import (
 from constants import (
     EfficiencyCoefficients as EffC,
 )
+from media import open_upload
 from models import (
-    User,
-    Training,
-    Set
+    db,
+    User
 )
 from utils import (
     Logger,
@@ -27,10 +27,63 @@ from utils import (
     get_base_58_string
 )
 
+# every set of the user's finished trainings in the period with its exercise and muscle group names
+# in the user's language, its score (the sum of the scores of its reps, a rep without weight counts
+# the user's weight) and the max score of its exercise, each row also carries the totals of the trainings.
+# Trainings without sets give one row of totals
+TRAININGS_DATA_SQL = """
+WITH trainings AS (
+    SELECT id,
+           created,
+           extract(epoch FROM "end" - created) AS duration,
+           extract(epoch FROM created - lag(created) OVER (ORDER BY created)) AS gap
+    FROM trainings
+    WHERE user_id = %(user_id)s
+      AND "end" IS NOT NULL
+      AND (%(start_date)s::timestamp IS NULL OR created >= %(start_date)s::timestamp)
+), totals AS (
+    SELECT count(*) AS trainings,
+           (SELECT count(*) FROM sets WHERE training_id IN (SELECT id FROM trainings)) AS sets,
+           coalesce(avg(duration), 0) AS avg_duration,
+           coalesce(avg(gap), 0) AS avg_gap
+    FROM trainings
+), scores AS (
+    SELECT s.id,
+           s.exercise_id,
+           coalesce(e.name->>%(lang)s, e.name->>'en') AS exercise,
+           coalesce(g.name->>%(lang)s, g.name->>'en') AS muscle_group,
+           s.created,
+           t.created AS training_created,
+           coalesce(sum(round(
+               CASE WHEN jsonb_typeof(r.rep->'weight') = 'number' AND (r.rep->>'weight')::numeric <> 0
+                    THEN (r.rep->>'weight')::numeric
+                    ELSE %(user_weight)s END
+               / nullif(%(base_cf)s - %(rep_cf)s * (r.rep->>'reps')::numeric / 10, 0) * 100)), 0) AS score
+    FROM trainings t
+    JOIN sets s ON s.training_id = t.id
+    JOIN exercises e ON e.id = s.exercise_id
+    JOIN muscle_groups g ON g.id = e.group_id
+    LEFT JOIN LATERAL jsonb_array_elements(s.data) AS r (rep) ON true
+    GROUP BY s.id, t.created, e.id, g.id
+)
+SELECT totals.trainings,
+       totals.sets,
+       totals.avg_duration,
+       totals.avg_gap,
+       scores.exercise,
+       scores.muscle_group,
+       scores.created,
+       scores.score,
+       max(scores.score) OVER (PARTITION BY scores.exercise_id) AS max_score
+FROM totals
+LEFT JOIN scores ON true
+ORDER BY scores.training_created, scores.id
+"""
+
 
 class Analyzer:
     def __init__(self, user_id, period):
-        self.user = User.get_by_id(user_id)
+        self.user = User.get_cached(user_id=user_id)
         self.chat_id = self.user.chat_id
         self.lang = self.user.lang
         self.silent = self.user.extra_data.get('silent', False)
@@ -39,15 +92,15 @@ class Analyzer:
         self._log = Logger(fh, 'AnalyticGenerator')
 
     async def call(self):
-        text, analytics_file, analytics_path = self._get_data(self.user)
-        if analytics_file is not None:
-            await self.bot.sendDocument(
-                chat_id=self.chat_id,
-                document=analytics_file,
-                filename='analytics.pdf',
-                caption=text,
-                disable_notification=self.silent
-            )
+        text, analytics_path = self._get_data(self.user)
+        if analytics_path is not None:
+            async with open_upload(analytics_path, filename='analytics.pdf') as analytics_file:
+                await self.bot.sendDocument(
+                    chat_id=self.chat_id,
+                    document=analytics_file,
+                    caption=text,
+                    disable_notification=self.silent
+                )
             self.remove_file(analytics_path)
         else:
             await self.bot.sendMessage(
@@ -95,85 +148,46 @@ class Analyzer:
                                                periods[str(self.period)],
                                                user)
         if analytics_path is None:
-            return empty_texts[self.lang], None, None
-
-        with open(analytics_path, 'rb') as f:
-            analytics_file = f.read()
+            return empty_texts[self.lang], None
 
-        return (texts[self.lang],
-                analytics_file,
-                analytics_path)
+        return texts[self.lang], analytics_path
 
     def _get_trainings_data(self, period, user):
-        trainings = (Training
-                     .select()
-                     .where(Training.user == user,
-                            Training.end.is_null(False))
-                     .order_by(Training.created))
-        if period != 'all':
+        start_date = None
+        if period != 'all' and int(period) > 0:
             start_date = datetime.now() - timedelta(days=30 * int(period))
-            trainings.where(Training.created >= start_date)
-
         user_weight = int(user.extra_data.get('weight', 10))
-
-        total_trainings = trainings.count()
+        rows = db.execute_sql(TRAININGS_DATA_SQL, dict(user_id=user.id,
+                                                       start_date=start_date,
+                                                       lang=user.lang,
+                                                       user_weight=user_weight,
+                                                       base_cf=EffC.BaseCF,
+                                                       rep_cf=EffC.RepCF)).fetchall()
+        total_trainings = rows[0][0] if rows else 0
         if not total_trainings:
             return None, None, None, None, None, None
-        avg_training_time = 0
-        avg_time_btw_training = 0
-        total_sets = 0
+        _, total_sets, avg_training_time, avg_time_btw_training = rows[0][:4]
+
         exercises_max_scores = {}
         reps_data = {}
-        for training in trainings:
-            sets = Set.select().where(Set.training_id == training.id)
-            total_sets += sets.count()
-            avg_training_time += (training.end - training.created).total_seconds()
-            for s in sets:
-                if exercises_max_scores.get(s.exercise.get_name(user.lang)) is None:
-                    group = s.exercise.group.name[user.lang]
-                    exercises_max_scores[s.exercise.get_name(user.lang)] = {'group': group,
-                                                                            'max_score': 0}
-                else:
-                    group = exercises_max_scores[s.exercise.get_name(user.lang)]['group']
-                ex_date = s.created
-                exercise = s.exercise.get_name(user.lang)
-                if reps_data.get(group) is None:
-                    reps_data[group] = {}
-                if reps_data[group].get(exercise) is None:
-                    reps_data[group][exercise] = []
-
-                score = 0
-                if reps_data.get(group) is None:
-                    reps_data[group] = {exercise: []}
-                if reps_data[group].get(exercise) is None:
-                    reps_data[group][exercise] = []
-                for sub_set in s.data:
-                    weight = sub_set['weight']
-                    if not weight:
-                        weight = user_weight
-                    score += self._get_score(weight, sub_set['reps'])
-
-                max_score = max(exercises_max_scores[exercise]['max_score'], score)
-                exercises_max_scores[exercise]['max_score'] = max_score
-
-                reps_data[group][exercise].append({'score': score,
-                                                   'date': ex_date})
-
-        for index in range(total_trainings - 1):
-            avg_time_btw_training += (trainings[index + 1].created - trainings[index].created).total_seconds()
-
-        avg_training_time = avg_training_time / total_trainings
-        avg_time_btw_training = avg_time_btw_training / max(total_trainings - 1, 1)
+        for *_, exercise, group, ex_date, score, max_score in rows:
+            if exercise is None:
+                # trainings without sets
+                continue
+            if exercise not in exercises_max_scores:
+                exercises_max_scores[exercise] = {'group': group,
+                                                  'max_score': 0}
+            exercises_max_scores[exercise]['max_score'] = max(exercises_max_scores[exercise]['max_score'],
+                                                              int(max_score))
+            reps_data.setdefault(group, {}).setdefault(exercise, []).append({'score': int(score),
+                                                                             'date': ex_date})
 
         return (total_trainings,
                 total_sets,
                 exercises_max_scores,
                 reps_data,
-                avg_training_time,
-                avg_time_btw_training)
-
-    def _get_score(self, weight, reps):
-        return round(weight / (EffC.BaseCF - EffC.RepCF * reps / 10) * 100)
+                float(avg_training_time),
+                float(avg_time_btw_training))
 
     def _create_plot(self, name, data, max_score):
         texts = {
@@ -16,7 +16,7 @@ from utils import (
 
 class ProgramRemind:
     def __init__(self, user_id):
-        self.user = User.get_by_id(user_id)
+        self.user = User.get_cached(user_id=user_id)
         self.chat_id = self.user.chat_id
         self.lang = self.user.lang
         self.silent = self.user.extra_data.get('silent', False)
@@ -0,0 +1,374 @@
+import asyncio
+import contextlib
+import hashlib
+import mimetypes
+import mmap
+import os
+import random
+import threading
+from datetime import datetime
+from uuid import uuid4
+
+from telegram import Bot, InputFile, Message
+from telegram.error import BadRequest
+
+from catalog import catalog
+from config import MAIN_PATH
+from constants import MediaTypes
+from models import MediaFile, run_db
+from utils import logger
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# BadRequest texts meaning Telegram no longer accepts the file_id
+STALE_FILE_ID_ERRORS = (
+    'wrong file identifier',
+    'wrong remote file identifier',
+    'file reference expired',
+    'failed to get http url content',
+    'wrong type of the web page content',
+    'file_id',
+)
+
+_senders = {
+    MediaTypes.Video: 'send_video',
+    MediaTypes.Animation: 'send_animation',
+    MediaTypes.Document: 'send_document',
+}
+
+
+def is_stale_file_id(error: BadRequest) -> bool:
+    message = error.message.lower()
+    return any(text in message for text in STALE_FILE_ID_ERRORS)
+
+
+class ContentHashes:
+    """
+    sha256 of files on disk, remembered while size and mtime of a file stay the same
+    """
+
+    def __init__(self):
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def get(self, path) -> str:
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._hashes.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        with self._lock:
+            self._hashes[path] = (signature, content_hash)
+        return content_hash
+
+
+content_hashes = ContentHashes()
+
+
+class FileIds:
+    """
+    (content hash, media type) -> Telegram file_id, backed by the media_files table.
+    Known ids are kept in memory, the table is read once per key and process
+    """
+
+    def __init__(self):
+        self._file_ids = {}
+
+    def cached(self, content_hash, media_type):
+        return self._file_ids.get((content_hash, media_type))
+
+    def load(self, content_hash, media_type):
+        media_file = (MediaFile
+                      .select(MediaFile.file_id)
+                      .where(MediaFile.content_hash == content_hash,
+                             MediaFile.media_type == media_type)
+                      .first())
+        if media_file is None:
+            return None
+        self._file_ids[(content_hash, media_type)] = media_file.file_id
+        return media_file.file_id
+
+    def save(self, content_hash, media_type, path, file_id, file_unique_id):
+        now = datetime.now()
+        (MediaFile
+         .insert(content_hash=content_hash,
+                 media_type=media_type,
+                 path=path,
+                 file_id=file_id,
+                 file_unique_id=file_unique_id,
+                 created=now,
+                 updated=now)
+         .on_conflict(conflict_target=[MediaFile.content_hash, MediaFile.media_type],
+                      update={MediaFile.path: path,
+                              MediaFile.file_id: file_id,
+                              MediaFile.file_unique_id: file_unique_id,
+                              MediaFile.updated: now})
+         .execute())
+        self._file_ids[(content_hash, media_type)] = file_id
+
+    def forget(self, content_hash, media_type):
+        self._file_ids.pop((content_hash, media_type), None)
+        (MediaFile
+         .delete()
+         .where(MediaFile.content_hash == content_hash,
+                MediaFile.media_type == media_type)
+         .execute())
+
+
+file_ids = FileIds()
+
+
+class _Mapping:
+    def __init__(self, key, f):
+        self.key = key
+        self.size = key[1]
+        self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        if self.mapped is not None and hasattr(mmap, 'MADV_WILLNEED'):
+            # start reading the file in now, so the event loop rarely waits on a page fault
+            self.mapped.madvise(mmap.MADV_WILLNEED)
+        self.users = 0
+
+
+class MappedFiles:
+    """
+    read-only memory maps shared by concurrent uploads of the same file,
+    a map is closed when its last reader is
+    """
+
+    def __init__(self):
+        self._mappings = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, path) -> _Mapping:
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            key = (path, stat.st_size, stat.st_mtime_ns)
+            with self._lock:
+                mapping = self._mappings.get(key)
+                if mapping is None:
+                    mapping = self._mappings[key] = _Mapping(key, f)
+                mapping.users += 1
+        return mapping
+
+    def release(self, mapping: _Mapping):
+        with self._lock:
+            mapping.users -= 1
+            if mapping.users:
+                return
+            del self._mappings[mapping.key]
+        if mapping.mapped is not None:
+            mapping.mapped.close()
+
+
+mapped_files = MappedFiles()
+
+
+class MappedFile:
+    """
+    reader over a shared memory map with the file object interface httpx streams uploads from
+    """
+
+    def __init__(self, path):
+        self._mapping = mapped_files.acquire(path)
+        self.size = self._mapping.size
+        self._position = 0
+
+    def read(self, size=-1) -> bytes:
+        if self._mapping is None or self._mapping.mapped is None:
+            return b''
+        end = self.size if size is None or size < 0 else min(self._position + size, self.size)
+        chunk = self._mapping.mapped[self._position:end]
+        self._position = end
+        return chunk
+
+    def seek(self, offset, whence=os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self._position = min(max(offset, 0), self.size)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self):
+        if self._mapping is not None:
+            mapped_files.release(self._mapping)
+            self._mapping = None
+
+
+class StreamedInputFile(InputFile):
+    """
+    InputFile handing a file object to the HTTP layer as is.
+    telegram.InputFile reads file objects into bytes, httpx streams them in chunks
+    """
+    __slots__ = ()
+
+    def __init__(self, obj, filename, attach=False):
+        self.input_file_content = obj
+        self.attach_name = 'attached' + uuid4().hex if attach else None
+        self.mimetype = mimetypes.guess_type(filename, strict=False)[0] or 'application/octet-stream'
+        self.filename = filename
+
+
+@contextlib.asynccontextmanager
+async def open_upload(path, filename=None):
+    """
+    map the file at path off the event loop and give an InputFile streaming it,
+    the map is released on exit
+    """
+    mapped = await asyncio.get_running_loop().run_in_executor(None, MappedFile, path)
+    try:
+        yield StreamedInputFile(mapped, filename or os.path.basename(path))
+    finally:
+        mapped.close()
+
+
+def _read(path) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+async def send_media(bot: Bot, media_type, path, filename=None, thumb_path=None, **kwargs) -> Message:
+    """
+    send the file at path by its Telegram file_id when it was uploaded before,
+    otherwise upload it (as filename and with the thumbnail at thumb_path, when given)
+    and remember the file_id Telegram returns.
+    A file_id Telegram rejects is dropped and the file is uploaded again
+    """
+    send = getattr(bot, _senders[media_type])
+    loop = asyncio.get_running_loop()
+    content_hash = await loop.run_in_executor(None, content_hashes.get, path)
+
+    file_id = file_ids.cached(content_hash, media_type)
+    if file_id is None:
+        file_id = await run_db(file_ids.load, content_hash, media_type)
+    if file_id is not None:
+        try:
+            return await send(**{media_type: file_id}, **kwargs)
+        except BadRequest as e:
+            if not is_stale_file_id(e):
+                raise
+            logger.info(f'Media - file_id of {path} rejected ({e.message}), uploading again')
+            await run_db(file_ids.forget, content_hash, media_type)
+
+    if thumb_path is not None:
+        # thumbnails are at most 200 kB
+        thumb = await loop.run_in_executor(None, _read, thumb_path)
+        kwargs['thumb'] = StreamedInputFile(thumb, os.path.basename(thumb_path), attach=True)
+    async with open_upload(path, filename) as input_file:
+        message = await send(**{media_type: input_file}, **kwargs)
+    uploaded = getattr(message, media_type)
+    if uploaded is None:
+        # Telegram may deliver e.g. a short silent video as an animation
+        uploaded = message.effective_attachment
+    await run_db(file_ids.save, content_hash, media_type, path, uploaded.file_id, uploaded.file_unique_id)
+    return message
+
+
+class MediaAsset:
+    def __init__(self, path, media_type, filename=None):
+        self.path = path  # relative to MAIN_PATH, like Exercise.media
+        self.media_type = media_type
+        self.filename = filename
+
+    def __repr__(self):
+        return f'MediaAsset({self.path}, {self.media_type})'
+
+
+def media_type_of(path):
+    return MediaTypes.Document if path.lower().endswith('.pdf') else MediaTypes.Video
+
+
+class MediaRegistry:
+    """
+    static files the bot sends: single files, directories to pick from
+    and the exercise videos of the catalog. Everything is sent through send_media,
+    so each file is uploaded once and sent by file_id afterwards
+    """
+
+    def __init__(self, root):
+        self._root = root
+        self._assets = {}
+        self._directories = {}
+
+    def full_path(self, path):
+        return self._root + path
+
+    def register(self, path, media_type, filename=None):
+        self._assets[path] = MediaAsset(path, media_type, filename)
+
+    def register_directory(self, directory, media_type, extensions):
+        self._directories[directory] = (media_type, tuple(extensions), None)
+
+    def directory(self, directory) -> tuple:
+        media_type, extensions, paths = self._directories[directory]
+        if paths is None:
+            names = sorted(name for name in os.listdir(self.full_path(directory))
+                           if name.lower().endswith(extensions))
+            paths = tuple(directory + name for name in names)
+            for path in paths:
+                self.register(path, media_type)
+            self._directories[directory] = (media_type, extensions, paths)
+        return paths
+
+    def choice(self, directory):
+        paths = self.directory(directory)
+        return random.choice(paths) if paths else None
+
+    def get(self, path) -> MediaAsset:
+        asset = self._assets.get(path)
+        if asset is None:
+            asset = MediaAsset(path, media_type_of(path))
+        return asset
+
+    def assets(self) -> list:
+        for directory in self._directories:
+            self.directory(directory)
+        assets = dict(self._assets)
+        for exercise in catalog.snapshot.exercise_by_id.values():
+            for paths in exercise.media.values():
+                if paths and paths[0] not in assets:
+                    assets[paths[0]] = MediaAsset(paths[0], MediaTypes.Video)
+        return list(assets.values())
+
+    def resolve(self, path):
+        """
+        media type, file and send_media arguments of what is actually sent for path:
+        videos with a transcoded variant (see transcode_media.py) are sent as the variant
+        with its real dimensions, duration and thumbnail
+        """
+        asset = self.get(path)
+        kwargs = {}
+        if asset.filename is not None:
+            kwargs['filename'] = asset.filename
+        if asset.media_type == MediaTypes.Video:
+            variant = catalog.snapshot.media_variants.get(path)
+            if variant is not None:
+                path = variant.path
+                kwargs.update(width=variant.width, height=variant.height, duration=variant.duration)
+                if variant.thumb_path:
+                    kwargs['thumb_path'] = self.full_path(variant.thumb_path)
+        return asset.media_type, self.full_path(path), kwargs
+
+    async def send(self, bot: Bot, path, **kwargs) -> Message:
+        media_type, full_path, media_kwargs = self.resolve(path)
+        kwargs.update(media_kwargs)
+        return await send_media(bot, media_type, full_path, **kwargs)
+
+
+END_TRAINING_CLIPS = 'static/end_training/'
+
+registry = MediaRegistry(MAIN_PATH)
+registry.register_directory(END_TRAINING_CLIPS, MediaTypes.Video, extensions=('.mp4',))
+registry.register('static/info/manual.MOV', MediaTypes.Video)
+registry.register('static/info/oferta.pdf', MediaTypes.Document, filename='terms_of_use.pdf')
+registry.register('static/guide.pdf', MediaTypes.Document, filename='boss_of_the_gym.pdf')
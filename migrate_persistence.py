@@ -0,0 +1,51 @@
+"""
+One-shot copy of the PicklePersistence file into the database persistence.
+
+Usage:
+    python migrate_persistence.py --file gymbuddybot [--backend postgres|sqlite]
+"""
+import argparse
+import asyncio
+
+from telegram.ext import PicklePersistence
+
+from config import PERSISTENCE_BACKEND
+from constants import PersistenceBackends
+from persistence import get_persistence
+
+
+async def migrate(filepath, backend):
+    source = PicklePersistence(filepath=filepath)
+    target = get_persistence(backend)
+
+    chat_data = await source.get_chat_data()
+    for chat_id, data in chat_data.items():
+        await target.update_chat_data(chat_id, data)
+
+    user_data = await source.get_user_data()
+    for user_id, data in user_data.items():
+        await target.update_user_data(user_id, data)
+
+    await target.update_bot_data(await source.get_bot_data())
+
+    conversations = source.conversations or {}
+    for name, states in conversations.items():
+        for key, state in states.items():
+            await target.update_conversation(name, key, state)
+
+    await target.flush()
+    print(f'{len(chat_data)} chats, {len(user_data)} users and '
+          f'{sum(len(states) for states in conversations.values())} conversation states '
+          f'copied to {backend}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', default='gymbuddybot')
+    parser.add_argument('--backend', default=PERSISTENCE_BACKEND, choices=PersistenceBackends.all())
+    args = parser.parse_args()
+    asyncio.run(migrate(args.file, args.backend))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Peewee migrations -- 004_add_catalog_version.py.
+
+Some examples (model - class or model name)::
+
+    > Model = migrator.orm['model_name']            # Return model in current state by name
+
+    > migrator.sql(sql)                             # Run custom SQL
+    > migrator.python(func, *args, **kwargs)        # Run python code
+    > migrator.create_model(Model)                  # Create a model (could be used as decorator)
+    > migrator.remove_model(model, cascade=True)    # Remove a model
+    > migrator.add_fields(model, **fields)          # Add fields to a model
+    > migrator.change_fields(model, **fields)       # Change fields
+    > migrator.remove_fields(model, *field_names, cascade=True)
+    > migrator.rename_field(model, old_field_name, new_field_name)
+    > migrator.rename_table(model, new_table_name)
+    > migrator.add_index(model, *col_names, unique=False)
+    > migrator.drop_index(model, *col_names)
+    > migrator.add_not_null(model, *field_names)
+    > migrator.drop_not_null(model, *field_names)
+    > migrator.add_default(model, field_name, default)
+
+"""
+
+import peewee as pw
+
+try:
+    import playhouse.postgres_ext as pw_pext
+except ImportError:
+    pass
+
+SQL = pw.SQL
+
+
+def migrate(migrator, database, fake=False, **kwargs):
+    """Write your migrations here."""
+
+    migrator.sql("""
+        CREATE TABLE catalog_version (
+            id integer PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+            version bigint NOT NULL DEFAULT 1
+        )
+    """)
+    migrator.sql("INSERT INTO catalog_version (id, version) VALUES (1, 1)")
+    migrator.sql("""
+        CREATE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+        DECLARE
+            new_version bigint;
+        BEGIN
+            UPDATE catalog_version SET version = version + 1 WHERE id = 1
+            RETURNING version INTO new_version;
+            PERFORM pg_notify('catalog', new_version::text);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for table in ('muscle_groups', 'tools', 'exercises'):
+        migrator.sql(f"""
+            CREATE TRIGGER {table}_catalog_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version()
+        """)
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    """Write your rollback migrations here."""
+
+    for table in ('muscle_groups', 'tools', 'exercises'):
+        migrator.sql(f"DROP TRIGGER {table}_catalog_version ON {table}")
+    migrator.sql("DROP FUNCTION bump_catalog_version()")
+    migrator.sql("DROP TABLE catalog_version")
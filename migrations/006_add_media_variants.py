@@ -0,0 +1,64 @@
+"""Peewee migrations -- 006_add_media_variants.py.
+
+Some examples (model - class or model name)::
+
+    > Model = migrator.orm['model_name']            # Return model in current state by name
+
+    > migrator.sql(sql)                             # Run custom SQL
+    > migrator.python(func, *args, **kwargs)        # Run python code
+    > migrator.create_model(Model)                  # Create a model (could be used as decorator)
+    > migrator.remove_model(model, cascade=True)    # Remove a model
+    > migrator.add_fields(model, **fields)          # Add fields to a model
+    > migrator.change_fields(model, **fields)       # Change fields
+    > migrator.remove_fields(model, *field_names, cascade=True)
+    > migrator.rename_field(model, old_field_name, new_field_name)
+    > migrator.rename_table(model, new_table_name)
+    > migrator.add_index(model, *col_names, unique=False)
+    > migrator.drop_index(model, *col_names)
+    > migrator.add_not_null(model, *field_names)
+    > migrator.drop_not_null(model, *field_names)
+    > migrator.add_default(model, field_name, default)
+
+"""
+
+import peewee as pw
+
+try:
+    import playhouse.postgres_ext as pw_pext
+except ImportError:
+    pass
+
+SQL = pw.SQL
+
+
+def migrate(migrator, database, fake=False, **kwargs):
+    """Write your migrations here."""
+
+    @migrator.create_model
+    class MediaVariant(pw.Model):
+        source_path = pw.CharField(max_length=255, unique=True)
+        source_hash = pw.CharField(max_length=64)
+        path = pw.CharField(max_length=255)
+        thumb_path = pw.CharField(max_length=255, null=True)
+        width = pw.IntegerField()
+        height = pw.IntegerField()
+        duration = pw.IntegerField()
+        size = pw.IntegerField()
+        created = pw.DateTimeField()
+
+        class Meta:
+            table_name = 'media_variants'
+
+    # variants are part of the catalog snapshot
+    migrator.sql("""
+        CREATE TRIGGER media_variants_catalog_version
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON media_variants
+        FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version()
+    """)
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    """Write your rollback migrations here."""
+
+    migrator.sql("DROP TRIGGER media_variants_catalog_version ON media_variants")
+    migrator.remove_model('media_variants')
@@ -0,0 +1,94 @@
+"""Peewee migrations -- 007_add_hot_path_indexes.py.
+
+Some examples (model - class or model name)::
+
+    > Model = migrator.orm['model_name']            # Return model in current state by name
+
+    > migrator.sql(sql)                             # Run custom SQL
+    > migrator.python(func, *args, **kwargs)        # Run python code
+    > migrator.create_model(Model)                  # Create a model (could be used as decorator)
+    > migrator.remove_model(model, cascade=True)    # Remove a model
+    > migrator.add_fields(model, **fields)          # Add fields to a model
+    > migrator.change_fields(model, **fields)       # Change fields
+    > migrator.remove_fields(model, *field_names, cascade=True)
+    > migrator.rename_field(model, old_field_name, new_field_name)
+    > migrator.rename_table(model, new_table_name)
+    > migrator.add_index(model, *col_names, unique=False)
+    > migrator.drop_index(model, *col_names)
+    > migrator.add_not_null(model, *field_names)
+    > migrator.drop_not_null(model, *field_names)
+    > migrator.add_default(model, field_name, default)
+
+"""
+
+import peewee as pw
+import psycopg2
+
+try:
+    import playhouse.postgres_ext as pw_pext
+except ImportError:
+    pass
+
+SQL = pw.SQL
+
+# name, table, definition
+INDEXES = (
+    # previous finished set of an exercise
+    ('sets_user_exercise_finished', 'sets', '(user_id, exercise_id, id DESC) WHERE "end" IS NOT NULL'),
+    # sets of a training, named like the foreign key index create_tables makes
+    ('set_training_id', 'sets', '(training_id)'),
+    # open training of a user
+    ('trainings_user_open', 'trainings', '(user_id) WHERE "end" IS NULL'),
+    # training history
+    ('trainings_user_finished', 'trainings', '(user_id, id DESC) WHERE "end" IS NOT NULL'),
+)
+
+
+def _autocommit_connection(database):
+    """
+    CREATE INDEX CONCURRENTLY can't run in a transaction block and migrations run in one,
+    so the indexes are built over a connection of their own
+    """
+    connection = psycopg2.connect(dbname=database.database, **database.connect_params)
+    connection.autocommit = True
+    return connection
+
+
+def create_indexes(database):
+    connection = _autocommit_connection(database)
+    try:
+        with connection.cursor() as cursor:
+            for name, table, definition in INDEXES:
+                # a failed concurrent build leaves an invalid index behind
+                cursor.execute('SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)', (name,))
+                row = cursor.fetchone()
+                if row and row[0]:
+                    cursor.execute(f'DROP INDEX CONCURRENTLY {name}')
+                cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}')
+    finally:
+        connection.close()
+
+
+def drop_indexes(database):
+    connection = _autocommit_connection(database)
+    try:
+        with connection.cursor() as cursor:
+            for name, _, _ in INDEXES:
+                if name == 'set_training_id':
+                    # the foreign key index, it may predate this migration
+                    continue
+                cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+    finally:
+        connection.close()
+
+
+def migrate(migrator, database, fake=False, **kwargs):
+    """Write your migrations here."""
+
+    migrator.python(create_indexes, database)
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    """Write your rollback migrations here."""
+
+    migrator.python(drop_indexes, database)
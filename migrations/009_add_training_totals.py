@@ -0,0 +1,95 @@
+"""Peewee migrations -- 009_add_training_totals.py.
+
+Some examples (model - class or model name)::
+
+    > Model = migrator.orm['model_name']            # Return model in current state by name
+
+    > migrator.sql(sql)                             # Run custom SQL
+    > migrator.python(func, *args, **kwargs)        # Run python code
+    > migrator.create_model(Model)                  # Create a model (could be used as decorator)
+    > migrator.remove_model(model, cascade=True)    # Remove a model
+    > migrator.add_fields(model, **fields)          # Add fields to a model
+    > migrator.change_fields(model, **fields)       # Change fields
+    > migrator.remove_fields(model, *field_names, cascade=True)
+    > migrator.rename_field(model, old_field_name, new_field_name)
+    > migrator.rename_table(model, new_table_name)
+    > migrator.add_index(model, *col_names, unique=False)
+    > migrator.drop_index(model, *col_names)
+    > migrator.add_not_null(model, *field_names)
+    > migrator.drop_not_null(model, *field_names)
+    > migrator.add_default(model, field_name, default)
+
+"""
+
+import peewee as pw
+
+from config import TZ
+
+try:
+    import playhouse.postgres_ext as pw_pext
+except ImportError:
+    pass
+
+SQL = pw.SQL
+
+
+def migrate(migrator, database, fake=False, **kwargs):
+    """Write your migrations here."""
+
+    migrator.sql("""
+        ALTER TABLE trainings
+            ADD COLUMN rep_count integer NOT NULL DEFAULT 0,
+            ADD COLUMN set_count integer NOT NULL DEFAULT 0,
+            ADD COLUMN tonnage double precision NOT NULL DEFAULT 0,
+            ADD COLUMN rest_sum double precision NOT NULL DEFAULT 0,
+            ADD COLUMN first_rep_at timestamp,
+            ADD COLUMN last_rep_at timestamp,
+            ADD COLUMN exercise_ids integer[] NOT NULL DEFAULT '{}'
+    """)
+    # only open trainings show their totals later, finished ones keep zeros.
+    # rep times are stored in the app's local time like datetime.fromtimestamp writes them
+    migrator.sql("""
+        UPDATE trainings SET
+            rep_count = totals.rep_count,
+            set_count = totals.set_count,
+            tonnage = totals.tonnage,
+            rest_sum = totals.rest_sum,
+            first_rep_at = totals.first_rep_at,
+            last_rep_at = totals.last_rep_at,
+            exercise_ids = totals.exercise_ids
+        FROM (
+            SELECT s.training_id,
+                   sum(jsonb_array_length(s.data)) AS rep_count,
+                   count(*) AS set_count,
+                   sum((SELECT coalesce(sum(coalesce((r->>'weight')::float, 0) * coalesce((r->>'reps')::float, 0)), 0)
+                        FROM jsonb_array_elements(s.data) r)) AS tonnage,
+                   sum((s.data->-1->>'timestamp')::float - (s.data->0->>'timestamp')::float) AS rest_sum,
+                   timezone(%(tz)s, to_timestamp(min((s.data->0->>'timestamp')::float))) AS first_rep_at,
+                   timezone(%(tz)s, to_timestamp(max((s.data->-1->>'timestamp')::float))) AS last_rep_at,
+                   (SELECT array_agg(e.exercise_id ORDER BY e.first_id)
+                    FROM (SELECT exercise_id, min(id) AS first_id
+                          FROM sets
+                          WHERE training_id = s.training_id AND jsonb_array_length(data) > 0
+                          GROUP BY exercise_id) e) AS exercise_ids
+            FROM sets s
+            JOIN trainings t ON t.id = s.training_id AND t."end" IS NULL
+            WHERE jsonb_array_length(s.data) > 0
+            GROUP BY s.training_id
+        ) totals
+        WHERE trainings.id = totals.training_id
+    """, {'tz': TZ})
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    """Write your rollback migrations here."""
+
+    migrator.sql("""
+        ALTER TABLE trainings
+            DROP COLUMN rep_count,
+            DROP COLUMN set_count,
+            DROP COLUMN tonnage,
+            DROP COLUMN rest_sum,
+            DROP COLUMN first_rep_at,
+            DROP COLUMN last_rep_at,
+            DROP COLUMN exercise_ids
+    """)
@@ -0,0 +1,81 @@
+"""Peewee migrations -- 010_add_open_training_activity_index.py.
+
+Some examples (model - class or model name)::
+
+    > Model = migrator.orm['model_name']            # Return model in current state by name
+
+    > migrator.sql(sql)                             # Run custom SQL
+    > migrator.python(func, *args, **kwargs)        # Run python code
+    > migrator.create_model(Model)                  # Create a model (could be used as decorator)
+    > migrator.remove_model(model, cascade=True)    # Remove a model
+    > migrator.add_fields(model, **fields)          # Add fields to a model
+    > migrator.change_fields(model, **fields)       # Change fields
+    > migrator.remove_fields(model, *field_names, cascade=True)
+    > migrator.rename_field(model, old_field_name, new_field_name)
+    > migrator.rename_table(model, new_table_name)
+    > migrator.add_index(model, *col_names, unique=False)
+    > migrator.drop_index(model, *col_names)
+    > migrator.add_not_null(model, *field_names)
+    > migrator.drop_not_null(model, *field_names)
+    > migrator.add_default(model, field_name, default)
+
+"""
+
+import peewee as pw
+import psycopg2
+
+try:
+    import playhouse.postgres_ext as pw_pext
+except ImportError:
+    pass
+
+SQL = pw.SQL
+
+NAME = 'trainings_open_activity'
+# open trainings by their last activity, for close_stale_trainings
+DEFINITION = 'ON trainings ((COALESCE(last_rep_at, created))) WHERE "end" IS NULL'
+
+
+def _autocommit_connection(database):
+    """
+    CREATE INDEX CONCURRENTLY can't run in a transaction block and migrations run in one,
+    so the index is built over a connection of its own
+    """
+    connection = psycopg2.connect(dbname=database.database, **database.connect_params)
+    connection.autocommit = True
+    return connection
+
+
+def create_index(database):
+    connection = _autocommit_connection(database)
+    try:
+        with connection.cursor() as cursor:
+            # a failed concurrent build leaves an invalid index behind
+            cursor.execute('SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)', (NAME,))
+            row = cursor.fetchone()
+            if row and row[0]:
+                cursor.execute(f'DROP INDEX CONCURRENTLY {NAME}')
+            cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {NAME} {DEFINITION}')
+    finally:
+        connection.close()
+
+
+def drop_index(database):
+    connection = _autocommit_connection(database)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {NAME}')
+    finally:
+        connection.close()
+
+
+def migrate(migrator, database, fake=False, **kwargs):
+    """Write your migrations here."""
+
+    migrator.python(create_index, database)
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    """Write your rollback migrations here."""
+
+    migrator.python(drop_index, database)
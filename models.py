@@ -1,24 +1,119 @@
-from functools import wraps
+import asyncio
+import bisect
+import contextvars
+import threading
+import time
+import traceback
+import typing
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from functools import partial, wraps
+
+import psycopg2
 from peewee import (
+    EXCLUDED,
+    Expression,
     Model,
     CharField,
+    CompositeKey,
     DateTimeField,
     ForeignKeyField,
     datetime as peewee_datetime,
     IntegerField,
     BooleanField,
-    DoubleField
+    Case,
+    DoubleField,
+    SQL,
+    fn
 )
 from playhouse.pool import PooledPostgresqlExtDatabase
-from playhouse.postgres_ext import BinaryJSONField
-
-from config import DB_CONFIG, DEFAULT_LANGUAGE
-from constants import MuscleGroupTypes, SubscriptionValue
-from utils import get_base_58_string
+from playhouse.postgres_ext import ArrayField, BinaryJSONField
+
+from config import (
+    DB_CONFIG,
+    DB_MODE,
+    DB_WORKERS,
+    DEFAULT_LANGUAGE,
+    INTERACTIONS_FLUSH_SIZE,
+    TRAINING_SESSION_CACHE_SIZE,
+    TRAINING_SESSION_TTL,
+    TZ,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL
+)
+from constants import DBModes, MuscleGroupTypes, SubscriptionValue
+from utils import get_base_58_string, logger
 
 peewee_now = peewee_datetime.datetime.now
+from_timestamp = peewee_datetime.datetime.fromtimestamp
+
+
+class PoolMetrics:
+    """
+    connection pool statistics: time spent waiting for a connection
+    and histogram of how long connections stay checked out
+    """
+    checkout_buckets = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, float('inf'))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.wait_total = 0.
+            self.wait_max = 0.
+            self.checkout_histogram = [0] * len(self.checkout_buckets)
+
+    def observe_wait(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def observe_checkout(self, seconds):
+        with self._lock:
+            self.checkout_histogram[bisect.bisect_left(self.checkout_buckets, seconds)] += 1
+
+    def snapshot(self, in_use, idle):
+        with self._lock:
+            return dict(
+                in_use=in_use,
+                idle=idle,
+                checkouts=self.checkouts,
+                wait_avg_ms=round(self.wait_total / max(self.checkouts, 1) * 1000, 2),
+                wait_max_ms=round(self.wait_max * 1000, 2),
+                checkout_histogram={f'<={bucket}s': count
+                                    for bucket, count in zip(self.checkout_buckets, self.checkout_histogram)},
+            )
+
+
+class MonitoredPooledPostgresqlExtDatabase(PooledPostgresqlExtDatabase):
+    def __init__(self, *args, **kwargs):
+        self.metrics = PoolMetrics()
+        super().__init__(*args, **kwargs)
+
+    def connect(self, reuse_if_open=False):
+        started = time.perf_counter()
+        try:
+            return super().connect(reuse_if_open)
+        finally:
+            self.metrics.observe_wait(time.perf_counter() - started)
+
+    def _close(self, conn, close_conn=False):
+        pool_conn = self._in_use.get(self.conn_key(conn))
+        if not close_conn and pool_conn is not None:
+            self.metrics.observe_checkout(time.time() - pool_conn.checked_out)
+        super()._close(conn, close_conn)
+
+    def pool_stats(self):
+        return self.metrics.snapshot(in_use=len(self._in_use),
+                                     idle=len(self._connections))
+
 
-db = PooledPostgresqlExtDatabase(**DB_CONFIG)
+db = MonitoredPooledPostgresqlExtDatabase(**DB_CONFIG)
 db.commit_select = True
 db.autorollback = True
 
@@ -35,20 +130,74 @@ def close_db_connection():
 
 def db_connect_wrapper(func):
     """
-    connect to db and disconnect from it
+    connect to db and disconnect from it,
+    a connection opened by an outer wrapper is left to it
     """
 
     @wraps(func)
     def wrapper(*args, **kwds):
+        opened = db.is_closed()
         try:
-            open_db_connection()
+            if opened:
+                db.connect()
             return func(*args, **kwds)
         finally:
-            close_db_connection()
+            if opened:
+                close_db_connection()
 
     return wrapper
 
 
+async def log_pool_metrics(interval):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f'DB pool - {db.pool_stats()}')
+
+
+_db_mode = DB_MODE
+_db_executor = None
+
+
+def set_db_mode(mode):
+    """
+    switch between running queries inline (sync) and in a thread pool (thread)
+    """
+    global _db_mode
+    if mode not in DBModes.all():
+        raise ValueError(f'Unknown db mode - {mode}')
+    _db_mode = mode
+
+
+def get_db_executor():
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=min(DB_WORKERS, DB_CONFIG['max_connections']),
+                                          thread_name_prefix='db')
+    return _db_executor
+
+
+def shutdown_db_executor():
+    global _db_executor
+    if _db_executor is not None:
+        _db_executor.shutdown(wait=True)
+        _db_executor = None
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    run a unit of synchronous db work without blocking the event loop in thread mode.
+    The caller's context variables are visible to func.
+    A pooled connection is checked out only for the unit itself and returned
+    before the caller awaits anything else, e.g. Telegram API calls.
+    """
+    if _db_mode == DBModes.Thread:
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(get_db_executor(),
+                                          partial(context.run, db_connect_wrapper(func), *args, **kwargs))
+    return db_connect_wrapper(func)(*args, **kwargs)
+
+
 class _Model(Model):
     class Meta:
         database = db
@@ -178,6 +327,257 @@ class User(_Model):
     last_interacted = DateTimeField(default=peewee_datetime.datetime.now)
     subscription_end = DateTimeField(default=peewee_datetime.datetime.now() + peewee_datetime.timedelta(days=7))
 
+    @classmethod
+    def get_cached(cls, chat_id=None, user_id=None) -> typing.Union[None, 'User']:
+        """
+        user by chat_id or id, the users table is queried only on a cache miss
+        """
+        user = user_cache.get(chat_id=chat_id, user_id=user_id)
+        if user is None:
+            if chat_id is not None:
+                user = cls.get_or_none(chat_id=chat_id)
+            else:
+                user = cls.get_or_none(id=user_id)
+            if user is not None:
+                user_cache.put(user)
+        return user
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the row as read (from the table or user_cache), save() writes only what differs from it
+        self._row = deepcopy(self.__data__) if kwargs.get('__no_default__') else None
+
+    def save(self, force_insert=False, only=None):
+        try:
+            if force_insert or only is not None or self._row is None:
+                rows = super().save(force_insert=force_insert, only=only)
+            else:
+                rows = self._save_changes()
+        except:
+            user_cache.invalidate(self)
+            raise
+        if only is None:
+            self._row = deepcopy(self.__data__)
+            user_cache.put(self)
+        else:
+            user_cache.invalidate(self)
+        return rows
+
+    def _save_changes(self) -> int:
+        """
+        UPDATE only the fields changed since the row was read, extra_data key by key
+        on the server (|| and -), so what other processes changed meanwhile is kept.
+        The updated row comes back and replaces the instance's data
+        """
+        changes = {}
+        for name, value in self.__data__.items():
+            if name != 'extra_data' and self._row.get(name) != value:
+                changes[self._meta.fields[name]] = value
+        old_extra, new_extra = self._row.get('extra_data') or {}, self.extra_data or {}
+        if old_extra != new_extra:
+            extra_data = User.extra_data
+            updated = {key: value for key, value in new_extra.items()
+                       if key not in old_extra or old_extra[key] != value}
+            if updated:
+                extra_data = extra_data.concat(updated)
+            for key in old_extra.keys() - new_extra.keys():
+                extra_data = Expression(extra_data, '-', SQL('%s::text', [key]))
+            changes[User.extra_data] = extra_data
+        if not changes:
+            return 0
+        row = next(iter(User.update(changes).where(User.id == self.id).returning(User).execute()), None)
+        if row is None:
+            return 0
+        self.__data__ = row.__data__
+        self._dirty.clear()
+        return 1
+
+    def delete_instance(self, *args, **kwargs):
+        user_cache.invalidate(self)
+        return super().delete_instance(*args, **kwargs)
+
+
+class UserCache:
+    """
+    LRU cache of users rows with TTL, keyed by chat_id and by id.
+    Only row data is kept: every get returns a new User instance,
+    so concurrent handlers never share (and mutate) one object.
+    Every write through User.save/delete_instance updates or drops the entry
+    """
+
+    def __init__(self, maxsize, ttl):
+        self._rows = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._chat_ids = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, chat_id=None, user_id=None) -> typing.Union[None, 'User']:
+        with self._lock:
+            if chat_id is None:
+                chat_id = self._chat_ids.get(user_id)
+            data = self._rows.get(str(chat_id)) if chat_id is not None else None
+            if data is None:
+                return None
+            data = deepcopy(data)
+        user = User(__no_default__=1, **data)
+        user._dirty.clear()
+        return user
+
+    def put(self, user: 'User'):
+        with self._lock:
+            self._rows[str(user.chat_id)] = deepcopy(user.__data__)
+            self._chat_ids[user.id] = str(user.chat_id)
+
+    def update(self, user_id, **fields):
+        """
+        apply a bulk UPDATE made outside of User.save to the cached row
+        """
+        with self._lock:
+            chat_id = self._chat_ids.get(user_id)
+            data = self._rows.get(chat_id) if chat_id is not None else None
+            if data is not None:
+                data.update(fields)
+
+    def invalidate(self, user: 'User'):
+        with self._lock:
+            self._rows.pop(str(user.chat_id), None)
+            self._chat_ids.pop(user.id, None)
+
+    def invalidate_ids(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                chat_id = self._chat_ids.pop(user_id, None)
+                if chat_id is not None:
+                    self._rows.pop(chat_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._chat_ids.clear()
+
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+USERS_CHANNEL = 'users'
+
+
+def notify_users_changed(user_ids):
+    """
+    tell every process to drop these users from its user_cache, for bulk UPDATEs made outside of User.save.
+    Inside a transaction the notification is sent on commit
+    """
+    user_ids = [str(user_id) for user_id in user_ids]
+    # a NOTIFY payload is limited to 8000 bytes
+    for start in range(0, len(user_ids), 500):
+        db.execute_sql('SELECT pg_notify(%s, %s)', (USERS_CHANNEL, ','.join(user_ids[start:start + 500])))
+
+
+def listen_connection(channel):
+    connection = psycopg2.connect(dbname=DB_CONFIG['database'],
+                                  user=DB_CONFIG['user'],
+                                  password=DB_CONFIG['password'],
+                                  host=DB_CONFIG['host'],
+                                  port=DB_CONFIG['port'])
+    connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    connection.cursor().execute(f'LISTEN {channel}')
+    return connection
+
+
+async def watch_users(retry_interval):
+    """
+    drop users changed by other processes from user_cache on NOTIFY from notify_users_changed.
+    Notifications sent while not listening are lost, so the whole cache is dropped on every (re)connect
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        connection = None
+        changed = asyncio.Event()
+        try:
+            connection = await loop.run_in_executor(None, listen_connection, USERS_CHANNEL)
+            loop.add_reader(connection.fileno(), changed.set)
+            user_cache.clear()
+            while True:
+                await changed.wait()
+                changed.clear()
+                connection.poll()
+                user_ids = [int(user_id)
+                            for notify in connection.notifies
+                            for user_id in notify.payload.split(',') if user_id]
+                connection.notifies.clear()
+                user_cache.invalidate_ids(user_ids)
+        except asyncio.CancelledError:
+            raise
+        except:
+            logger.error(traceback.format_exc())
+            await asyncio.sleep(retry_interval)
+        finally:
+            if connection is not None:
+                loop.remove_reader(connection.fileno())
+                connection.close()
+
+
+class InteractionBuffer:
+    """
+    write-behind buffer for users.last_interacted: the latest timestamp per user
+    is kept in memory and written with a single UPDATE ... FROM (VALUES ...)
+    """
+
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def touch(self, user_id, timestamp=None) -> bool:
+        """
+        remember the interaction, returns True when the buffer should be flushed
+        """
+        timestamp = timestamp or peewee_now()
+        with self._lock:
+            self._pending[user_id] = timestamp
+            full = len(self._pending) >= self._max_size
+        user_cache.update(user_id, last_interacted=timestamp)
+        return full
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        params = []
+        for user_id, timestamp in pending.items():
+            params.extend((user_id, timestamp))
+        values = ', '.join(['(%s, %s::timestamp)'] * len(pending))
+        try:
+            db.execute_sql(f'UPDATE users SET last_interacted = v.last_interacted '
+                           f'FROM (VALUES {values}) AS v (id, last_interacted) '
+                           f'WHERE users.id = v.id', params)
+        except:
+            with self._lock:
+                for user_id, timestamp in pending.items():
+                    self._pending.setdefault(user_id, timestamp)
+            raise
+        return len(pending)
+
+
+interaction_buffer = InteractionBuffer(INTERACTIONS_FLUSH_SIZE)
+
+
+async def flush_interactions(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_db(interaction_buffer.flush)
+        except:
+            logger.error(traceback.format_exc())
+
+
+def _tonnage(reps) -> float:
+    return sum(rep.get('weight', 0) * rep.get('reps', 0) for rep in reps)
+
+
+def _duration(reps) -> float:
+    # time between the first and the last rep of a set, the rests within it
+    return reps[-1]['timestamp'] - reps[0]['timestamp'] if reps else 0
+
 
 class Training(_Model):
     class Meta:
@@ -186,6 +586,72 @@ class Training(_Model):
     user = ForeignKeyField(User)
     created = DateTimeField(default=peewee_datetime.datetime.now)
     end = DateTimeField(null=True)
+    # running totals of the logged reps, kept by add_reps
+    rep_count = IntegerField(default=0)
+    set_count = IntegerField(default=0)
+    tonnage = DoubleField(default=0)
+    rest_sum = DoubleField(default=0)
+    first_rep_at = DateTimeField(null=True)
+    last_rep_at = DateTimeField(null=True)
+    exercise_ids = ArrayField(IntegerField, default=list, index=False)  # in the order of their first set
+
+    @classmethod
+    def add_reps(cls, training_id, exercise_id, old_reps, new_reps) -> bool:
+        """
+        apply the change of one set's reps from old_reps to new_reps to the totals, with one UPDATE.
+        False if the training is finished (nothing is changed then)
+        """
+        if not new_reps:
+            return True
+        (cls
+         .update(rep_count=cls.rep_count + (len(new_reps) - len(old_reps)),
+                 set_count=cls.set_count + (0 if old_reps else 1),
+                 tonnage=cls.tonnage + (_tonnage(new_reps) - _tonnage(old_reps)),
+                 rest_sum=cls.rest_sum + (_duration(new_reps) - _duration(old_reps)),
+                 first_rep_at=fn.COALESCE(cls.first_rep_at, from_timestamp(new_reps[0]['timestamp'])),
+                 last_rep_at=from_timestamp(new_reps[-1]['timestamp']),
+                 exercise_ids=Case(None,
+                                   [(cls.exercise_ids.contains(exercise_id), cls.exercise_ids)],
+                                   fn.array_append(cls.exercise_ids, exercise_id)))
+         .where(cls.id == training_id,
+                cls.end.is_null())
+         .execute()) > 0
+
+    @classmethod
+    def recount(cls, training_id):
+        """
+        compute the totals again from the sets of the training
+        """
+        sets = []
+        exercise_ids = []
+        for tr_set in (Set
+                       .select(Set.exercise_id, Set.data)
+                       .where(Set.training == training_id)
+                       .order_by(Set.id)):
+            if tr_set.data:
+                sets.append(tr_set.data)
+                if tr_set.exercise_id not in exercise_ids:
+                    exercise_ids.append(tr_set.exercise_id)
+        timestamps = [rep['timestamp'] for reps in sets for rep in reps]
+        (cls
+         .update(rep_count=sum(len(reps) for reps in sets),
+                 set_count=len(sets),
+                 tonnage=sum(_tonnage(reps) for reps in sets),
+                 rest_sum=sum(_duration(reps) for reps in sets),
+                 first_rep_at=from_timestamp(min(timestamps)) if timestamps else None,
+                 last_rep_at=from_timestamp(max(timestamps)) if timestamps else None,
+                 exercise_ids=exercise_ids)
+         .where(cls.id == training_id)
+         .execute())
+
+
+# partial indexes of the hot queries, built by migrations 007 and 010
+Training.add_index(Training.index(Training.user, name='trainings_user_open')
+                   .where(Training.end.is_null()))
+Training.add_index(Training.index(Training.user, Training.id.desc(), name='trainings_user_finished')
+                   .where(Training.end.is_null(False)))
+Training.add_index(Training.index(fn.COALESCE(Training.last_rep_at, Training.created), name='trainings_open_activity')
+                   .where(Training.end.is_null()))
 
 
 class Set(_Model):
@@ -199,6 +665,302 @@ class Set(_Model):
     created = DateTimeField(default=peewee_datetime.datetime.now)
     end = DateTimeField(null=True)
 
+    @classmethod
+    def append_rep(cls, set_id, rep) -> typing.Union[None, int]:
+        """
+        push rep to data of an unfinished set with one UPDATE (data || rep),
+        returns the new number of reps or None if there is no such set
+        """
+        return cls._update_reps(set_id, cls.data.concat([rep]))
+
+    @classmethod
+    def replace_last_rep(cls, set_id, rep) -> typing.Union[None, int]:
+        """
+        replace the last rep of an unfinished set with one UPDATE (jsonb_set at -1),
+        returns the number of reps or None if there is no such set
+        """
+        return cls._update_reps(set_id, fn.jsonb_set(cls.data, SQL("'{-1}'"), cls.data.db_value(rep)))
+
+    @classmethod
+    def _update_reps(cls, set_id, data) -> typing.Union[None, int]:
+        rows = list(cls
+                    .update(data=data)
+                    .where(cls.id == set_id,
+                           cls.end.is_null())
+                    .returning(fn.jsonb_array_length(cls.data))
+                    .tuples()
+                    .execute())
+        return rows[0][0] if rows else None
+
+
+# partial index of the previous finished set query, built by migration 007
+Set.add_index(Set.index(Set.user, Set.exercise, Set.id.desc(), name='sets_user_exercise_finished')
+              .where(Set.end.is_null(False)))
+
+
+class MediaFile(_Model):
+    """
+    Telegram file_id of an uploaded file, keyed by the sha256 of its content
+    """
+    class Meta:
+        db_table = 'media_files'
+        indexes = (
+            (('content_hash', 'media_type'), True),
+        )
+
+    content_hash = CharField(max_length=64)
+    media_type = CharField(max_length=16)
+    path = CharField()
+    file_id = CharField()
+    file_unique_id = CharField()
+    created = DateTimeField(default=peewee_datetime.datetime.now)
+    updated = DateTimeField(default=peewee_datetime.datetime.now)
+
+
+class MediaVariant(_Model):
+    """
+    Telegram-optimized encode of a source video (Exercise.media path) with its thumbnail
+    """
+    class Meta:
+        db_table = 'media_variants'
+
+    source_path = CharField(unique=True)
+    source_hash = CharField(max_length=64)
+    path = CharField()
+    thumb_path = CharField(null=True)
+    width = IntegerField()
+    height = IntegerField()
+    duration = IntegerField()
+    size = IntegerField()
+    created = DateTimeField(default=peewee_datetime.datetime.now)
+
+
+class LastSet(_Model):
+    """
+    the latest finished set of every user and exercise,
+    written when a training ends (see record), read by primary key
+    """
+    class Meta:
+        db_table = 'last_sets'
+        primary_key = CompositeKey('user', 'exercise')
+
+    user = ForeignKeyField(User, index=False)
+    exercise = ForeignKeyField(Exercise, index=False)
+    set_id = IntegerField()
+    reps = BinaryJSONField(default=list, index=False)
+    finished_at = DateTimeField()
+
+    @classmethod
+    def record(cls, *where):
+        """
+        upsert the latest finished set per (user, exercise) among the sets matching where,
+        with one INSERT ... SELECT. Newer entries are never replaced by older sets.
+        Returns the set ids written
+        """
+        latest = (Set
+                  .select(Set.user, Set.exercise, Set.id, Set.data, Set.end)
+                  .where(Set.end.is_null(False), *where)
+                  .order_by(Set.user, Set.exercise, Set.id.desc())
+                  .distinct(Set.user, Set.exercise))
+        return (cls
+                .insert_from(latest, [cls.user, cls.exercise, cls.set_id, cls.reps, cls.finished_at])
+                .on_conflict(conflict_target=[cls.user, cls.exercise],
+                             update={cls.set_id: EXCLUDED.set_id,
+                                     cls.reps: EXCLUDED.reps,
+                                     cls.finished_at: EXCLUDED.finished_at},
+                             where=(cls.set_id < EXCLUDED.set_id))
+                .returning(cls.set_id)
+                .tuples()
+                .execute())
+
+    @classmethod
+    def reps_of(cls, user_id, exercise_id) -> typing.Union[None, list]:
+        last_set = (cls
+                    .select(cls.reps)
+                    .where(cls.user == user_id,
+                           cls.exercise == exercise_id)
+                    .first())
+        return last_set.reps if last_set is not None else None
+
+
+class TrainingSession:
+    """
+    what logging a rep needs about a user's active training:
+    the open training, the current exercise and set with its reps
+    and the reps of the previous finished set of that exercise
+    """
+    __slots__ = ('user_id', 'training_id', 'exercise_id', 'set_id', 'reps', 'previous_reps')
+
+    def __init__(self, user_id, training_id, exercise_id, set_id=None, reps=None, previous_reps=None):
+        self.user_id = user_id
+        self.training_id = training_id
+        self.exercise_id = exercise_id
+        self.set_id = set_id
+        self.reps = reps or []
+        self.previous_reps = previous_reps
+
+
+class TrainingSessions:
+    """
+    sessions of users logging sets, kept while they train.
+    Updates of a chat are processed one at a time (see lanes.py),
+    so a session is only used by one handler at a time.
+    Reps are written through, a session is dropped whenever its training or exercise changes
+    """
+
+    def __init__(self, maxsize, ttl):
+        self._sessions = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, user_id) -> typing.Union[None, TrainingSession]:
+        with self._lock:
+            return self._sessions.get(user_id)
+
+    def put(self, session: TrainingSession):
+        with self._lock:
+            self._sessions[session.user_id] = session
+
+    def drop(self, user_id):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def log_rep(self, session: TrainingSession, rep, replace_last=False) -> bool:
+        """
+        append rep to the session's set, or replace the last rep, with one statement
+        (Set.insert / Set.append_rep / Set.replace_last_rep) and update the training totals.
+        Returns False if the training or the set was finished meanwhile, e.g. by the sweeper
+        in another process (the session is dropped then and nothing is written)
+        """
+        replace_last = replace_last and bool(session.reps)
+        reps = list(session.reps)
+        if replace_last:
+            reps.pop()
+        reps.append(rep)
+        old_reps = session.reps if session.set_id is not None else []
+        try:
+            with db.atomic() as transaction:
+                # the training row goes first: it is locked in the order the sweeper locks
+                # (the training, then its sets) and a finished training is not written to
+                if not Training.add_reps(session.training_id, session.exercise_id, old_reps, reps):
+                    self.drop(session.user_id)
+                    return False
+                if session.set_id is None:
+                    session.set_id = Set.insert(user=session.user_id,
+                                                exercise=session.exercise_id,
+                                                training=session.training_id,
+                                                data=reps).execute()
+                else:
+                    if replace_last:
+                        length = Set.replace_last_rep(session.set_id, rep)
+                    else:
+                        length = Set.append_rep(session.set_id, rep)
+                    if length is None:
+                        transaction.rollback()
+                        self.drop(session.user_id)
+                        return False
+                    if length != len(reps):
+                        # the set was changed behind the session's back
+                        reps = Set.select(Set.data).where(Set.id == session.set_id).scalar()
+                        Training.recount(session.training_id)
+        except:
+            self.drop(session.user_id)
+            raise
+        session.reps = reps
+        return True
+
+
+training_sessions = TrainingSessions(TRAINING_SESSION_CACHE_SIZE, TRAINING_SESSION_TTL)
+
+
+def _finish_trainings(trainings: typing.List[Training]):
+    """
+    the part of ending trainings after their rows are closed, in bulk for all of them:
+    empty sets are deleted, the other sets get their end from the timestamp of their last rep,
+    last_sets is updated and next_program_trainings of the users is cleared
+    """
+    if not trainings:
+        return
+    training_ids = [training.id for training in trainings]
+    user_ids = [training.user_id for training in trainings]
+    for user_id in user_ids:
+        training_sessions.drop(user_id)
+    Set.delete().where(Set.training.in_(training_ids), fn.jsonb_array_length(Set.data) == 0).execute()
+    # to_timestamp gives timestamptz, timezone() turns it into the app's local time
+    # like datetime.fromtimestamp does, whatever the db session's TimeZone is
+    (Set
+     .update(end=fn.timezone(TZ, fn.to_timestamp(Set.data[-1]['timestamp'].as_json(False).cast('float'))))
+     .where(Set.training.in_(training_ids))
+     .execute())
+    LastSet.record(Set.training.in_(training_ids))
+    _clear_next_program_trainings(user_ids)
+
+
+def _clear_next_program_trainings(user_ids):
+    (User
+     .update(extra_data=fn.jsonb_set(User.extra_data, SQL("'{next_program_trainings}'"), SQL("'null'")))
+     .where(User.id.in_(user_ids))
+     .execute())
+    notify_users_changed(user_ids)
+
+
+def end_training(user: User) -> typing.Union[None, Training]:
+    """
+    close the user's open training with bulk statements in one transaction.
+    Returns the closed training with its totals, None when there is no open training
+    """
+    training_sessions.drop(user.id)
+    with db.atomic():
+        open_training = (Training
+                         .select(Training.id)
+                         .where(Training.user == user.id,
+                                Training.end.is_null())
+                         .limit(1))
+        # end IS NULL is checked again after a concurrent close (e.g. close_stale_trainings)
+        closed = list(Training
+                      .update(end=peewee_now())
+                      .where(Training.id == open_training,
+                             Training.end.is_null())
+                      .returning(Training)
+                      .execute())
+        if closed:
+            _finish_trainings(closed)
+        else:
+            _clear_next_program_trainings([user.id])
+    user.extra_data['next_program_trainings'] = None
+    user_cache.invalidate(user)
+    return closed[0] if closed else None
+
+
+def close_stale_trainings(idle: int, limit: int) -> typing.List[Training]:
+    """
+    end up to limit trainings without reps for idle seconds, oldest activity first.
+    Trainings are locked with SKIP LOCKED, so processes sweeping at the same time
+    close different trainings and every training is closed once.
+    A stale training ends at its last rep (or its start when it has none)
+    """
+    last_active = fn.COALESCE(Training.last_rep_at, Training.created)
+    with db.atomic():
+        stale = (Training
+                 .select(Training.id)
+                 .where(Training.end.is_null(),
+                        last_active < peewee_now() - peewee_datetime.timedelta(seconds=idle))
+                 .order_by(last_active)
+                 .limit(limit)
+                 .for_update('FOR UPDATE SKIP LOCKED'))
+        closed = list(Training
+                      .update(end=last_active)
+                      .where(Training.id.in_(stale),
+                             Training.end.is_null())
+                      .returning(Training)
+                      .execute())
+        _finish_trainings(closed)
+    user_cache.invalidate_ids([training.user_id for training in closed])
+    return closed
+
 
 CREATING_LIST = [
     MuscleGroup,
@@ -210,7 +972,10 @@ CREATING_LIST = [
     Subscription,
     User,
     Set,
-    Training
+    Training,
+    LastSet,
+    MediaFile,
+    MediaVariant
 ]
 
 
@@ -0,0 +1,266 @@
+import asyncio
+import hashlib
+import json
+import pickle
+import time
+import traceback
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+from peewee import (
+    Model,
+    BlobField,
+    CharField,
+    CompositeKey,
+    DateTimeField,
+    SqliteDatabase
+)
+from telegram.ext import BasePersistence, PersistenceInput
+
+from config import (
+    PERSISTENCE_BACKEND,
+    PERSISTENCE_SQLITE_PATH,
+    PERSISTENCE_TTL,
+    PERSISTENCE_UPDATE_INTERVAL
+)
+from constants import PersistenceBackends
+from models import db, peewee_now, run_db
+from utils import logger
+
+
+class PersistenceEntry(Model):
+    class Meta:
+        table_name = 'persistence'
+        primary_key = CompositeKey('kind', 'key')
+
+    kind = CharField()
+    key = CharField()
+    data = BlobField()
+    data_hash = CharField(max_length=32)
+    updated = DateTimeField(default=peewee_now, index=True)
+
+
+class EntryKinds:
+    Bot = 'bot'
+    Chat = 'chat'
+    User = 'user'
+    Conversation = 'conversation'
+
+
+class DBPersistence(BasePersistence):
+    """
+    persistence which keeps one row per chat/user/conversation in the database.
+    Only rows whose data changed since they were read or written are saved,
+    chat and user data is read on the first update of the chat/user, not on start,
+    rows nobody touched for ttl seconds are deleted by cleanup(), which also drops
+    the chats/users idle for ttl seconds from memory
+    """
+
+    def __init__(self,
+                 database=db,
+                 ttl: int = PERSISTENCE_TTL,
+                 update_interval: float = PERSISTENCE_UPDATE_INTERVAL,
+                 store_data: PersistenceInput = None):
+        super().__init__(store_data=store_data or PersistenceInput(callback_data=False),
+                         update_interval=update_interval)
+        self._database = database
+        PersistenceEntry.bind(database)
+        self._ttl = ttl
+        self._executor = None
+        if database is not db:
+            # a single thread owns the connection of an embedded database
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='persistence')
+        self._saved = {}
+        self._loaded = set()
+        # (kind, key) of chats/users -> monotonic time of their last refresh or save
+        self._touched = {}
+
+    async def _execute(self, func, *args):
+        if self._executor is None:
+            return await run_db(func, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args))
+
+    @staticmethod
+    def _dump(data) -> typing.Tuple[bytes, str]:
+        payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        return payload, hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    def _is_saved(self, kind, key, data_hash) -> bool:
+        saved = self._saved.get((kind, key))
+        if saved is None:
+            return False
+        saved_hash, saved_at = saved
+        # unchanged rows are still touched now and then so cleanup() does not take them for idle
+        return saved_hash == data_hash and time.monotonic() - saved_at < self._ttl / 2
+
+    def _select(self, kind, key):
+        entry = PersistenceEntry.get_or_none(kind=kind, key=key)
+        if entry is None:
+            return None
+        return bytes(entry.data), entry.data_hash
+
+    def _select_kind(self, kind):
+        return [(entry.key, bytes(entry.data), entry.data_hash)
+                for entry in PersistenceEntry.select().where(PersistenceEntry.kind == kind)]
+
+    def _upsert(self, kind, key, payload, data_hash):
+        (PersistenceEntry
+         .insert(kind=kind, key=key, data=payload, data_hash=data_hash, updated=peewee_now())
+         .on_conflict(conflict_target=[PersistenceEntry.kind, PersistenceEntry.key],
+                      update={PersistenceEntry.data: payload,
+                              PersistenceEntry.data_hash: data_hash,
+                              PersistenceEntry.updated: peewee_now()})
+         .execute())
+
+    def _delete(self, kind, key):
+        PersistenceEntry.delete().where(PersistenceEntry.kind == kind, PersistenceEntry.key == key).execute()
+
+    def _delete_expired(self):
+        deadline = peewee_now() - timedelta(seconds=self._ttl)
+        return (PersistenceEntry
+                .delete()
+                .where(PersistenceEntry.kind.in_([EntryKinds.Chat, EntryKinds.User]),
+                       PersistenceEntry.updated < deadline)
+                .execute())
+
+    async def _load(self, kind, key):
+        row = await self._execute(self._select, kind, key)
+        if row is None:
+            return None
+        payload, data_hash = row
+        self._saved[(kind, key)] = (data_hash, time.monotonic())
+        return pickle.loads(payload)
+
+    def _touch(self, kind, key):
+        if kind in (EntryKinds.Chat, EntryKinds.User):
+            self._touched[(kind, key)] = time.monotonic()
+
+    def _evict_idle(self, application=None) -> int:
+        """
+        forget chats/users nobody touched for ttl seconds: what is known about their rows
+        and, with application given, their chat_data/user_data
+        """
+        deadline = time.monotonic() - self._ttl
+        idle = [item for item, touched_at in self._touched.items() if touched_at < deadline]
+        for kind, key in idle:
+            del self._touched[(kind, key)]
+            self._saved.pop((kind, key), None)
+            self._loaded.discard((kind, key))
+            if application is not None:
+                # the private dicts: Application.drop_chat_data/drop_user_data would delete the rows too
+                data = application._chat_data if kind == EntryKinds.Chat else application._user_data
+                data.pop(int(key), None)
+        return len(idle)
+
+    async def _save(self, kind, key, data):
+        self._touch(kind, key)
+        payload, data_hash = self._dump(data)
+        if self._is_saved(kind, key, data_hash):
+            return
+        await self._execute(self._upsert, kind, key, payload, data_hash)
+        self._saved[(kind, key)] = (data_hash, time.monotonic())
+
+    async def _drop(self, kind, key):
+        self._saved.pop((kind, key), None)
+        self._loaded.discard((kind, key))
+        self._touched.pop((kind, key), None)
+        await self._execute(self._delete, kind, key)
+
+    async def _refresh(self, kind, key, data: dict):
+        self._touch(kind, key)
+        if (kind, key) in self._loaded:
+            return
+        stored = await self._load(kind, key)
+        if (kind, key) not in self._loaded:
+            self._loaded.add((kind, key))
+            if stored:
+                for name, value in stored.items():
+                    data.setdefault(name, value)
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return await self._load(EntryKinds.Bot, '') or {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        conversations = {}
+        for key, payload, _ in await self._execute(self._select_kind, f'{EntryKinds.Conversation}:{name}'):
+            conversations[tuple(json.loads(key))] = pickle.loads(payload)
+        return conversations
+
+    async def update_conversation(self, name: str, key: tuple, new_state: typing.Optional[object]) -> None:
+        kind = f'{EntryKinds.Conversation}:{name}'
+        key = json.dumps(key)
+        if new_state is None:
+            await self._drop(kind, key)
+        else:
+            await self._save(kind, key, new_state)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        await self._save(EntryKinds.User, str(user_id), data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        await self._save(EntryKinds.Chat, str(chat_id), data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        await self._save(EntryKinds.Bot, '', data)
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        await self._drop(EntryKinds.Chat, str(chat_id))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self._drop(EntryKinds.User, str(user_id))
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        await self._refresh(EntryKinds.User, str(user_id), user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        await self._refresh(EntryKinds.Chat, str(chat_id), chat_data)
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def cleanup(self, application=None) -> int:
+        evicted = self._evict_idle(application)
+        deleted = await self._execute(self._delete_expired)
+        if deleted or evicted:
+            logger.info(f'Persistence - deleted {deleted} idle entries, {evicted} dropped from memory')
+        return deleted
+
+    async def flush(self) -> None:
+        if self._executor is not None:
+            self._executor.submit(self._database.close).result()
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def get_persistence(backend: str = PERSISTENCE_BACKEND) -> DBPersistence:
+    if backend == PersistenceBackends.Postgres:
+        return DBPersistence(db)
+    if backend == PersistenceBackends.SQLite:
+        database = SqliteDatabase(PERSISTENCE_SQLITE_PATH, pragmas={'journal_mode': 'wal'})
+        PersistenceEntry.bind(database)
+        database.create_tables([PersistenceEntry], safe=True)
+        database.close()
+        return DBPersistence(database)
+    raise ValueError(f'Unknown persistence backend - {backend}')
+
+
+async def cleanup_persistence(application, interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await application.persistence.cleanup(application)
+        except:
+            logger.error(traceback.format_exc())
@@ -0,0 +1,84 @@
+import asyncio
+import traceback
+
+from cachetools import TTLCache
+from telegram import Bot
+from telegram.error import BadRequest, RetryAfter
+
+from config import RENDER_DELAY
+from utils import logger
+
+NOT_MODIFIED_ERROR = 'message is not modified'
+
+
+def _state(text, reply_markup) -> int:
+    return hash((text, reply_markup.to_json() if reply_markup is not None else None))
+
+
+class MessageRenders:
+    """
+    coalesced edits of messages re-rendered on every change, like the live set message.
+    An edit waits `delay` seconds and only the latest state of the message is sent,
+    a state equal to the one already shown is not sent at all.
+    RetryAfter postpones the edit by the time Telegram asks for
+    """
+
+    def __init__(self, delay, maxsize=10000, ttl=60 * 60):
+        self._delay = delay
+        self._pending = {}
+        self._tasks = {}
+        self._shown = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def edit(self, bot: Bot, chat_id, message_id, text, reply_markup=None, create_task=asyncio.create_task):
+        key = (chat_id, message_id)
+        self._pending[key] = (bot, text, reply_markup)
+        if key not in self._tasks:
+            self._tasks[key] = create_task(self._render(key))
+
+    def discard(self, chat_id, message_id):
+        """
+        forget the pending and the shown state of a message edited past the renderer
+        """
+        key = (chat_id, message_id)
+        self._pending.pop(key, None)
+        self._shown.pop(key, None)
+
+    async def _render(self, key):
+        chat_id, message_id = key
+        delay = self._delay
+        try:
+            while key in self._pending:
+                await asyncio.sleep(delay)
+                delay = self._delay
+                if key not in self._pending:
+                    break
+                bot, text, reply_markup = self._pending.pop(key)
+                state = _state(text, reply_markup)
+                if self._shown.get(key) == state:
+                    continue
+                try:
+                    await bot.edit_message_text(text=text,
+                                                chat_id=chat_id,
+                                                message_id=message_id,
+                                                reply_markup=reply_markup)
+                except RetryAfter as e:
+                    # a state that came in meanwhile is newer than this one
+                    self._pending.setdefault(key, (bot, text, reply_markup))
+                    delay = e.retry_after
+                    logger.info(f'Renders - edit of {key} postponed for {delay}s')
+                    continue
+                except BadRequest as e:
+                    if NOT_MODIFIED_ERROR not in e.message.lower():
+                        raise
+                self._shown[key] = state
+        except:
+            self._pending.pop(key, None)
+            logger.error(traceback.format_exc())
+        finally:
+            del self._tasks[key]
+
+    async def close(self):
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+
+message_renders = MessageRenders(RENDER_DELAY)
@@ -0,0 +1,58 @@
+import asyncio
+import typing
+
+from cachetools import TTLCache
+from telegram.error import RetryAfter
+
+from config import SEND_CHAT_INTERVAL, SEND_RATE
+from utils import logger
+
+
+class RateLimitedSender:
+    """
+    messages the bot sends on its own (not in reply to an update) go through here:
+    at most `rate` messages a second overall and one per `chat_interval` seconds to a chat,
+    so a batch of notifications stays under Telegram's flood limits.
+    RetryAfter pauses every send for the time Telegram asks for, then the message is sent again
+    """
+
+    def __init__(self, rate, chat_interval, attempts=3):
+        self._interval = 1 / rate
+        self._chat_interval = chat_interval
+        self._attempts = attempts
+        self._next_at = 0
+        self._chat_next_at = TTLCache(maxsize=100000, ttl=max(chat_interval, 1) * 60)
+
+    async def _wait(self, chat_id):
+        """
+        wait for the chat's next slot, then for the next overall one.
+        The overall slot is only booked when the chat is ready, so a busy chat doesn't hold others back
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        chat_at = max(now, self._chat_next_at.get(chat_id, 0))
+        self._chat_next_at[chat_id] = chat_at + self._chat_interval
+        await asyncio.sleep(chat_at - now)
+
+        now = loop.time()
+        at = max(now, self._next_at)
+        self._next_at = at + self._interval
+        await asyncio.sleep(at - now)
+
+    async def send(self, chat_id, send: typing.Callable[[], typing.Awaitable]):
+        """
+        await send (a coroutine function without arguments, e.g. a bot.send_message partial)
+        in the next free slot for chat_id
+        """
+        for attempt in range(self._attempts):
+            await self._wait(chat_id)
+            try:
+                return await send()
+            except RetryAfter as e:
+                if attempt == self._attempts - 1:
+                    raise
+                logger.info(f'Sender - flood limit, sends paused for {e.retry_after}s')
+                self._next_at = max(self._next_at, asyncio.get_running_loop().time() + e.retry_after)
+
+
+sender = RateLimitedSender(SEND_RATE, SEND_CHAT_INTERVAL)
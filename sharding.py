@@ -0,0 +1,172 @@
+"""
+Multi-process mode: one front process receives updates (polling or webhook, see
+APP_UPDATES_MODE), drops duplicates by update_id and hands every update to the worker
+owning its chat (chat_id % APP_SHARD_WORKERS). Workers run the usual handlers.
+
+Every worker reads its own queue, so updates of a chat reach one process in the order
+they were received. A dead worker is restarted on the same queue - the updates it
+had not taken yet wait there and the chats keep their worker.
+
+This scales a bot over the cores of one host, running it on several nodes is out of scope:
+Telegram hands a bot's updates to a single getUpdates consumer or a single webhook URL,
+so there is one front process per bot anyway, and its duplicate filter (a TTLCache by
+update_id) only has to live there. Workers are fed through multiprocessing queues and
+would need a network broker to run on other hosts. The state workers share - the database,
+user_cache invalidation over LISTEN/NOTIFY, the catalog - already works across hosts.
+
+Usage:
+    python sharding.py
+"""
+import asyncio
+import multiprocessing
+import signal
+import traceback
+from cachetools import TTLCache
+
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+from config import (
+    TOKEN,
+    SHARD_DEDUP_SIZE,
+    SHARD_DEDUP_TTL,
+    SHARD_STOP_TIMEOUT,
+    SHARD_SUPERVISE_INTERVAL,
+    SHARD_WORKERS,
+    UPDATE_QUEUE_SIZE,
+    UPDATES_MODE,
+    WEBHOOK
+)
+from constants import UpdateModes
+from main import build_application
+from utils import logger
+
+_mp = multiprocessing.get_context('spawn')
+
+
+def update_shard(update: Update, shards: int) -> int:
+    if update.effective_chat is not None:
+        key = update.effective_chat.id
+    elif update.effective_user is not None:
+        key = update.effective_user.id
+    else:
+        key = 0
+    return key % shards
+
+
+async def _work(queue):
+    application = build_application(updater=False)
+    loop = asyncio.get_running_loop()
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        # stop() drops updates still in the queue
+        await application.update_queue.join()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+def run_worker(shard, queue):
+    # the front process decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logger.info(f'Shard {shard} - worker started')
+    asyncio.run(_work(queue))
+    logger.info(f'Shard {shard} - worker stopped')
+
+
+class ShardedFront:
+    def __init__(self, shards: int = SHARD_WORKERS):
+        self.shards = shards
+        self.queues = [_mp.Queue() for _ in range(shards)]
+        self.workers = [None] * shards
+        self._seen = TTLCache(maxsize=SHARD_DEDUP_SIZE, ttl=SHARD_DEDUP_TTL)
+        self._stopping = False
+
+    def start_worker(self, shard):
+        worker = _mp.Process(target=run_worker,
+                             args=(shard, self.queues[shard]),
+                             name=f'shard-{shard}')
+        worker.start()
+        self.workers[shard] = worker
+
+    def is_duplicate(self, update: Update) -> bool:
+        if update.update_id in self._seen:
+            return True
+        self._seen[update.update_id] = True
+        return False
+
+    def dispatch(self, update: Update):
+        if self.is_duplicate(update):
+            logger.info(f'Duplicate update {update.update_id} dropped')
+            return
+        self.queues[update_shard(update, self.shards)].put(update.to_dict())
+
+    async def consume(self, update_queue: asyncio.Queue):
+        while True:
+            update = await update_queue.get()
+            try:
+                self.dispatch(update)
+            except:
+                logger.error(traceback.format_exc())
+            finally:
+                update_queue.task_done()
+
+    async def supervise(self, interval=SHARD_SUPERVISE_INTERVAL):
+        while not self._stopping:
+            await asyncio.sleep(interval)
+            for shard, worker in enumerate(self.workers):
+                if not self._stopping and not worker.is_alive():
+                    logger.error(f'Shard {shard} - worker exited with {worker.exitcode}, restarting')
+                    self.start_worker(shard)
+
+    async def stop_workers(self, timeout=SHARD_STOP_TIMEOUT):
+        self._stopping = True
+        for queue in self.queues:
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        for shard, worker in enumerate(self.workers):
+            await loop.run_in_executor(None, worker.join, timeout)
+            if worker.is_alive():
+                logger.error(f'Shard {shard} - worker did not stop in {timeout}s, killing')
+                worker.kill()
+
+    async def run(self):
+        for shard in range(self.shards):
+            self.start_worker(shard)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        update_queue = asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE)
+        updater = Updater(bot=Bot(TOKEN), update_queue=update_queue)
+        async with updater:
+            if UPDATES_MODE == UpdateModes.Webhook:
+                await updater.start_webhook(allowed_updates=Update.ALL_TYPES, **WEBHOOK)
+            else:
+                await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            tasks = [asyncio.create_task(self.consume(update_queue)),
+                     asyncio.create_task(self.supervise())]
+
+            await stop.wait()
+            await updater.stop()
+            await update_queue.join()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await self.stop_workers()
+
+
+if __name__ == '__main__':
+    asyncio.run(ShardedFront().run())
@@ -0,0 +1,85 @@
+import asyncio
+
+from telegram import Chat, Message, Update
+from telegram.ext import Application, TypeHandler
+
+from lanes import ChatLanes, LanedApplication
+
+
+def _update(update_id, chat_id):
+    return Update(update_id, message=Message(update_id, None, Chat(chat_id, Chat.PRIVATE)))
+
+
+async def _application(concurrency, max_lane_depth):
+    application = (Application.builder()
+                   .application_class(LanedApplication, kwargs=dict(max_lane_depth=max_lane_depth))
+                   .token('1:test')
+                   .concurrent_updates(concurrency)
+                   .build())
+    # no get_me call, the bot never talks to Telegram here
+    application.bot._initialized = True
+    await application.initialize()
+    return application
+
+
+def test_jobs_of_a_lane_run_in_order():
+    async def run():
+        lanes = ChatLanes(concurrency=2, max_depth=10)
+        order = []
+
+        async def job(name):
+            await asyncio.sleep(0.01)
+            order.append(name)
+
+        assert lanes.submit(1, lambda: job('first'))
+        assert lanes.submit(1, lambda: job('second'))
+        while lanes.depth(1):
+            await asyncio.sleep(0.01)
+        assert order == ['first', 'second']
+        assert lanes.stats()['lanes'] == 0
+
+    asyncio.run(run())
+
+
+def test_other_chats_are_handled_while_a_lane_is_full():
+    async def run():
+        concurrency, max_lane_depth = 2, 3
+        application = await _application(concurrency, max_lane_depth)
+        release = asyncio.Event()
+        handled = []
+
+        async def handler(update, context):
+            if update.effective_chat.id == 1:
+                await release.wait()
+            handled.append((update.effective_chat.id, update.update_id))
+
+        application.add_handler(TypeHandler(Update, handler, block=True))
+        await application.start()
+        try:
+            # chat 1 floods: its lane fills up, the rest of its updates is dropped
+            for update_id in range(10):
+                await application.update_queue.put(_update(update_id, chat_id=1))
+            await application.update_queue.put(_update(100, chat_id=2))
+            await asyncio.wait_for(application.update_queue.join(), timeout=5)
+            for _ in range(100):
+                if (2, 100) in handled:
+                    break
+                await asyncio.sleep(0.01)
+
+            # only running jobs take a concurrent_updates slot, so chat 2 wasn't held back
+            assert handled == [(2, 100)]
+            assert application.lanes.depth(1) == max_lane_depth
+            assert application.lanes.stats()['dropped'] == 10 - max_lane_depth
+
+            release.set()
+            for _ in range(100):
+                if not application.lanes.depth(1):
+                    break
+                await asyncio.sleep(0.01)
+            assert handled[1:] == [(1, update_id) for update_id in range(max_lane_depth)]
+        finally:
+            release.set()
+            await application.stop()
+            await application.shutdown()
+
+    asyncio.run(run())
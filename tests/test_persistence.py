@@ -0,0 +1,65 @@
+import asyncio
+
+from peewee import SqliteDatabase
+from telegram.ext import Application
+
+import persistence
+from persistence import DBPersistence, EntryKinds, PersistenceEntry
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _persistence(tmp_path, ttl):
+    database = SqliteDatabase(str(tmp_path / 'persistence.sqlite'))
+    PersistenceEntry.bind(database)
+    database.create_tables([PersistenceEntry], safe=True)
+    return DBPersistence(database, ttl=ttl, update_interval=60)
+
+
+def test_cleanup_evicts_idle_chats_and_users_from_memory(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(persistence.time, 'monotonic', clock)
+    ttl = 100
+
+    async def run():
+        store = _persistence(tmp_path, ttl)
+        application = Application.builder().token('1:test').persistence(store).build()
+        try:
+            for chat_id in (1, 2):
+                await store.refresh_chat_data(chat_id, application._chat_data[chat_id])
+                application._chat_data[chat_id]['step'] = chat_id
+                await store.update_chat_data(chat_id, application._chat_data[chat_id])
+            await store.refresh_user_data(1, application._user_data[1])
+            await store.update_user_data(1, {'lang': 'en'})
+            application._user_data[1]['lang'] = 'en'
+
+            clock.now += ttl / 2
+            await store.refresh_chat_data(2, application._chat_data[2])
+            clock.now += ttl / 2 + 1
+
+            await store.cleanup(application)
+
+            # chat 1 and user 1 were idle for ttl, chat 2 was active half a ttl ago
+            assert 1 not in application.chat_data
+            assert 1 not in application.user_data
+            assert application.chat_data[2] == {'step': 2}
+            assert (EntryKinds.Chat, '1') not in store._loaded
+            assert (EntryKinds.Chat, '1') not in store._saved
+            assert (EntryKinds.User, '1') not in store._saved
+            assert (EntryKinds.Chat, '2') in store._loaded
+            assert set(store._touched) == {(EntryKinds.Chat, '2')}
+
+            # an evicted chat is read from the database again on its next update
+            chat_data = {}
+            await store.refresh_chat_data(1, chat_data)
+            assert chat_data == {'step': 1}
+        finally:
+            await store.flush()
+
+    asyncio.run(run())
@@ -0,0 +1,189 @@
+"""
+Encode the exercise videos (Exercise.media, every gender) into Telegram-friendly variants:
+H.264/AAC mp4 with the longer side capped, a capped bitrate and the moov atom up front
+(faststart), so Telegram clients start playing before the download is complete.
+A JPEG thumbnail is taken from every video.
+
+Variants are written to static/variants/ and recorded in media_variants with their
+dimensions and duration, the bot sends them instead of the sources (see media.MediaRegistry).
+Sources whose content hash did not change since their variant was made are skipped.
+
+Usage:
+    python transcode_media.py [--max-side 1280] [--crf 26] [--max-rate 1500k] [--jobs 2] [--force]
+"""
+import argparse
+import json
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from config import FFMPEG, FFPROBE, MAIN_PATH
+from media import content_hashes
+from models import db, Exercise, MediaVariant
+
+VARIANTS_PATH = 'static/variants/'
+THUMB_SIDE = 320  # Telegram's limit for thumbnails
+
+
+def probe(path) -> dict:
+    output = subprocess.run([FFPROBE, '-v', 'error',
+                             '-select_streams', 'v:0',
+                             '-show_entries', 'stream=width,height:format=duration',
+                             '-of', 'json',
+                             path],
+                            check=True, capture_output=True, text=True).stdout
+    info = json.loads(output)
+    stream = info['streams'][0]
+    return dict(width=int(stream['width']),
+                height=int(stream['height']),
+                duration=round(float(info['format'].get('duration', 0))))
+
+
+def encode(source, target, max_side, crf, max_rate):
+    scale = (f"scale='min(iw,{max_side})':'min(ih,{max_side})'"
+             f":force_original_aspect_ratio=decrease:force_divisible_by=2")
+    subprocess.run([FFMPEG, '-y', '-v', 'error',
+                    '-i', source,
+                    '-vf', scale,
+                    '-c:v', 'libx264', '-preset', 'slow', '-crf', str(crf),
+                    '-maxrate', max_rate, '-bufsize', max_rate,
+                    '-profile:v', 'high', '-pix_fmt', 'yuv420p',
+                    '-c:a', 'aac', '-b:a', '96k',
+                    '-movflags', '+faststart',
+                    target],
+                   check=True)
+
+
+def thumbnail(source, target, duration):
+    subprocess.run([FFMPEG, '-y', '-v', 'error',
+                    '-ss', str(min(1, duration / 2)),
+                    '-i', source,
+                    '-frames:v', '1',
+                    '-vf', f'scale={THUMB_SIDE}:{THUMB_SIDE}:force_original_aspect_ratio=decrease',
+                    '-q:v', '4',
+                    target],
+                   check=True)
+
+
+def _lock(source_hash):
+    """
+    sources with the same content share their variant files: jobs (also of other runs) putting files
+    of one hash in place, recording or removing them take this lock in their transaction
+    """
+    db.execute_sql('SELECT pg_advisory_xact_lock(hashtext(%s))', (source_hash,))
+
+
+def _temp_path(path) -> str:
+    # next to the target, so os.replace is an atomic rename. ffmpeg picks the format by the suffix
+    stem, suffix = os.path.splitext(path)
+    return f'{MAIN_PATH}{stem}.{os.getpid()}-{threading.get_ident()}.tmp{suffix}'
+
+
+def _remove(path):
+    in_use = (MediaVariant
+              .select()
+              .where((MediaVariant.path == path) | (MediaVariant.thumb_path == path))
+              .exists())
+    if path and not in_use and os.path.exists(MAIN_PATH + path):
+        os.remove(MAIN_PATH + path)
+
+
+def _remove_variant(variant):
+    with db.atomic():
+        _lock(variant.source_hash)
+        _remove(variant.path)
+        _remove(variant.thumb_path)
+
+
+def transcode(source_path, args) -> str:
+    source = MAIN_PATH + source_path
+    if not os.path.exists(source):
+        return 'missing'
+    source_hash = content_hashes.get(source)
+    variant = MediaVariant.get_or_none(MediaVariant.source_path == source_path)
+    if (not args.force
+            and variant is not None
+            and variant.source_hash == source_hash
+            and os.path.exists(MAIN_PATH + variant.path)):
+        return 'unchanged'
+
+    path = f'{VARIANTS_PATH}{source_hash[:32]}.mp4'
+    thumb_path = f'{VARIANTS_PATH}{source_hash[:32]}.jpg'
+    # encoded aside and renamed into place, so no one sees (or sends) a half-written file
+    temp_path, temp_thumb_path = _temp_path(path), _temp_path(thumb_path)
+    try:
+        encode(source, temp_path, args.max_side, args.crf, args.max_rate)
+        metadata = probe(temp_path)
+        thumbnail(temp_path, temp_thumb_path, metadata['duration'])
+
+        with db.atomic():
+            _lock(source_hash)
+            os.replace(temp_path, MAIN_PATH + path)
+            os.replace(temp_thumb_path, MAIN_PATH + thumb_path)
+            (MediaVariant
+             .insert(source_path=source_path,
+                     source_hash=source_hash,
+                     path=path,
+                     thumb_path=thumb_path,
+                     size=os.path.getsize(MAIN_PATH + path),
+                     created=datetime.now(),
+                     **metadata)
+             .on_conflict(conflict_target=[MediaVariant.source_path],
+                          preserve=[MediaVariant.source_hash,
+                                    MediaVariant.path,
+                                    MediaVariant.thumb_path,
+                                    MediaVariant.width,
+                                    MediaVariant.height,
+                                    MediaVariant.duration,
+                                    MediaVariant.size,
+                                    MediaVariant.created])
+             .execute())
+    finally:
+        for temp in (temp_path, temp_thumb_path):
+            if os.path.exists(temp):
+                os.remove(temp)
+    if variant is not None and variant.path != path:
+        _remove_variant(variant)
+    return 'transcoded'
+
+
+def safe_transcode(source_path, args) -> str:
+    try:
+        return transcode(source_path, args)
+    except subprocess.CalledProcessError as e:
+        print(f'{source_path}: {e.cmd[0]} exited with {e.returncode} {e.stderr or ""}')
+        return 'failed'
+
+
+def source_paths() -> list:
+    paths = set()
+    for exercise in Exercise.select(Exercise.media):
+        for gender_paths in exercise.media.values():
+            if gender_paths:
+                paths.add(gender_paths[0])
+    return sorted(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-side', type=int, default=1280, help='longer side of the variants, px')
+    parser.add_argument('--crf', type=int, default=26)
+    parser.add_argument('--max-rate', default='1500k', help='video bitrate cap')
+    parser.add_argument('--jobs', type=int, default=2, help='ffmpeg processes at a time')
+    parser.add_argument('--force', action='store_true', help='transcode unchanged sources again')
+    args = parser.parse_args()
+
+    os.makedirs(MAIN_PATH + VARIANTS_PATH, exist_ok=True)
+    paths = source_paths()
+    results = {}
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        for path, result in zip(paths, executor.map(lambda p: safe_transcode(p, args), paths)):
+            print(f'{result}: {path}')
+            results[result] = results.get(result, 0) + 1
+    print(', '.join(f'{count} {result}' for result, count in results.items()) or 'no videos')
+
+
+if __name__ == '__main__':
+    main()
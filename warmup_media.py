@@ -0,0 +1,61 @@
+"""
+Upload every static asset and exercise video that has no file_id yet to a storage chat,
+so users never wait for the first upload. Run it on deploy, after the static files are in place.
+
+Usage:
+    python warmup_media.py [--chat-id ...] [--force]
+"""
+import argparse
+import asyncio
+import os
+
+from telegram import Bot
+from telegram.error import RetryAfter
+
+from config import TOKEN, MEDIA_STORAGE_CHAT_ID
+from media import content_hashes, file_ids, registry
+from models import run_db
+
+
+async def _upload(bot, asset, chat_id):
+    while True:
+        try:
+            return await registry.send(bot, asset.path, chat_id=chat_id, disable_notification=True)
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+
+
+async def warmup(chat_id, force=False):
+    uploaded = skipped = missing = 0
+    async with Bot(TOKEN) as bot:
+        for asset in await run_db(registry.assets):
+            media_type, path, _ = registry.resolve(asset.path)
+            if not os.path.exists(path):
+                print(f'missing: {path}')
+                missing += 1
+                continue
+            content_hash = content_hashes.get(path)
+            if force:
+                await run_db(file_ids.forget, content_hash, media_type)
+            elif await run_db(file_ids.load, content_hash, media_type) is not None:
+                skipped += 1
+                continue
+            message = await _upload(bot, asset, chat_id)
+            await message.delete()
+            uploaded += 1
+            print(f'uploaded: {asset.path}')
+    print(f'{uploaded} uploaded, {skipped} already known, {missing} missing')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chat-id', type=int, default=MEDIA_STORAGE_CHAT_ID)
+    parser.add_argument('--force', action='store_true', help='upload files with a known file_id again')
+    args = parser.parse_args()
+    if not args.chat_id:
+        parser.error('set APP_MEDIA_STORAGE_CHAT_ID or pass --chat-id')
+    asyncio.run(warmup(args.chat_id, args.force))
+
+
+if __name__ == '__main__':
+    main()